@@ -0,0 +1,277 @@
+# Archive of reports kept compressed in a few large pack files
+#
+# Years of daily reports for many vendors add up to hundreds of thousands of small files, which
+# are slow to list, back up and scan (especially on network file systems). An Archive appends
+# reports to pack files instead, gzipped just as App Store Connect sends them, and starts a new
+# pack file once the current one has grown to max_pack_size. An index (one JSON object per line,
+# appended like the manifest of a report cache) maps the query which retrieves a report (and so
+# identifies its vendor, type, date type, date and version) to the pack file, offset and length
+# of its data, along with the SHA-256 checksum of the (unzipped) report and whether it was final.
+#
+# Reports are read through a memory map of their pack file and unzipped on the fly, so they can
+# be handed to the parsers (reports.parse, columns.load, Warehouse.ingest) without being unpacked:
+#
+#     with Archive('/var/reports') as archive:
+#         for record in reports.parse(archive.open('Sales.getReport, 85442109,Sales,Summary,Daily,20230718'), 'Sales'):
+#             print(record.sku, record.units)
+#
+# Reports which are replaced or removed leave their data behind in the pack files until the
+# archive is compacted.
+
+import os, io, mmap, zlib, hashlib, datetime, threading
+import cache, client
+
+INDEX = 'index.jsonl'
+
+# pack files are read and written in pieces of this size
+CHUNK_SIZE = 64 * 1024
+
+def pack_name(number):
+    return 'pack-%06d.pack' % number
+
+def pack_number(name):
+    """Return the number of a pack file given its name, or None if it isn't one"""
+
+    if name.startswith('pack-') and name.endswith('.pack') and name[5:-5].isdigit():
+        return int(name[5:-5])
+    return None
+
+class PackMap(mmap.mmap):
+    """Read-only memory map of a pack file"""
+
+    def __new__(cls, directory, number):
+        with open(os.path.join(directory, pack_name(number)), 'rb') as file:
+            data = super().__new__(cls, file.fileno(), 0, access=mmap.ACCESS_READ)
+        data.pack = number
+        return data
+
+class Reader(io.RawIOBase):
+    """Read a report from a memory mapped pack file, unzipping it on the fly if it is stored compressed"""
+
+    def __init__(self, data, offset, length, compressed):
+        self._data = data
+        self._position = offset
+        self._end = offset + length
+        self._inflater = client.Inflater() if compressed else None
+        self._pending = b''
+        self._offset = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self._offset >= len(self._pending):
+            if self._position >= self._end:
+                return 0
+            chunk = self._data[self._position:min(self._position + CHUNK_SIZE, self._end)]
+            self._position += len(chunk)
+            self._pending, self._offset = self._inflate(chunk) if self._inflater else chunk, 0
+
+        size = min(len(buffer), len(self._pending) - self._offset)
+        buffer[:size] = self._pending[self._offset:self._offset + size]
+        self._offset += size
+        return size
+
+    def _inflate(self, chunk):
+        pieces = list(self._inflater.inflate(chunk))
+        if self._position >= self._end:
+            pieces.append(self._inflater.flush())
+        return b''.join(pieces)
+
+class Writer:
+    """File-like destination collecting the data of a report, which is appended to the archive when the with block ends
+
+    The data is kept in memory until then (compressed, unless the report is stored as is), so that concurrent downloads
+    don't have to wait for each other. Nothing is added to the archive if the with block ends with an error. The checksum
+    is computed from the unzipped report, so that it is the same as that of the report file (see cache.checksum).
+    """
+
+    def __init__(self, archive, key, filename, compressed, end):
+        self.archive = archive
+        self.key = key
+        self.filename = filename
+        self.compressed = compressed
+        self.end = end
+        self.entry = None
+        self._buffer = io.BytesIO()
+        self._sha256 = hashlib.sha256()
+        self._inflater = client.Inflater() if compressed else None
+
+    def __enter__(self):
+        return self
+
+    def write(self, data):
+        if self._inflater:
+            for piece in self._inflater.inflate(data):
+                self._sha256.update(piece)
+        else:
+            self._sha256.update(data)
+        return self._buffer.write(data)
+
+    def flush(self):
+        pass
+
+    def __exit__(self, type, value, traceback):
+        try:
+            if type is None:
+                if self._inflater:
+                    self._sha256.update(self._inflater.flush())
+                self.entry = self.archive._append(self.key, self._buffer.getbuffer(), self._sha256.hexdigest(), self.filename, self.compressed, self.end)
+        finally:
+            self._buffer = None
+
+class Archive:
+    """Pack files of compressed reports along with an index of where each report is stored
+
+    An archive can be shared by multiple threads, but only one process should write to it at a time.
+    """
+
+    def __init__(self, directory, final_after = 3, max_pack_size = 256 * 1024 * 1024):
+        self.directory = directory
+        self.final_after = datetime.timedelta(days=final_after)
+        self.max_pack_size = max_pack_size
+        self._lock = threading.Lock()
+        self._maps = {}
+
+        os.makedirs(directory, exist_ok=True)
+        self._index = os.path.join(directory, INDEX)
+        self._entries = cache.read_journal(self._index)
+        self._pack = max(filter(None, map(pack_number, os.listdir(directory))), default=1)
+
+    def close(self):
+        with self._lock:
+            maps, self._maps = self._maps, {}
+        for data in maps.values():
+            data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def lookup(self, key):
+        """Return the index entry of an archived report, or None"""
+
+        with self._lock:
+            return self._entries.get(key)
+
+    def entries(self):
+        """Return the index entries of all archived reports"""
+
+        with self._lock:
+            return list(self._entries.values())
+
+    def writer(self, key, filename, compressed = True, end = None):
+        """Return a file-like destination for a report to be archived under key (use it in a with block)
+
+        If compressed, the data written is gzipped and will be unzipped when reading the report. A report counts as
+        final if the period it covers had ended long enough before archiving it (or if its period is unknown).
+        """
+
+        return Writer(self, key, filename, compressed, end)
+
+    def add(self, key, filename, end = None):
+        """Compress a report file into the archive, e.g. one of a report cache"""
+
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        with open(filename, 'rb') as file, self.writer(key, os.path.basename(filename), True, end) as writer:
+            for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+                writer.write(compressor.compress(chunk))
+            writer.write(compressor.flush())
+        return writer.entry
+
+    def _append(self, key, data, sha256, filename, compressed, end):
+        now = datetime.datetime.now()
+        entry = dict(key=key, pack=None, offset=None, length=len(data), sha256=sha256, filename=filename, compressed=compressed,
+                     fetched=now.isoformat(timespec='seconds'), final=end is None or end + self.final_after <= now.date())
+        with self._lock:
+            path = os.path.join(self.directory, pack_name(self._pack))
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size and size + len(data) > self.max_pack_size:
+                self._pack, size = self._pack + 1, 0
+                path = os.path.join(self.directory, pack_name(self._pack))
+            with open(path, 'ab') as file:
+                file.write(data)
+            entry.update(pack=self._pack, offset=size)
+            # the index is only appended to once the data is in place, so it never points to a partial report
+            cache.append_journal(self._index, entry)
+            self._entries[key] = entry
+        return entry
+
+    def remove(self, key):
+        """Forget about an archived report (its data is left behind until the archive is compacted)"""
+
+        with self._lock:
+            if self._entries.pop(key, None):
+                cache.append_journal(self._index, dict(key=key, removed=True))
+
+    def _map(self, entry):
+        """Return a memory map of the pack file holding an entry, mapping the file again if it has grown since"""
+
+        with self._lock:
+            data = self._maps.get(entry['pack'])
+            if data is None or len(data) < entry['offset'] + entry['length']:
+                # a previous map which is still being read from is closed once the reader is done with it
+                data = self._maps[entry['pack']] = PackMap(self.directory, entry['pack'])
+            return data
+
+    def open(self, key):
+        """Open an archived report for reading (in binary mode), unzipping it on the fly"""
+
+        entry = self.lookup(key)
+        if entry is None:
+            raise ValueError("Error: The report '%s' is not in the archive" % key)
+        data = self._map(entry) if entry['length'] else b''
+        return io.BufferedReader(Reader(data, entry['offset'], entry['length'], entry['compressed']), CHUNK_SIZE)
+
+    def read(self, key):
+        """Return the content of an archived report"""
+
+        with self.open(key) as file:
+            return file.read()
+
+    def compact(self):
+        """Copy the data of all current reports into new pack files and delete the old ones along with what they hold besides
+
+        Returns the number of bytes freed. Reports must not be read or written while compacting.
+        """
+
+        with self._lock:
+            packs = sorted(filter(None, map(pack_number, os.listdir(self.directory))))
+            before = sum(os.path.getsize(os.path.join(self.directory, pack_name(number))) for number in packs)
+            self._maps = {}
+            self._pack = (packs[-1] if packs else 0) + 1
+
+            entries = {}
+            size = 0
+            output = None
+            data = None
+            try:
+                for entry in sorted(self._entries.values(), key=lambda entry: (entry['pack'], entry['offset'])):
+                    if output and size and size + entry['length'] > self.max_pack_size:
+                        output.close()
+                        output, size, self._pack = None, 0, self._pack + 1
+                    if output is None:
+                        output = open(os.path.join(self.directory, pack_name(self._pack)), 'wb')
+                    if entry['length'] and (data is None or data.pack != entry['pack']):
+                        if data:
+                            data.close()
+                        data = PackMap(self.directory, entry['pack'])
+                    if entry['length']:
+                        output.write(data[entry['offset']:entry['offset'] + entry['length']])
+                    entries[entry['key']] = dict(entry, pack=self._pack, offset=size)
+                    size += entry['length']
+            finally:
+                if output:
+                    output.close()
+                if data:
+                    data.close()
+
+            cache.write_journal(self._index, entries.values())
+            self._entries = entries
+
+            for number in packs:
+                os.remove(os.path.join(self.directory, pack_name(number)))
+            after = sum(entry['length'] for entry in entries.values())
+        return before - after
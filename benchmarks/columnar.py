@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Compare adding up a large synthetic sales report record by record with the columnar Table
+#
+#     python3 benchmarks/columnar.py --rows 2000000
+
+import sys, os, time, random, argparse, tempfile, collections
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import reports, columns
+
+HEADER = ['Provider', 'Provider Country', 'SKU', 'Developer', 'Title', 'Version', 'Product Type Identifier', 'Units',
+          'Developer Proceeds', 'Begin Date', 'End Date', 'Customer Currency', 'Country Code', 'Currency of Proceeds',
+          'Apple Identifier', 'Customer Price']
+
+KEYS = ['SKU', 'Country Code']
+SUMS = ['Units', 'Developer Proceeds']
+
+def write_report(filename, rows, skus, seed = 1):
+    """Write a sales report with the given number of rows spread over a year, many SKUs and all countries"""
+
+    random.seed(seed)
+    countries = ['%c%c' % (65 + i // 26, 65 + i % 26) for i in range(175)]
+    dates = ['%02d/%02d/2023' % (month, day) for month in range(1, 13) for day in range(1, 29)]
+    with open(filename, 'w', encoding='utf-8', newline='') as file:
+        file.write('\t'.join(HEADER) + '\n')
+        for _ in range(rows):
+            date = random.choice(dates)
+            sku = 'sku%d' % random.randrange(skus)
+            file.write('APPLE\tUS\t%s\tDeveloper\tTitle of %s\t1.0\t1F\t%d\t%.2f\t%s\t%s\tUSD\t%s\tUSD\t%d\t%.2f\n' % (
+                sku, sku, random.randint(-1, 20), random.randrange(1, 5000) / 100, date, date,
+                random.choice(countries), 100000 + int(sku[3:]), random.randrange(99, 9999) / 100))
+
+def row_wise(filename):
+    totals = collections.defaultdict(lambda: [0, 0])
+    with open(filename, 'rb') as file:
+        for record in reports.parse(file, 'Sales', columns=KEYS + SUMS):
+            sums = totals[(record.sku, record.country_code)]
+            sums[0] += record.units
+            sums[1] += record.developer_proceeds
+    return {key: (units, float(proceeds)) for key, (units, proceeds) in totals.items()}
+
+def columnar(filename):
+    started = time.perf_counter()
+    table = columns.load(filename, 'Sales', columns=KEYS + SUMS)
+    loaded = time.perf_counter()
+    totals = table.group_by(KEYS, SUMS)
+    return {(sku, country): (units, proceeds) for sku, country, units, proceeds in totals.rows()}, loaded - started
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the columnar aggregation of sales reports against the row-wise path")
+    parser.add_argument('--rows', type=int, default=2000000, help="number of rows of the synthetic report (defaults to %(default)s)")
+    parser.add_argument('--skus', type=int, default=500, help="number of distinct SKUs (defaults to %(default)s)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'S_Y_85442109_2023.txt')
+        write_report(filename, args.rows, args.skus)
+        print("{0} rows, {1:.1f} MB, aggregation by {2}, {3}".format(args.rows, os.path.getsize(filename) / 1024 / 1024,
+              ' and '.join(KEYS), 'NumPy ' + columns.numpy.__version__ if columns.numpy else 'array module (NumPy is not installed)'))
+
+        started = time.perf_counter()
+        expected = row_wise(filename)
+        row_wise_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        result, load_time = columnar(filename)
+        columnar_time = time.perf_counter() - started
+
+    mismatches = [key for key in expected if key not in result or expected[key][0] != result[key][0] or abs(expected[key][1] - result[key][1]) > 0.005]
+    print("row-wise:  {0:7.2f} s".format(row_wise_time))
+    print("columnar:  {0:7.2f} s (loading {1:.2f} s, group_by {2:.2f} s), {3:.1f}x faster".format(
+          columnar_time, load_time, columnar_time - load_time, row_wise_time / columnar_time))
+    print("{0} groups, {1}".format(len(expected), "results match" if not mismatches and len(result) == len(expected) else "%d results differ" % len(mismatches)))
+
+if __name__ == '__main__':
+    main()
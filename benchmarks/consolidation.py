@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Compare consolidating the financial reports of a fiscal period record by record with the columnar path
+#
+#     python3 benchmarks/consolidation.py --regions 40 --rows 50000
+
+import sys, os, json, time, random, argparse, tempfile, collections
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import reports, columns, consolidate
+
+HEADER = ['Start Date', 'End Date', 'UPC', 'ISRC/ISBN', 'Vendor Identifier', 'Quantity', 'Partner Share',
+          'Extended Partner Share', 'Partner Share Currency', 'Sales or Return', 'Apple Identifier',
+          'Artist/Show/Developer/Author', 'Title', 'Label/Studio/Network/Developer/Publisher', 'Grid',
+          'Product Type Identifier', 'ISAN/Other Identifier', 'Country Of Sale', 'Pre-order Flag', 'Promo Code',
+          'Customer Price', 'Customer Currency']
+
+VENDORS = [85442109, 85442110]
+
+def write_period(directory, regions, rows, products, seed = 1):
+    """Write the financial reports of every vendor and region, each in its own currency, along with an index like getAllFinancialReports"""
+
+    random.seed(seed)
+    codes = ['%c%c' % (65 + i // 26, 65 + i % 26) for i in range(regions)]
+    rates = {'C' + code: random.uniform(0.001, 2.0) for code in codes}
+    index = []
+    for vendor in VENDORS:
+        os.makedirs(os.path.join(directory, str(vendor)), exist_ok=True)
+        for code in codes:
+            filename = os.path.join(str(vendor), '{0}_0723_{1}.txt'.format(vendor, code))
+            with open(os.path.join(directory, filename), 'w', encoding='utf-8', newline='') as file:
+                file.write('\t'.join(HEADER) + '\n')
+                for _ in range(rows):
+                    product = random.randrange(products)
+                    quantity = random.randint(-1, 20)
+                    share = random.randrange(10, 5000) / 100
+                    file.write('07/02/2023\t07/29/2023\t\t\tsku%d\t%d\t%.2f\t%.2f\tC%s\tS\t%d\tDeveloper\tTitle %d\t\t\t1F\t\t%s\t\t\t%.2f\tC%s\n' % (
+                        product, quantity, share, quantity * share, code, 100000 + product, product, code, share * 1.4, code))
+                file.write('\nTotal_Rows\t%d\n' % rows)
+            index.append(dict(vendor=vendor, region=code, status='downloaded', file=filename))
+    with open(os.path.join(directory, 'index.json'), 'w') as file:
+        json.dump(dict(fiscalyear='2023', fiscalperiod='10', reports=index), file)
+    return rates
+
+def row_wise(directory, rates):
+    totals = collections.defaultdict(lambda: [0, 0.0])
+    with open(os.path.join(directory, 'index.json')) as file:
+        index = json.load(file)
+    for entry in index['reports']:
+        with open(os.path.join(directory, entry['file']), 'rb') as file:
+            for record in reports.parse(file, 'Financial', columns=['Vendor Identifier', 'Quantity', 'Extended Partner Share', 'Partner Share Currency']):
+                sums = totals[(str(entry['vendor']), entry['region'], record.vendor_identifier, record.partner_share_currency)]
+                sums[0] += record.quantity
+                sums[1] += float(record.extended_partner_share) * rates[record.partner_share_currency]
+    return {key: (quantity, amount) for key, (quantity, amount) in totals.items()}
+
+def columnar(directory, rates):
+    started = time.perf_counter()
+    table = consolidate.load_period(directory)
+    loaded = time.perf_counter()
+    totals = consolidate.consolidate(table, rates, 'USD')
+    return {tuple(row[:4]): (row[4], row[6]) for row in totals.rows()}, loaded - started
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the columnar consolidation of financial reports against the row-wise path")
+    parser.add_argument('--regions', type=int, default=40, help="number of regions (and currencies) per vendor (defaults to %(default)s)")
+    parser.add_argument('--rows', type=int, default=50000, help="number of rows of each report (defaults to %(default)s)")
+    parser.add_argument('--products', type=int, default=500, help="number of distinct products (defaults to %(default)s)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        rates = write_period(directory, args.regions, args.rows, args.products)
+        print("{0} reports of {1} rows, {2}".format(len(VENDORS) * args.regions, args.rows,
+              'NumPy ' + columns.numpy.__version__ if columns.numpy else 'array module (NumPy is not installed)'))
+
+        started = time.perf_counter()
+        expected = row_wise(directory, rates)
+        row_wise_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        result, load_time = columnar(directory, rates)
+        columnar_time = time.perf_counter() - started
+
+    mismatches = [key for key in expected if key not in result or expected[key][0] != result[key][0] or abs(expected[key][1] - result[key][1]) > 0.005]
+    print("row-wise:  {0:7.2f} s".format(row_wise_time))
+    print("columnar:  {0:7.2f} s (loading {1:.2f} s, converting and adding up {2:.2f} s), {3:.1f}x faster".format(
+          columnar_time, load_time, columnar_time - load_time, row_wise_time / columnar_time))
+    print("{0} groups, {1}".format(len(expected), "results match" if not mismatches and len(result) == len(expected) else "%d results differ" % len(mismatches)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Local stand-in for the App Store Connect reporter service
+#
+# Speaks the protocol of client.post_request: a form-encoded POST to /reportservice/sales/v1 or
+# /reportservice/finance/v1 carrying a jsonRequest, answered with plain text or XML (depending on
+# the request's mode) or with a gzipped report along with its filename and downloadmsg headers.
+# Reports are synthetic but shaped like real ones; each size is generated and compressed once.
+# Latency and failures can be injected to see how the client copes with a slow or busy service.
+#
+#     python3 benchmarks/fakeservice.py --port 8080 --latency 0.2 --error-rate 0.1
+#     ./reporter.py --server http://127.0.0.1:8080 -u bench getSalesReport 85442109 Daily 20230718 -T token
+
+import json, gzip, time, random, argparse, datetime, functools, threading, socketserver, http.server, urllib.parse
+
+ACCOUNTS = [('Example Inc.', 2821955), ('Example Games Ltd.', 2821956)]
+VENDORS = {85442109: ('US', 'EU', 'JP', 'AU'), 85442110: ('US', 'CA')}
+CURRENCIES = {'US': 'USD', 'EU': 'EUR', 'JP': 'JPY', 'AU': 'AUD', 'CA': 'CAD'}
+
+SALES_HEADER = ['Provider', 'Provider Country', 'SKU', 'Developer', 'Title', 'Version', 'Product Type Identifier', 'Units',
+                'Developer Proceeds', 'Begin Date', 'End Date', 'Customer Currency', 'Country Code', 'Currency of Proceeds',
+                'Apple Identifier', 'Customer Price']
+
+FINANCIAL_HEADER = ['Start Date', 'End Date', 'UPC', 'ISRC/ISBN', 'Vendor Identifier', 'Quantity', 'Partner Share',
+                    'Extended Partner Share', 'Partner Share Currency', 'Sales or Return', 'Apple Identifier',
+                    'Artist/Show/Developer/Author', 'Title', 'Label/Studio/Network/Developer/Publisher', 'Grid',
+                    'Product Type Identifier', 'ISAN/Other Identifier', 'Country Of Sale', 'Pre-order Flag', 'Promo Code',
+                    'Customer Price', 'Customer Currency']
+
+COUNTRIES = ['US', 'DE', 'GB', 'FR', 'JP', 'CN', 'CA', 'AU', 'IT', 'ES', 'NL', 'SE', 'CH', 'BR', 'MX', 'KR']
+
+NO_REPORTS = "There are no reports available to download for the selected time period."
+
+# generating and compressing reports
+
+@functools.lru_cache(maxsize=32)
+def sales_report(rows, first, last):
+    """Return a gzipped summary sales report of the given number of rows covering first to last (as MM/DD/YYYY)"""
+
+    generator = random.Random(rows)
+    lines = ['\t'.join(SALES_HEADER)]
+    for row in range(rows):
+        sku = 'sku%d' % (row % 500)
+        lines.append('APPLE\tUS\t%s\tDeveloper\tTitle of %s\t1.0\t1F\t%d\t%.2f\t%s\t%s\tUSD\t%s\tUSD\t%d\t%.2f' % (
+            sku, sku, generator.randint(1, 20), generator.randrange(1, 5000) / 100, first, last,
+            COUNTRIES[row // 500 % len(COUNTRIES)], 100000 + row % 500, generator.randrange(99, 9999) / 100))
+    return gzip.compress(('\n'.join(lines) + '\n').encode(), compresslevel=6)
+
+@functools.lru_cache(maxsize=32)
+def financial_report(rows, regioncode):
+    """Return a gzipped financial report of the given number of rows, followed by its totals like the real ones"""
+
+    generator = random.Random(rows)
+    lines = ['\t'.join(FINANCIAL_HEADER)]
+    total = 0
+    currency = CURRENCIES.get(regioncode, 'USD')
+    for row in range(rows):
+        quantity = generator.randint(-1, 20)
+        total += quantity
+        lines.append('07/02/2023\t07/29/2023\t\t\t%d\t%d\t0.69\t%.2f\t%s\tS\t%d\tDeveloper\tTitle %d\t\t\t1F\t\t%s\t\t\t0.99\t%s' % (
+            row % 500, quantity, quantity * 0.69, currency, 100000 + row % 500, row % 500, regioncode, currency))
+    lines += ['', 'Total_Rows\t%d' % rows, 'Total_Amount\t%.2f' % (total * 0.69), 'Total_Units\t%d' % total]
+    return gzip.compress(('\n'.join(lines) + '\n').encode(), compresslevel=6)
+
+def report_period(datetype, date, today = None):
+    """Return first and last day of a report as MM/DD/YYYY, or None if there can't be such a report (yet)"""
+
+    try:
+        if datetype in ('Daily', 'Weekly'):
+            last = datetime.datetime.strptime(date, '%Y%m%d').date()
+            first = last - datetime.timedelta(days=6 if datetype == 'Weekly' else 0)
+        elif datetype == 'Monthly':
+            first = datetime.datetime.strptime(date, '%Y%m').date()
+            last = (first + datetime.timedelta(days=31)).replace(day=1) - datetime.timedelta(days=1)
+        else:
+            first = datetime.date(int(date), 1, 1)
+            last = first.replace(month=12, day=31)
+    except ValueError:
+        return None
+    if last >= (today or datetime.date.today()):
+        return None
+    return first.strftime('%m/%d/%Y'), last.strftime('%m/%d/%Y')
+
+# answering queries
+
+def element(tag, *children):
+    """Render an XML element whose children are text or already rendered elements"""
+
+    return '<{0}>{1}</{0}>'.format(tag, ''.join(str(child) for child in children))
+
+def document(root):
+    return '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>' + root
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """Answer reporter queries like App Store Connect would, though with made-up data"""
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, which would otherwise be held back by delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        form = urllib.parse.parse_qs(body)
+
+        if self.server.latency:
+            time.sleep(self.server.latency * random.uniform(1 - self.server.jitter, 1 + self.server.jitter))
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            return self.respond(self.server.error_status, "The service is temporarily busy. Please try again later.", {'Retry-After': '0'})
+
+        try:
+            request = json.loads(form['jsonRequest'][0])
+            query = request['queryInput'].strip('[]').split(', ', 1)[1]
+        except (KeyError, IndexError, ValueError):
+            return self.respond(400, "Invalid request.")
+        if not request.get('userid') or not (request.get('accesstoken') or request.get('password')):
+            return self.respond(401, "Please enter a valid access token or password.")
+
+        method, _, params = query.partition(', ')
+        service, _, method = method.partition('.')
+        params = params.split(',') if params else []
+        xml_mode = request.get('mode') == 'Robot.XML'
+
+        if method == 'getReport':
+            return self.report(service, params)
+        if method == 'getStatus':
+            message = "The {0} service is available.".format(service)
+            return self.respond(200, document(element('Status', element('Message', message))) if xml_mode else message)
+        if method == 'getAccounts':
+            if xml_mode:
+                return self.respond(200, document(element('Accounts', *(element('Account', element('Name', name), element('Number', number))
+                                                                        for name, number in ACCOUNTS))))
+            return self.respond(200, '\n'.join('{0}, {1}'.format(name, number) for name, number in ACCOUNTS))
+        if method == 'getVendors':
+            if xml_mode:
+                return self.respond(200, document(element('Vendors', *(element('Vendor', vendor) for vendor in VENDORS))))
+            return self.respond(200, '\n'.join(str(vendor) for vendor in VENDORS))
+        if method == 'getVendorsAndRegions':
+            if xml_mode:
+                vendors = (element('Vendor', element('Number', vendor), *(element('Region', element('Code', region), element('Reports', element('Report', 'Financial')))
+                                                                          for region in regions)) for vendor, regions in VENDORS.items())
+                return self.respond(200, document(element('VendorsAndRegions', *vendors)))
+            return self.respond(200, '\n'.join('The following reports are available for vendor {0}:\n{1}'.format(
+                vendor, '\n'.join('{0}: Financial'.format(region) for region in regions)) for vendor, regions in VENDORS.items()))
+        if method == 'getReportVersion':
+            version = '1_1' if params[:1] == ['Sales'] else '1_0'
+            return self.respond(200, document(element('Version', version)) if xml_mode else
+                                "The latest version of {0} {1} is {2}.".format(params[0], params[-1], version))
+        if method == 'viewToken':
+            return self.respond(200, "AccessToken:{0}\nExpiration Date:2099-12-31".format(self.server.token))
+        if method == 'generateToken':
+            if 'requestId=' not in body:
+                return self.respond(200, "If you generate a new access token, your existing token will be deleted.", {'service_request_id': 'fake-request'})
+            self.server.token = '{0:032x}'.format(random.getrandbits(128))
+            return self.respond(200, "AccessToken:{0}\nExpiration Date:2099-12-31".format(self.server.token))
+        if method == 'deleteToken':
+            return self.respond(200, "Your token has been deleted.")
+        return self.respond(400, "Unknown method {0}.".format(method))
+
+    def report(self, service, params):
+        if len(params) < 5 or not params[0].isdigit():
+            return self.respond(400, "Invalid report arguments.")
+        if int(params[0]) not in VENDORS:
+            return self.respond(404, NO_REPORTS)
+
+        if service == 'Finance':
+            vendor, regioncode, _, fiscalyear, fiscalperiod = params
+            content = financial_report(self.server.rows, regioncode)
+            filename = '{0}_{1:02d}{2}_{3}.txt.gz'.format(vendor, int(fiscalperiod), fiscalyear[2:], regioncode)
+        else:
+            vendor, reporttype, reportsubtype, datetype, date = params[:5]
+            # until the publish delay has passed, yesterday's reports aren't there yet
+            today = datetime.date.today() - datetime.timedelta(days=time.monotonic() < self.server.published_at)
+            period = report_period(datetype, date, today)
+            if period is None:
+                return self.respond(404, NO_REPORTS)
+            content = sales_report(self.server.rows, *period)
+            prefix = 'S_' + datetype[0] if reporttype == 'Sales' else reporttype
+            filename = '{0}_{1}_{2}.txt.gz'.format(prefix, vendor, date)
+
+        headers = {'filename': filename, 'downloadmsg': "Successfully downloaded {0}".format(filename)}
+        self.respond(200, content, headers, 'application/a-gzip')
+
+    def respond(self, status, body, headers = None, content_type = 'text/plain; charset=utf-8'):
+        body = body.encode() if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+class HTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}'.format(*self.server_address)
+
+def create_server(port = 0, rows = 1000, latency = 0.0, jitter = 0.0, error_rate = 0.0, error_status = 503, verbose = False, publish_delay = 0.0):
+    """Set up a stand-in on a localhost port (0 picks a free one)
+
+    Every response is delayed by latency seconds, varied randomly by the fraction jitter, and answered with
+    error_status instead with a probability of error_rate. Reports have the given number of rows; those
+    covering yesterday are only published publish_delay seconds after starting the stand-in.
+    """
+
+    server = HTTPServer(('127.0.0.1', port), RequestHandler)
+    server.rows = rows
+    server.latency = latency
+    server.jitter = jitter
+    server.error_rate = error_rate
+    server.error_status = error_status
+    server.verbose = verbose
+    server.published_at = time.monotonic() + publish_delay
+    server.token = '{0:032x}'.format(random.getrandbits(128))
+    return server
+
+def start(**kwargs):
+    """Run a stand-in in a background thread and return it (call shutdown() to stop it)"""
+
+    server = create_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the App Store Connect reporter service")
+    parser.add_argument('--port', type=int, default=0, help="localhost port to listen on (defaults to a free one)")
+    parser.add_argument('--rows', type=int, default=1000, help="number of rows of each report (defaults to %(default)s)")
+    parser.add_argument('--latency', metavar='SECONDS', type=float, default=0.0, help="delay of every response (defaults to %(default)s)")
+    parser.add_argument('--jitter', metavar='FRACTION', type=float, default=0.0, help="vary the delay randomly by up to this fraction (defaults to %(default)s)")
+    parser.add_argument('--error-rate', metavar='FRACTION', type=float, default=0.0, help="fraction of requests answered with an error (defaults to %(default)s)")
+    parser.add_argument('--error-status', metavar='CODE', type=int, default=503, help="HTTP status of these errors (defaults to %(default)s)")
+    parser.add_argument('--publish-delay', metavar='SECONDS', type=float, default=0.0, help="answer that yesterday's reports aren't available until this long after starting (defaults to %(default)s)")
+    parser.add_argument('-v', '--verbose', action='store_true', help="log every request to stderr")
+    args = parser.parse_args()
+
+    server = create_server(args.port, args.rows, args.latency, args.jitter, args.error_rate, args.error_status, args.verbose, args.publish_delay)
+    print(server.url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Measure the client against the local stand-in for the reporter service (fakeservice.py)
+#
+#     python3 benchmarks/suite.py --output results.json
+#     python3 benchmarks/suite.py --only latency cold-start --compare results.json
+#
+# latency:     time of single queries and report downloads one after another on a warm connection
+# throughput:  daily reports downloaded per second by a batch at different numbers of concurrent jobs
+# memory:      peak memory allocated while downloading and unzipping a large report to a file and into memory
+# cold-start:  wall time of running reporter.py for a single query, and of starting Python alone, along
+#              with the time spent on imports (python -X importtime); fails if modules meant to be
+#              imported on first use are imported for a single query, or if imports exceed --max-import-ms
+#
+# The stand-in runs in a process of its own, so it neither competes for the GIL nor shows up in
+# memory measurements. Results are written as JSON, to be compared with those of other releases.
+
+import sys, os, json, time, platform, argparse, datetime, tempfile, statistics, subprocess, tracemalloc, concurrent.futures
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import client, retry, transport
+
+BENCHMARKS = ('latency', 'throughput', 'memory', 'cold-start')
+
+# modules which a single query must not import, as only some commands need them
+LAZY_MODULES = ('numpy', 'asyncio', 'concurrent.futures', 'csv', 'tempfile', 'xml.etree.ElementTree', 'http.server',
+                'sqlite3', 'keychain', 'daemon', 'columns', 'reports', 'planner', 'rollup', 'responses', 'warehouse', 'archive', 'mmap', 'watch', 'consolidate')
+VENDOR = 85442109
+ACCOUNT = 2821955
+
+class Service:
+    """Run fakeservice.py in a subprocess for the duration of a with block"""
+
+    def __init__(self, **options):
+        self.arguments = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fakeservice.py')]
+        for name, value in options.items():
+            self.arguments += ['--' + name.replace('_', '-'), str(value)]
+
+    def __enter__(self):
+        self.process = subprocess.Popen(self.arguments, stdout=subprocess.PIPE, text=True)
+        self.url = self.process.stdout.readline().strip()
+        if not self.url:
+            raise RuntimeError("The stand-in for the reporter service didn't start")
+        return self
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.wait()
+
+def create_client(url, jobs = 1):
+    return client.ReporterClient('bench@example.com', 'token', account=ACCOUNT, server=url, pool=transport.ConnectionPool(maxsize=jobs),
+                                 retry_policy=retry.RetryPolicy(retries=5, backoff=0.01))
+
+def days(count):
+    """Return count dates (as YYYYMMDD) of past days, so that reports are available for them"""
+
+    today = datetime.date.today()
+    return [(today - datetime.timedelta(days=offset)).strftime('%Y%m%d') for offset in range(count, 0, -1)]
+
+def summary(seconds):
+    """Describe a list of durations in milliseconds"""
+
+    seconds = sorted(seconds)
+    return dict(runs=len(seconds), min_ms=seconds[0] * 1000, median_ms=statistics.median(seconds) * 1000,
+                p95_ms=seconds[min(len(seconds) - 1, int(len(seconds) * 0.95))] * 1000, mean_ms=statistics.mean(seconds) * 1000)
+
+def timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - started
+
+# benchmarks
+
+def bench_latency(args):
+    with Service(rows=args.rows) as service, create_client(service.url) as reporter:
+        first = timed(reporter.get_status)
+        date = days(1)[0]
+        reporter.get_sales_report(VENDOR, 'Daily', date) # let the stand-in generate the report
+        status = [timed(reporter.get_status) for _ in range(args.requests)]
+        reports = [timed(reporter.get_sales_report, VENDOR, 'Daily', date) for _ in range(args.requests)]
+    return dict(first_query_ms=first * 1000, query=summary(status), report=summary(reports), report_rows=args.rows)
+
+def bench_throughput(args):
+    results = []
+    dates = days(args.reports)
+    with Service(rows=args.rows, latency=args.latency, jitter=0.5) as service:
+        for jobs in args.concurrency:
+            with create_client(service.url, jobs) as reporter, tempfile.TemporaryDirectory() as directory:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+                    started = time.perf_counter()
+                    for future in [executor.submit(reporter.get_sales_report, VENDOR, 'Daily', date, directory) for date in dates]:
+                        future.result()
+                    seconds = time.perf_counter() - started
+                stats = reporter.pool.stats()
+            results.append(dict(jobs=jobs, reports=len(dates), seconds=seconds, reports_per_second=len(dates) / seconds,
+                                connections=stats['connections']))
+    return dict(server_latency_ms=args.latency * 1000, report_rows=args.rows, runs=results)
+
+def bench_memory(args):
+    date = days(1)[0]
+    with Service(rows=args.large_rows) as service, create_client(service.url) as reporter, tempfile.TemporaryDirectory() as directory:
+        # the stand-in generates the report on the first request, which is not what is to be measured
+        result = reporter.get_sales_report(VENDOR, 'Daily', date, directory)
+        size = os.path.getsize(result.path)
+
+        results = dict(report_rows=args.large_rows, report_mb=size / 1024 / 1024)
+        for name, destination in (('file', directory), ('memory', None)):
+            tracemalloc.start()
+            seconds = timed(reporter.get_sales_report, VENDOR, 'Daily', date, destination)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results[name] = dict(seconds=seconds, peak_mb=peak / 1024 / 1024)
+    return results
+
+def import_times(command):
+    """Run a command with python -X importtime and return the microseconds each module took as (self, cumulative, nesting)"""
+
+    process = subprocess.run([sys.executable, '-X', 'importtime'] + command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    modules = {}
+    for line in process.stderr.splitlines():
+        if line.startswith('import time:') and not line.endswith('| imported package'):
+            own, cumulative, name = line[len('import time:'):].split('|')
+            modules[name.strip()] = (int(own), int(cumulative), (len(name) - len(name.lstrip()) - 1) // 2)
+    return modules
+
+def bench_cold_start(args):
+    reporter = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'reporter.py')
+    with Service() as service:
+        command = [reporter, '--server', service.url, '-u', 'bench@example.com', 'getStatus', 'Sales', '-T', 'token']
+        query = [timed(subprocess.run, [sys.executable] + command, stdout=subprocess.DEVNULL, check=True) for _ in range(args.runs)]
+        # the run importing fastest is the one least disturbed by other processes
+        modules = min((import_times(command) for _ in range(args.runs)), key=lambda modules: sum(own for own, _, _ in modules.values()))
+    interpreter = [timed(subprocess.run, [sys.executable, '-c', 'pass'], check=True) for _ in range(args.runs)]
+
+    heaviest = sorted(((cumulative, name) for name, (_, cumulative, nesting) in modules.items() if nesting == 0), reverse=True)[:10]
+    imports = dict(total_ms=sum(own for own, _, _ in modules.values()) / 1000, modules=len(modules),
+                   heaviest_ms={name: cumulative / 1000 for cumulative, name in heaviest},
+                   eager=[name for name in LAZY_MODULES if name in modules])
+    return dict(query=summary(query), interpreter=summary(interpreter), imports=imports)
+
+# reporting
+
+def flatten(results, prefix = ''):
+    """Turn nested results into a flat dictionary of numbers, e.g. {'latency.query.median_ms': 1.2}"""
+
+    flat = {}
+    for name, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + name + '.'))
+        elif isinstance(value, list):
+            for item in value:
+                flat.update(flatten(item, '{0}{1}[jobs={2}].'.format(prefix, name, item.get('jobs'))))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + name] = value
+    return flat
+
+def compare(results, baseline):
+    flat, before = flatten(results), flatten(baseline['results'])
+    print("\nCompared with {0} ({1}):".format(baseline['version'], baseline['time']))
+    for name, value in flat.items():
+        if name in before and before[name] and not name.endswith(('runs', 'rows', 'reports', 'jobs')):
+            print("  {0:50} {1:12.2f} {2:12.2f} {3:+8.1f}%".format(name, before[name], value, (value / before[name] - 1) * 100))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the client against a local stand-in for the reporter service")
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=BENCHMARKS, help="benchmarks to run (defaults to all)")
+    parser.add_argument('--requests', type=int, default=50, help="number of sequential requests measuring latency (defaults to %(default)s)")
+    parser.add_argument('--rows', type=int, default=1000, help="number of rows of the reports for latency and throughput (defaults to %(default)s)")
+    parser.add_argument('--reports', type=int, default=64, help="number of reports of a batch measuring throughput (defaults to %(default)s)")
+    parser.add_argument('--concurrency', type=lambda value: [int(jobs) for jobs in value.split(',')], default=[1, 2, 4, 8, 16], help="comma separated numbers of concurrent jobs (defaults to 1,2,4,8,16)")
+    parser.add_argument('--latency', metavar='SECONDS', type=float, default=0.05, help="time the stand-in takes to answer during the throughput benchmark (defaults to %(default)s)")
+    parser.add_argument('--large-rows', type=int, default=500000, help="number of rows of the report measuring memory (defaults to %(default)s)")
+    parser.add_argument('--runs', type=int, default=10, help="number of runs measuring the cold start (defaults to %(default)s)")
+    parser.add_argument('--max-import-ms', type=float, help="fail if a single query spends more time on imports than this")
+    parser.add_argument('--output', metavar='FILE', help="write the results as JSON to FILE")
+    parser.add_argument('--compare', metavar='FILE', help="compare the results with those of an earlier run")
+    args = parser.parse_args()
+
+    results = {}
+    for name in BENCHMARKS:
+        if name in args.only:
+            print("Running {0} benchmark...".format(name), file=sys.stderr)
+            results[name] = globals()['bench_' + name.replace('-', '_')](args)
+
+    report = dict(version=client.VERSION, time=datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+                  python=platform.python_version(), platform=platform.platform(), results=results)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
+
+    imports = results.get('cold-start', {}).get('imports')
+    if imports and imports['eager']:
+        sys.exit("Modules meant to be imported on first use are imported for a single query: " + ', '.join(imports['eager']))
+    if imports and args.max_import_ms is not None and imports['total_ms'] > args.max_import_ms:
+        sys.exit("Imports for a single query take {0:.1f} ms, more than {1:.1f} ms".format(imports['total_ms'], args.max_import_ms))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+# Local cache of downloaded report files
+#
+# Reports are stored below the cache directory in one subdirectory per vendor. What has been
+# fetched is recorded in an append-only manifest (one JSON object per line), keyed by the query
+# which retrieves the report, e.g. 'Sales.getReport, 85442109,Sales,Summary,Daily,20230718'.
+# That query string comprises the command, vendor, report type and subtype, date type, date and
+# version of a report, so it identifies the report completely. Reports which have been put together
+# locally from other cached reports (see rollup.py) are marked as derived.
+
+import os, json, hashlib, threading, datetime, calendar, contextlib
+
+MANIFEST = 'manifest.jsonl'
+
+# how reports of each date type are identified (weekly reports by the Sunday that week ends)
+DATE_FORMATS = {'Daily': '%Y%m%d', 'Weekly': '%Y%m%d', 'Monthly': '%Y%m', 'Yearly': '%Y'}
+
+def period_end(datetype, date):
+    """Return the last day covered by a report of the given date type and date"""
+
+    if datetype == 'Yearly':
+        return datetime.date(int(date), 12, 31)
+    if datetype == 'Monthly':
+        year, month = int(date[:4]), int(date[4:6])
+        return datetime.date(year, month, calendar.monthrange(year, month)[1])
+    return datetime.datetime.strptime(date, '%Y%m%d').date()
+
+@contextlib.contextmanager
+def atomic_write(filename, mode = 'w', permissions = 0o666, **options):
+    """Open a temporary file for writing, which replaces filename once it has been written completely
+
+    A partial file thus never shows up, and the temporary file is removed if writing fails. The file is created with
+    the given permissions as limited by the umask, just like open() does.
+    """
+
+    directory, basename = os.path.split(filename)
+    temporary = os.path.join(directory, '.{0}.{1}.tmp'.format(basename, os.urandom(6).hex()))
+    try:
+        with open(os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_EXCL, permissions), mode, **options) as file:
+            yield file
+        os.replace(temporary, filename)
+    except:
+        if os.path.exists(temporary):
+            os.unlink(temporary)
+        raise
+
+def read_journal(filename):
+    """Replay an append-only journal of JSON entries identified by their key (a manifest, or the index of an archive)
+
+    Returns the current entries by key: later entries replace earlier ones, and entries marked as removed drop them.
+    """
+
+    entries = {}
+    if os.path.exists(filename):
+        with open(filename) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue # skip a line that has been cut short by an interrupted run
+                if entry.get('removed'):
+                    entries.pop(entry['key'], None)
+                else:
+                    entries[entry['key']] = entry
+    return entries
+
+def append_journal(filename, entry):
+    with open(filename, 'a') as file:
+        file.write(json.dumps(entry) + '\n')
+
+def write_journal(filename, entries):
+    """Replace a journal atomically with one holding nothing but the given entries"""
+
+    with atomic_write(filename) as file:
+        for entry in entries:
+            file.write(json.dumps(entry) + '\n')
+
+def checksum(filename):
+    """Compute the SHA-256 checksum of a file"""
+
+    sha256 = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+class ReportCache:
+    """Directory of report files along with a manifest of what has been fetched when"""
+
+    def __init__(self, directory, final_after = 3):
+        self.directory = directory
+        self.final_after = datetime.timedelta(days=final_after)
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._manifest = os.path.join(directory, MANIFEST)
+        self._entries = read_journal(self._manifest)
+
+    def directory_for(self, vendor):
+        """Return the directory which holds the reports of a vendor"""
+
+        directory = os.path.join(self.directory, str(vendor))
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def lookup(self, key):
+        """Return the manifest entry of a cached report if its file is still present, otherwise None"""
+
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and os.path.exists(self.path(entry)):
+            return entry
+        return None
+
+    def entries(self):
+        """Return the manifest entries of all cached reports"""
+
+        with self._lock:
+            return list(self._entries.values())
+
+    def path(self, entry):
+        """Return the location of a cached report file"""
+
+        return os.path.join(self.directory, entry['file'])
+
+    def add(self, key, filename, end = None, derived = False):
+        """Record a report file which has just been fetched, or derived from other reports
+
+        A report counts as final if the period it covers had ended long enough before fetching it (or if its period is unknown).
+        """
+
+        now = datetime.datetime.now()
+        entry = dict(key=key, file=os.path.relpath(filename, self.directory), size=os.path.getsize(filename),
+                     sha256=checksum(filename), fetched=now.isoformat(timespec='seconds'),
+                     final=end is None or end + self.final_after <= now.date())
+        if derived:
+            entry.update(derived=True)
+        with self._lock:
+            self._entries[key] = entry
+            append_journal(self._manifest, entry)
+        return entry
+
+    def remove(self, key):
+        """Delete a cached report file and forget about it"""
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry:
+                append_journal(self._manifest, dict(key=key, removed=True))
+        if entry and os.path.exists(self.path(entry)):
+            os.remove(self.path(entry))
+
+    def prune(self, max_age = None, max_size = None):
+        """Evict reports fetched more than max_age days ago, then the oldest ones until the cache is at most max_size bytes large"""
+
+        with self._lock:
+            entries = sorted(self._entries.values(), key=lambda entry: entry['fetched'])
+
+        evict = []
+        if max_age is not None:
+            oldest = (datetime.datetime.now() - datetime.timedelta(days=max_age)).isoformat(timespec='seconds')
+            evict = [entry for entry in entries if entry['fetched'] < oldest]
+            entries = entries[len(evict):]
+        if max_size is not None:
+            size = sum(entry['size'] for entry in entries)
+            for entry in entries:
+                if size <= max_size:
+                    break
+                evict.append(entry)
+                size -= entry['size']
+
+        for entry in evict:
+            self.remove(entry['key'])
+        self.compact()
+        return evict
+
+    def compact(self):
+        """Rewrite the manifest so it contains nothing but the current entries"""
+
+        with self._lock:
+            write_journal(self._manifest, self._entries.values())
@@ -0,0 +1,708 @@
+# Programmatic interface to the App Store Connect reporter service
+#
+# ReporterClient holds the login credentials along with a pool of keep-alive connections and
+# offers one method per query. Nothing gets printed: text responses are returned as Result
+# objects, report files are either returned in memory, written into a directory or streamed
+# into a file object. AsyncReporterClient offers the same methods as coroutines.
+#
+#     client = ReporterClient('your@apple-id.com', access_token='...', account=2821955)
+#     report = client.get_sales_report(85442109, 'Daily', '20230718')
+#     for row in report.rows():
+#         print(row['SKU'], row['Units'])
+
+import os, io, json, zlib, time, threading, http.client, urllib.parse, functools
+import transport, cache, retry, metrics
+
+# modules needed by only some of the methods (e.g. asyncio, csv or the parsers) are imported where
+# they are used, so that reporter.py starts quickly for a single query
+
+VERSION = '2.2'
+ENDPOINT_SALES = 'https://reportingitc-reporter.apple.com/reportservice/sales/v1'
+ENDPOINT_FINANCE = 'https://reportingitc-reporter.apple.com/reportservice/finance/v1'
+
+# reports are downloaded and unzipped in pieces of this size to keep memory usage low
+CHUNK_SIZE = 64 * 1024
+
+# HTTP request
+
+def build_json_request_string(credentials, query):
+    """Build a JSON string from the urlquoted credentials and the actual query input"""
+
+    userid, accessToken, password, account, mode = credentials
+
+    request = dict(userid=userid, version=VERSION, mode=mode, queryInput=query)
+    if account: request.update(account=account) # empty account info would result in error 404
+    if accessToken: request.update(accesstoken=accessToken)
+    if password: request.update(password=password)
+
+    request = dict(jsonRequest=json.dumps(request))
+
+    return urllib.parse.urlencode(request)
+
+def report_query(vendor, reporttype, reportsubtype, datetype, date):
+    """Build the query for a sales, pre-order or newsstand report, which also identifies the report in a ReportCache"""
+
+    return 'Sales.getReport, {0},{1},{2},{3},{4}'.format(vendor, reporttype, reportsubtype, datetype, date)
+
+def rebase_endpoint(endpoint, server):
+    """Replace scheme and host of an endpoint URL with those of another server"""
+
+    server = urllib.parse.urlsplit(server)
+    return urllib.parse.urlsplit(endpoint)._replace(scheme=server.scheme, netloc=server.netloc).geturl()
+
+class AuthenticationError(ValueError):
+    """Rejection of the login credentials by the reporter service"""
+
+def post_request(pool, endpoint, credentials, command, url_params = None, stream = False, span = None):
+    """Execute the HTTP POST request
+
+    If stream is set, the body of a report file is not read but the response itself is returned in place of the content.
+    A metrics.Span, if given, takes the timings and sizes of the request.
+    """
+
+    command = "[p=Reporter.properties, %s]" % command
+    request_data = build_json_request_string(credentials, command)
+    if url_params: request_data += url_params
+
+    headers = {'Accept': 'text/html,image/gif,image/jpeg; q=.2, */*; q=.2', 'Content-Type': 'application/x-www-form-urlencoded'}
+
+    try:
+        response = pool.request(endpoint, request_data.encode(), headers, span.phases if span else None)
+        header = response.info()
+        if span:
+            span.status, span.reused = response.status, response.reused
+
+        if stream and response.status < 400 and header.get_content_type() == 'application/a-gzip':
+            return (response, header)
+
+        started = time.perf_counter()
+        content = response.read()
+        if span:
+            span.add('transfer', time.perf_counter() - started)
+            span.wire_bytes += len(content)
+            span.bytes += len(content)
+    except (OSError, http.client.HTTPException) as e:
+        raise retry.TransientError("Error: Connection to the reporter service failed (%s)" % (str(e) or e.__class__.__name__))
+
+    if response.status >= 400:
+        if response.status == 401:
+            raise AuthenticationError(content.decode())
+        if response.status == 400 or response.status == 403 or response.status == 404:
+            # for these error codes, the body always contains an error message
+            raise ValueError(content.decode())
+        elif response.status in retry.TRANSIENT_STATUS_CODES:
+            raise retry.TransientError("HTTP Error %s. The reporter service is busy or unavailable." % str(response.status), retry.parse_retry_after(header.get('Retry-After')))
+        else:
+            raise ValueError("HTTP Error %s. Did you choose reasonable query arguments?" % str(response.status))
+
+    return (content, header)
+
+# report files
+
+class Inflater:
+    """Unzip gzipped data given in pieces, which may consist of several gzip members"""
+
+    def __init__(self):
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._pending = False
+
+    def inflate(self, chunk):
+        """Iterate over the unzipped data of the next piece of gzipped data
+
+        The unzipped pieces are at most CHUNK_SIZE bytes long, because reports compress really well.
+        """
+
+        while chunk:
+            piece = self._decompressor.decompress(chunk, CHUNK_SIZE)
+            chunk = self._decompressor.unconsumed_tail
+            self._pending = True
+            if self._decompressor.eof:
+                # each gzip member needs its own decompressor
+                chunk = self._decompressor.unused_data
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                self._pending = False
+            yield piece
+
+    def flush(self):
+        """Return the rest of the unzipped data once all gzipped data has been given, failing if it has been cut short"""
+
+        if not self._pending:
+            return b''
+        piece = self._decompressor.flush()
+        if not self._decompressor.eof:
+            raise ValueError("Error: The report file is incomplete")
+        return piece
+
+def write_report(source, destination, unzip = True, span = None):
+    """Copy a report from a file-like source to a destination piece by piece, unzipping it on the fly if requested
+
+    A metrics.Span, if given, takes the time spent on reading, unzipping and writing as well as the sizes before and after unzipping.
+    """
+
+    inflater = Inflater() if unzip else None
+    clock = time.perf_counter
+    transfer = inflate = write = 0.0
+    wire_bytes = size = 0
+
+    try:
+        while True:
+            started = clock()
+            chunk = source.read(CHUNK_SIZE)
+            transfer += clock() - started
+            if not chunk:
+                break
+            wire_bytes += len(chunk)
+            if not inflater:
+                started = clock()
+                destination.write(chunk)
+                write += clock() - started
+                size += len(chunk)
+                continue
+            started = clock()
+            for piece in inflater.inflate(chunk):
+                inflated = clock()
+                destination.write(piece)
+                inflate += inflated - started
+                started = clock()
+                write += started - inflated
+                size += len(piece)
+
+        if inflater:
+            piece = inflater.flush()
+            destination.write(piece)
+            size += len(piece)
+    finally:
+        if span:
+            span.add('transfer', transfer)
+            span.add('write', write)
+            if unzip:
+                span.add('inflate', inflate)
+            span.wire_bytes += wire_bytes
+            span.bytes += size
+
+class IncomingReport:
+    """The body of a streamed response, failing transiently when the connection breaks while reading it
+
+    Errors writing the report are left alone, since sending the request again wouldn't help with them.
+    """
+
+    def __init__(self, response):
+        self.response = response
+
+    def read(self, size = -1):
+        try:
+            return self.response.read(size)
+        except (OSError, http.client.HTTPException) as e:
+            raise retry.TransientError("Error: Downloading the report failed (%s)" % (str(e) or e.__class__.__name__))
+
+    def close(self):
+        self.response.close()
+
+def write_report_file(source, filename, unzip = True, span = None):
+    """Write a report into a temporary file first and rename it when complete, so a partial report never shows up"""
+
+    with cache.atomic_write(filename, 'wb') as file:
+        write_report(source, file, unzip, span)
+
+class Result:
+    """Outcome of a query along with the response metadata
+
+    A report file is held either in memory (content), on disk (path) or in an Archive (archive). Reports streamed into a
+    file object have neither. Results of other queries carry the response body as content. Reports put together from
+    other reports are derived.
+    """
+
+    def __init__(self, query, header, content = None, path = None, filename = None, message = None, cached = False, derived = False, archive = None):
+        self.query = query
+        self.header = header
+        self.content = content
+        self.path = path
+        self.filename = filename
+        self.message = message
+        self.cached = cached
+        self.derived = derived
+        self.archive = archive
+
+    @property
+    def text(self):
+        return self.content.decode() if self.content is not None else None
+
+    def open(self):
+        """Open the report file (or the content held in memory) for reading"""
+
+        if self.path:
+            return open(self.path, 'rb')
+        if self.archive:
+            return self.archive.open(self.query)
+        if self.content is not None:
+            return io.BytesIO(self.content)
+        raise ValueError("Error: The report has been streamed and is not available anymore")
+
+    def parse(self):
+        """Convert the response to a query into typed objects (see responses.py), or None if it has no structure"""
+
+        import responses
+        return responses.parse(self.query, self.content) if self.content is not None else None
+
+    def rows(self):
+        """Iterate over the lines of a tab separated report, each as a dictionary keyed by column name"""
+
+        import csv
+        with io.TextIOWrapper(self.open(), encoding='utf-8', newline='') as file:
+            yield from csv.DictReader(file, delimiter='\t', quoting=csv.QUOTE_NONE)
+
+    def records(self, columns = None, where = None):
+        """Iterate over the typed records of the report (see reports.parse)"""
+
+        import reports
+        reporttype, version = reports.report_type_of(self.query)
+        with self.open() as file:
+            yield from reports.parse(file, reporttype, version, columns, where)
+
+class SingleFlight:
+    """Collapse identical calls made at the same time into a single one whose outcome all callers share"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = dict(calls=0, shared=0)
+
+    def do(self, key, function):
+        """Call function unless a call with the same key is in flight already; in that case wait for that call's outcome"""
+
+        import concurrent.futures
+        with self._lock:
+            self._stats['calls'] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = concurrent.futures.Future()
+            else:
+                self._stats['shared'] += 1
+
+        if not leader:
+            return call.result()
+
+        try:
+            result = function()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self):
+        """Return the number of calls made and how many of them have shared the outcome of another call"""
+
+        with self._lock:
+            return dict(self._stats)
+
+class ReporterClient:
+    """Client for querying Sales- and Financial Reports from App Store Connect
+
+    A client can be shared by multiple threads. If a ReportCache is given, downloaded reports are stored in that cache;
+    if an Archive is given, they are stored in its pack files instead. Failed requests are retried according to retry_policy; a RateLimiter and a CircuitBreaker, if given, apply to all
+    requests of the client. With a SingleFlight, identical queries made at the same time are sent only once.
+    """
+
+    def __init__(self, userid, access_token = None, password = None, account = None, mode = 'Normal', server = None, pool = None, report_cache = None,
+                 retry_policy = None, rate_limiter = None, circuit_breaker = None, single_flight = None, metrics = None, archive = None):
+        self.userid = userid
+        self.access_token = access_token
+        self.password = password
+        self.account = account
+        self.mode = mode
+        self.pool = pool or transport.ConnectionPool()
+        self.report_cache = report_cache
+        self.retry_policy = retry_policy or retry.RetryPolicy()
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self.single_flight = single_flight
+        self.metrics = metrics
+        self.archive = archive
+        self.endpoint_sales = rebase_endpoint(ENDPOINT_SALES, server) if server else ENDPOINT_SALES
+        self.endpoint_finance = rebase_endpoint(ENDPOINT_FINANCE, server) if server else ENDPOINT_FINANCE
+
+    @property
+    def credentials(self):
+        # the access token and password may be given as functions returning their current values (see credentials.py)
+        access_token = self.access_token() if callable(self.access_token) else self.access_token
+        password = self.password() if callable(self.password) else self.password
+        return (self.userid, access_token, password, str(self.account), self.mode)
+
+    def close(self):
+        self.pool.close()
+        if self.metrics:
+            self.metrics.close()
+        if self.archive:
+            self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _endpoint(self, service):
+        return self.endpoint_sales if service == 'Sales' else self.endpoint_finance
+
+    def _post(self, service, command, url_params = None, span = None):
+        """Post a query, waiting for the rate limiter and retrying it after transient failures"""
+
+        return self._retrying(lambda: post_request(self.pool, self._endpoint(service), self.credentials, command, url_params, span=span), span)
+
+    def _retrying(self, request, span = None):
+        """Make a request by calling a function, waiting for the rate limiter and calling it again after transient failures"""
+
+        attempt = 0
+        renewed = False
+        while True:
+            try:
+                if self.circuit_breaker:
+                    self.circuit_breaker.before_request(self._available)
+                if self.rate_limiter:
+                    self.rate_limiter.acquire()
+                result = request()
+            except AuthenticationError:
+                # the token may have been rotated since it was looked up, so look it up again and retry once
+                if renewed or not self._renew_credentials():
+                    raise
+                renewed = True
+                continue
+            except retry.TransientError as e:
+                if self.circuit_breaker:
+                    self.circuit_breaker.record_failure()
+                delay = self.retry_policy.delay(attempt, e.retry_after)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                if span:
+                    span.retries = attempt
+                continue
+
+            if self.circuit_breaker:
+                self.circuit_breaker.record_success()
+            return result
+
+    def _renew_credentials(self):
+        """Have secrets given as functions (see credentials.py) looked up again, telling whether the credentials have changed"""
+
+        secrets = [secret for secret in (self.access_token, self.password) if hasattr(secret, 'invalidate')]
+        if not secrets:
+            return False
+        previous = self.credentials
+        for secret in secrets:
+            secret.invalidate()
+        return self.credentials != previous
+
+    def _available(self):
+        """Ask the reporter service whether it is available (bypassing retries and the circuit breaker)"""
+
+        import responses
+        content, _ = post_request(self.pool, self.endpoint_sales, self.credentials, 'Sales.getStatus')
+        return responses.parse_status(content).available
+
+    def _once(self, key, function):
+        """Call function, or share the outcome of an identical call which is in flight already"""
+
+        if not self.single_flight:
+            return function()
+        return self.single_flight.do(key, function)
+
+    def query(self, service, command, url_params = None):
+        """Send a query which is answered with text (or XML, depending on mode)"""
+
+        def query():
+            with metrics.Span(command, self.metrics) as span:
+                content, header = self._post(service, command, url_params, span=span)
+                return Result(command, header, content)
+
+        return self._once((build_json_request_string(self.credentials, command), url_params), query)
+
+    def download(self, service, command, vendor, period = None, destination = None, unzip = True, sync = False):
+        """Download a report file
+
+        The report ends up in memory if destination is None, as a file in the directory destination names or
+        written into destination if that is a file object. With a report cache or an archive, the report is stored
+        there instead (and, when syncing, not downloaded at all if it holds a final version of it already).
+        period is a (datetype, date) tuple used for telling whether a report is final.
+        """
+
+        if destination is not None and not isinstance(destination, str):
+            # a report streamed into a file object cannot be shared
+            return self._download(service, command, vendor, period, destination, unzip, sync)
+
+        download = lambda: self._download(service, command, vendor, period, destination, unzip, sync)
+        return self._once((build_json_request_string(self.credentials, command), destination, sync), download)
+
+    def _stored(self, command):
+        """Return the Result of a final version of a report held by the report cache or archive, or None"""
+
+        entry = self.report_cache.lookup(command) if self.report_cache else None
+        if entry and entry['final']:
+            return Result(command, None, path=self.report_cache.path(entry), filename=os.path.basename(entry['file']), cached=True, derived=entry.get('derived', False))
+        entry = self.archive.lookup(command) if self.archive else None
+        if entry and entry['final']:
+            return Result(command, None, filename=entry['filename'], cached=True, archive=self.archive)
+        return None
+
+    def _download(self, service, command, vendor, period, destination, unzip, sync):
+        with metrics.Span(command, self.metrics) as span:
+            return self._download_measured(service, command, vendor, period, destination, unzip, sync, span)
+
+    def _download_measured(self, service, command, vendor, period, destination, unzip, sync, span):
+
+        stored = self._stored(command) if sync else None
+        if stored:
+            span.cached = True
+            return stored
+
+        # the request is sent again if the connection fails while the report is coming in, as partial reports are discarded
+        fetch = lambda: self._fetch(service, command, vendor, period, destination, unzip, span)
+        return self._retrying(fetch, span)
+
+    def _fetch(self, service, command, vendor, period, destination, unzip, span):
+        """Post a request for a report and store the report as it comes in"""
+
+        content, header = post_request(self.pool, self._endpoint(service), self.credentials, command, stream=True, span=span)
+        if header.get_content_type() != 'application/a-gzip':
+            return Result(command, header, content)
+
+        message = header.get('downloadmsg')
+        filename = header.get('filename') or 'report.txt.gz'
+        if unzip:
+            message = message.replace('.txt.gz', '.txt') if message else None
+            filename = filename[:-3]
+
+        content = IncomingReport(content)
+        try:
+            if self.report_cache:
+                destination = self.report_cache.directory_for(vendor)
+
+            if self.archive:
+                # the report is archived gzipped as it comes in, and only unzipped when reading it
+                with self.archive.writer(command, filename, unzip, cache.period_end(*period) if period else None) as writer:
+                    write_report(content, writer, False, span)
+                return Result(command, header, filename=filename, message=message, archive=self.archive)
+
+            if destination is None:
+                buffer = io.BytesIO()
+                write_report(content, buffer, unzip, span)
+                return Result(command, header, content=buffer.getvalue(), filename=filename, message=message)
+
+            if not isinstance(destination, str):
+                written = span.bytes
+                try:
+                    write_report(content, destination, unzip, span)
+                except retry.TransientError as e:
+                    if span.bytes > written:
+                        # what the caller has received already can't be taken back, so the request isn't sent again
+                        content.close()
+                        raise ValueError(str(e))
+                    raise
+                destination.flush()
+                return Result(command, header, filename=filename, message=message)
+
+            path = os.path.join(destination, filename)
+            write_report_file(content, path, unzip, span)
+        except retry.TransientError:
+            content.close()
+            raise
+        except OSError as e:
+            content.close()
+            raise ValueError("Error: Writing the report failed (%s)" % (str(e) or e.__class__.__name__))
+        if self.report_cache:
+            self.report_cache.add(command, path, cache.period_end(*period) if period else None)
+        return Result(command, header, path=path, filename=filename, message=message)
+
+    # App Store Connect (formerly named iTC) queries
+
+    def get_status(self, service = 'Sales'):
+        return self.query(service, service + '.getStatus')
+
+    def get_accounts(self, service = 'Sales'):
+        return self.query(service, service + '.getAccounts')
+
+    def get_vendors(self):
+        return self.query('Sales', 'Sales.getVendors')
+
+    def get_vendors_and_regions(self):
+        return self.query('Finance', 'Finance.getVendorsAndRegions')
+
+    def get_report_version(self, reporttype, reportsubtype):
+        # service is limited to Sales for now because although documented it doesn't work for Finance
+        return self.query('Sales', 'Sales.getReportVersion, {0},{1}'.format(reporttype, reportsubtype))
+
+    def get_financial_report(self, vendor, regioncode, fiscalyear, fiscalperiod, destination = None, sync = False):
+        command = 'Finance.getReport, {0},{1},Financial,{2},{3}'.format(vendor, regioncode, fiscalyear, fiscalperiod)
+        return self.download('Finance', command, vendor, None, destination, sync=sync)
+
+    def get_all_financial_reports(self, fiscalyear, fiscalperiod, destination = None, sync = False, max_workers = 8):
+        """Download the financial reports of all vendors and regions available for a fiscal period concurrently
+
+        Returns a list of (vendor, regioncode, outcome) tuples, where outcome is either the Result of the download or the
+        error which kept the report from being downloaded. If destination is a directory, each vendor's reports are
+        written into a subdirectory of it named after the vendor number.
+        """
+
+        import concurrent.futures
+        vendors = self.get_vendors_and_regions().parse()
+        reports = [(vendor.number, region.code) for vendor in vendors for region in vendor.regions
+                   if not region.reports or 'Financial' in region.reports]
+
+        def download(vendor, regioncode):
+            target = destination
+            if isinstance(destination, str):
+                target = os.path.join(destination, str(vendor))
+                os.makedirs(target, exist_ok=True)
+            return self.get_financial_report(vendor, regioncode, fiscalyear, fiscalperiod, target, sync)
+
+        outcomes = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [(vendor, regioncode, executor.submit(download, vendor, regioncode)) for vendor, regioncode in reports]
+            for vendor, regioncode, future in futures:
+                try:
+                    outcome = future.result()
+                except (ValueError, OSError) as e:
+                    outcome = e
+                outcomes.append((vendor, regioncode, outcome))
+        return outcomes
+
+    def get_sales_report(self, vendor, datetype, date, destination = None, sync = False):
+        command = report_query(vendor, 'Sales', 'Summary', datetype, date)
+        return self.download('Sales', command, vendor, (datetype, date), destination, sync=sync)
+
+    def derive_sales_report(self, vendor, datetype, date, destination = None, sync = False):
+        """Put a weekly, monthly or yearly sales report together from the daily reports in the report cache
+
+        Daily reports missing from the cache are downloaded first. The report itself is downloaded instead if it can't
+        be derived: without a report cache, if the period isn't over yet or none of its days has been cached, and if a
+        daily report isn't available or the daily reports don't fit together.
+        """
+
+        import datetime, rollup
+        days = rollup.period_days(datetype, date)
+        if not self.report_cache or not days or days[-1] >= datetime.date.today():
+            return self.get_sales_report(vendor, datetype, date, destination, sync)
+
+        command = report_query(vendor, 'Sales', 'Summary', datetype, date)
+        stored = self._stored(command) if sync else None
+        if stored:
+            return stored
+
+        dates = [day.strftime('%Y%m%d') for day in days]
+        if not any(self.report_cache.lookup(report_query(vendor, 'Sales', 'Summary', 'Daily', day)) for day in dates):
+            return self.get_sales_report(vendor, datetype, date, destination, sync)
+
+        filename = rollup.filename(vendor, datetype, date)
+        path = os.path.join(self.report_cache.directory_for(vendor), filename)
+        try:
+            # final daily reports are taken from the cache, the others are (re)downloaded
+            daily = [self.get_sales_report(vendor, 'Daily', day, sync=True).path for day in dates]
+            if None in daily:
+                raise ValueError("Error: Not all daily reports of the period are available")
+            with cache.atomic_write(path, encoding='utf-8', newline='') as file:
+                rollup.combine(daily, days[0], days[-1], file)
+        except retry.TransientError:
+            raise
+        except ValueError:
+            return self.get_sales_report(vendor, datetype, date, destination, sync)
+
+        self.report_cache.add(command, path, days[-1], derived=True)
+        if destination is not None and not isinstance(destination, str):
+            with open(path, 'rb') as file:
+                write_report(file, destination, False)
+            destination.flush()
+        message = "Derived {0} from {1} daily reports".format(filename, len(days))
+        return Result(command, None, path=path, filename=filename, message=message, derived=True)
+
+    def get_subscription_report(self, vendor, date, version = '1_3', destination = None, sync = False):
+        command = 'Sales.getReport, {0},Subscription,Summary,Daily,{1},{2}'.format(vendor, date, version)
+        return self.download('Sales', command, vendor, ('Daily', date), destination, sync=sync)
+
+    def get_subscription_event_report(self, vendor, date, version = '1_3', destination = None, sync = False):
+        command = 'Sales.getReport, {0},SubscriptionEvent,Summary,Daily,{1},{2}'.format(vendor, date, version)
+        return self.download('Sales', command, vendor, ('Daily', date), destination, sync=sync)
+
+    def get_subscriber_report(self, vendor, date, version = '1_3', destination = None, sync = False):
+        command = 'Sales.getReport, {0},Subscriber,Detailed,Daily,{1},{2}'.format(vendor, date, version)
+        return self.download('Sales', command, vendor, ('Daily', date), destination, sync=sync)
+
+    def get_newsstand_report(self, vendor, datetype, date, destination = None, sync = False):
+        command = report_query(vendor, 'Newsstand', 'Detailed', datetype, date)
+        return self.download('Sales', command, vendor, (datetype, date), destination, sync=sync)
+
+    def get_opt_in_report(self, vendor, date, destination = None, sync = False):
+        command = 'Sales.getReport, {0},Sales,Opt-In,Weekly,{1}'.format(vendor, date)
+        # do not attempt to unzip because it's password protected
+        return self.download('Sales', command, vendor, ('Weekly', date), destination, unzip=False, sync=sync)
+
+    def get_pre_order_report(self, vendor, datetype, date, destination = None, sync = False):
+        command = report_query(vendor, 'Pre-Order', 'Summary', datetype, date)
+        return self.download('Sales', command, vendor, (datetype, date), destination, sync=sync)
+
+    def get_podcasts_subscription_snapshot_report(self, vendor, date, destination = None, sync = False):
+        command = 'Sales.getReport, {0},apSubscriptionsSnapshot,Summary,Daily,{1}'.format(vendor, date)
+        return self.download('Sales', command, vendor, ('Daily', date), destination, sync=sync)
+
+    def view_token(self):
+        return self.query('Sales', 'Sales.viewToken')
+
+    def generate_token(self):
+        """Generate a new access token, which is used by this client from then on"""
+
+        command = 'Sales.generateToken'
+
+        # generating a new token requires mirroring back a request id to the iTC server, so let's examine the response header...
+        service_request_id = self.query('Sales', command).header.get('service_request_id')
+
+        # ...and post back the request id
+        result = self.query('Sales', command, "&isExistingToken=Y&requestId=" + service_request_id)
+        token = result.parse().access_token
+        if token:
+            self.access_token = token
+        return result
+
+    def delete_token(self):
+        return self.query('Sales', 'Sales.deleteToken')
+
+class AsyncReporterClient:
+    """Asynchronous variant of ReporterClient, offering the same methods as coroutines
+
+    Queries are carried out by a pool of at most max_concurrency threads which share the keep-alive connections of
+    one ReporterClient, so any number of queries can be awaited from a single event loop.
+    """
+
+    def __init__(self, *args, max_concurrency = 8, **kwargs):
+        import concurrent.futures
+        kwargs.setdefault('pool', transport.ConnectionPool(maxsize=max_concurrency))
+        self.client = ReporterClient(*args, **kwargs)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency)
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        if name.startswith('_') or not callable(method):
+            return method
+
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            import asyncio
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(method, *args, **kwargs))
+
+        return call
+
+    async def close(self):
+        self._executor.shutdown(wait=False)
+        self.client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,293 @@
+# Column oriented in-memory representation of reports for fast aggregation
+#
+# Adding up units and proceeds record by record is slow for large reports. A Table keeps every
+# column of one or more reports in a compact array instead: counts as 64 bit integers, amounts as
+# floating point numbers (exact to the cent for any realistic sum), and text as well as dates
+# dictionary encoded, i.e. as an array of small integer codes into a list of distinct values.
+# Empty counts and amounts are taken as 0.
+#
+# Aggregations work on these arrays as a whole. If NumPy is installed, columns are NumPy arrays
+# and group_by runs vectorized; otherwise the standard library's array module is used, which
+# still saves most of the memory and the per record overhead.
+#
+#     table = load_files(['S_D_85442109_20230717.txt', 'S_D_85442109_20230718.txt'], 'Sales')
+#     for sku, country, units in table.group_by(['SKU', 'Country Code'], ['Units']).rows():
+#         print(sku, country, units)
+
+import io, os, array, itertools
+import reports
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# number of lines converted at once while loading
+CHUNK_ROWS = 64 * 1024
+
+class Categorical:
+    """Dictionary encoded column: codes[i] is the position of the i-th value in values"""
+
+    def __init__(self, codes, values):
+        self.codes = codes
+        self.values = values
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        return self.values[self.codes[index]]
+
+    def ranks(self):
+        """Map each code to the position of its value in sort order (empty values last)"""
+
+        order = sorted(range(len(self.values)), key=lambda code: (self.values[code] is None, self.values[code]))
+        ranks = [0] * len(order)
+        for rank, code in enumerate(order):
+            ranks[code] = rank
+        return ranks
+
+def take(column, indices):
+    """Select the values at the given positions of a column"""
+
+    if isinstance(column, Categorical):
+        return Categorical(take(column.codes, indices), column.values)
+    if numpy is not None:
+        return column[indices]
+    return array.array(column.typecode, (column[index] for index in indices))
+
+def repeat(values, counts):
+    """Build a column holding each of the values as many times in a row as the corresponding count tells"""
+
+    index = {}
+    codes = [index.setdefault(value, len(index)) for value in values]
+    if numpy is not None:
+        data = numpy.repeat(numpy.asarray(codes, numpy.intc), counts)
+    else:
+        data = array.array('i')
+        for code, count in zip(codes, counts):
+            data.extend(array.array('i', [code]) * count)
+    return Categorical(data, list(index))
+
+def to_list(column):
+    if isinstance(column, Categorical):
+        values = column.values
+        return [values[code] for code in column.codes]
+    return column.tolist()
+
+class Table:
+    """Named columns of equal length"""
+
+    def __init__(self, columns):
+        self.columns = dict(columns)
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def rows(self):
+        """Iterate over the rows as tuples of values"""
+
+        return zip(*(to_list(column) for column in self.columns.values()))
+
+    def sum(self, name):
+        column = self.columns[name]
+        return column.sum().item() if numpy is not None else sum(column)
+
+    def group_by(self, keys, sums):
+        """Add up the columns named in sums for each distinct combination of values of the columns named in keys
+
+        The result is a Table with the key columns followed by the sums, ordered by the values of the keys.
+        """
+
+        for name in list(keys) + list(sums):
+            if name not in self.columns:
+                raise ValueError("Error: The report has no column named '%s'" % name)
+            if name in sums and isinstance(self.columns[name], Categorical):
+                raise ValueError("Error: Column '%s' doesn't hold numbers and can't be summed up" % name)
+
+        if numpy is not None:
+            first, groups = self._group_numpy(keys)
+            totals = {name: self._sum_numpy(self.columns[name], groups, len(first)) for name in sums}
+        else:
+            first, groups = self._group_array(keys)
+            totals = {name: self._sum_array(self.columns[name], groups, len(first)) for name in sums}
+
+        result = {name: take(self.columns[name], first) for name in keys}
+        result.update(totals)
+        return Table(result)
+
+    def _group_numpy(self, keys):
+        """Number the groups in sort order, return the first row of each group and the group of each row"""
+
+        combined = numpy.zeros(len(self), numpy.int64)
+        cardinality = 1
+        for name in keys:
+            column = self.columns[name]
+            if isinstance(column, Categorical):
+                codes, count = numpy.asarray(column.ranks(), numpy.int64)[column.codes], len(column.values)
+            else:
+                distinct, codes = numpy.unique(column, return_inverse=True)
+                count = len(distinct)
+            if cardinality * count >= 2 ** 62:
+                # renumber the combinations seen so far to keep the combined key from overflowing
+                distinct, combined = numpy.unique(combined, return_inverse=True)
+                cardinality = len(distinct)
+            combined = combined * count + codes
+            cardinality *= count
+
+        distinct, first, groups = numpy.unique(combined, return_index=True, return_inverse=True)
+        return first, groups.reshape(-1)
+
+    @staticmethod
+    def _sum_numpy(column, groups, count):
+        totals = numpy.bincount(groups, weights=column, minlength=count)
+        if column.dtype.kind == 'i':
+            return numpy.rint(totals).astype(numpy.int64)
+        return totals
+
+    def _group_array(self, keys):
+        combined = [0] * len(self)
+        for name in keys:
+            column = self.columns[name]
+            if isinstance(column, Categorical):
+                ranks = column.ranks()
+                codes, count = [ranks[code] for code in column.codes], len(ranks)
+            else:
+                distinct = {value: rank for rank, value in enumerate(sorted(set(column)))}
+                codes, count = [distinct[value] for value in column], len(distinct)
+            combined = [key * count + code for key, code in zip(combined, codes)]
+
+        distinct = {key: group for group, key in enumerate(sorted(set(combined)))}
+        groups = array.array('i', [distinct[key] for key in combined])
+        # the first row of each group is the one assigned last when going backwards
+        first = dict(zip(reversed(groups), range(len(groups) - 1, -1, -1)))
+        return [first[group] for group in range(len(distinct))], groups
+
+    @staticmethod
+    def _sum_array(column, groups, count):
+        totals = [0] * count
+        for group, value in zip(groups, column):
+            totals[group] += value
+        return array.array(column.typecode, totals)
+
+# loading
+
+class ColumnBuilder:
+    """Collect the values of a column chunk by chunk, converting them according to the report's schema"""
+
+    def __init__(self, convert):
+        self.convert = convert
+        if convert is reports.parse_int:
+            self.data = array.array('q')
+        elif convert is reports.parse_decimal:
+            self.data = array.array('d')
+        else:
+            self.data = array.array('i')
+            self.index = {}
+
+    def extend(self, values):
+        if self.data.typecode == 'i':
+            index = self.index
+            # number the values not seen before (in order of appearance), then look up all codes at C speed
+            for value in dict.fromkeys(values):
+                if value not in index:
+                    index[value] = len(index)
+            self.data.extend(array.array('i', map(index.__getitem__, values)))
+        elif self.data.typecode == 'q':
+            try:
+                self.data.extend(array.array('q', map(int, values)))
+            except ValueError:
+                self.data.extend([int(value) if value else 0 for value in values])
+        else:
+            try:
+                self.data.extend(array.array('d', map(float, values)))
+            except ValueError:
+                self.data.extend([float(value.replace(',', '')) if value else 0.0 for value in values])
+
+    def column(self):
+        data = numpy.frombuffer(self.data, {'i': numpy.intc, 'q': numpy.int64, 'd': numpy.float64}[self.data.typecode]) if numpy is not None else self.data
+        if self.data.typecode != 'i':
+            return data
+        values = list(self.index)
+        if self.convert is reports.parse_date:
+            values = [reports.parse_date(value) for value in values]
+        return Categorical(data, values)
+
+class Loader:
+    """Load one or more reports of the same type into a single Table"""
+
+    def __init__(self, reporttype, version = None, columns = None):
+        self.reporttype = reporttype
+        self.version = version
+        self.columns = columns
+        self.builders = None
+
+    def __len__(self):
+        return len(self.builders[0].data) if self.builders else 0
+
+    def add(self, report):
+        """Append the rows of a report, given as file name, file object or lines of text"""
+
+        if isinstance(report, (str, os.PathLike)):
+            with open(report, encoding='utf-8', newline='') as file:
+                return self.add(file)
+        if hasattr(report, 'read') and not isinstance(report, io.TextIOBase):
+            report = io.TextIOWrapper(report, encoding='utf-8', newline='')
+
+        lines = iter(report)
+        header = next(lines, None)
+        if header is None:
+            return
+        parser = reports.Parser(self.reporttype, self.version, self.columns)
+        parser.header(header)
+        if self.builders is None:
+            self.columns = list(self.columns or header.rstrip('\r\n').split('\t'))
+            self.builders = [ColumnBuilder(parser.types.get(column)) for column in self.columns]
+
+        width = parser.width
+        while True:
+            chunk = list(itertools.islice(lines, CHUNK_ROWS))
+            if not chunk:
+                break
+
+            # split all lines at once into a flat list of fields, so that every column is a slice of it
+            text = ''.join(chunk)
+            if '\r' in text:
+                text = text.replace('\r\n', '\n')
+            text, ended = reports.split_totals(text)
+            if ended:
+                chunk = chunk[:text.count('\n')]
+            fields = text.rstrip('\n').replace('\n', '\t').split('\t')
+            if chunk and len(fields) == len(chunk) * width:
+                for builder, index in zip(self.builders, parser.indices):
+                    builder.extend(fields[index::width])
+            elif chunk:
+                # lines lacking fields aren't rows, just like reports.Parser skips them
+                rows = [row for row in (line.rstrip('\r\n').split('\t') for line in chunk) if len(row) >= width]
+                fields = list(zip(*rows))
+                if fields:
+                    for builder, index in zip(self.builders, parser.indices):
+                        builder.extend(fields[index])
+            if ended:
+                break
+
+    def table(self):
+        return Table(zip(self.columns or [], [builder.column() for builder in self.builders or []]))
+
+def load(report, reporttype, version = None, columns = None):
+    """Load a report (file name, file object or lines of text) into a Table, keeping only the given columns"""
+
+    loader = Loader(reporttype, version, columns)
+    loader.add(report)
+    return loader.table()
+
+def load_files(filenames, reporttype, version = None, columns = None):
+    """Load several reports of the same type into a single Table"""
+
+    loader = Loader(reporttype, version, columns)
+    for filename in filenames:
+        loader.add(filename)
+    return loader.table()
@@ -0,0 +1,116 @@
+# Consolidating the financial reports of a fiscal period in a single currency
+#
+# Financial reports come one per vendor and region, with amounts in the currency of the region.
+# Consolidating a fiscal period loads all of them into one columnar Table (see columns.py), with
+# the vendor number and region code of each report added as columns, converts the Extended
+# Partner Share of every row by the exchange rate of its Partner Share Currency and adds up the
+# results for each vendor, region, product and currency.
+#
+# The conversion runs on whole columns: the currency column is dictionary encoded, so the rate of
+# each of its few distinct values is looked up once and spread over the rows by their codes.
+#
+# Exchange rates are read from a text file with one currency code and rate per line, separated by
+# a comma, tab or blanks, telling how much one unit of the currency is worth in the target currency:
+#
+#     EUR,1.0857
+#     JPY,0.00663
+#
+#     table = load_period('2023_07')
+#     totals = consolidate(table, load_rates('rates.csv'), 'USD')
+
+import os, json, array
+import columns
+
+VENDOR, REGION = 'Vendor', 'Region'
+QUANTITY, AMOUNT, CURRENCY = 'Quantity', 'Extended Partner Share', 'Partner Share Currency'
+
+# columns totals are grouped by by default
+BY = [VENDOR, REGION, 'Vendor Identifier', CURRENCY]
+
+def load_rates(filename, currency = None):
+    """Read a table of exchange rates into a dict mapping currency codes to rates (the target currency, if given, is worth 1)"""
+
+    rates = {currency: 1.0} if currency else {}
+    header = True
+    try:
+        with open(filename, encoding='utf-8') as file:
+            for number, line in enumerate(file, 1):
+                fields = line.replace(',', ' ').split()
+                if not fields or fields[0].startswith('#'):
+                    continue
+                try:
+                    if len(fields) != 2:
+                        raise ValueError
+                    rates[fields[0].upper()] = float(fields[1])
+                except ValueError:
+                    # the first line may be a header
+                    if not header:
+                        raise ValueError("Error: Line {0} of rate table '{1}' doesn't consist of a currency code and a rate".format(number, filename))
+                header = False
+    except OSError as e:
+        raise ValueError("Error: Could not read rate table ({0})".format(e))
+    return rates
+
+def load_period(directory, report_archive = None, by = BY):
+    """Load the financial reports listed in the index.json of a fiscal period directory (see getAllFinancialReports) into a Table
+
+    Only the columns needed for consolidating the reports by the columns in by are kept, along with columns holding the
+    vendor number and region code of each row. Reports listed as archived are read from report_archive.
+    """
+
+    try:
+        with open(os.path.join(directory, 'index.json'), encoding='utf-8') as file:
+            index = json.load(file)
+    except (OSError, ValueError) as e:
+        raise ValueError("Error: Could not read the index of the fiscal period ({0})".format(e))
+
+    names = [name for name in by if name not in (VENDOR, REGION, QUANTITY, AMOUNT, CURRENCY)] + [QUANTITY, AMOUNT, CURRENCY]
+    loader = columns.Loader('Financial', columns=names)
+    vendors, regions, counts = [], [], []
+    for entry in index['reports']:
+        if entry['status'] == 'failed':
+            continue
+        rows = len(loader)
+        if 'file' in entry:
+            try:
+                loader.add(os.path.join(directory, entry['file']))
+            except OSError as e:
+                raise ValueError("Error: Could not read report file ({0})".format(e))
+        elif report_archive is not None:
+            with report_archive.open(entry['key']) as file:
+                loader.add(file)
+        else:
+            raise ValueError("Error: The report of vendor {0}, region {1} is archived, the archive is needed to read it".format(entry['vendor'], entry['region']))
+        vendors.append(str(entry['vendor']))
+        regions.append(entry['region'])
+        counts.append(len(loader) - rows)
+
+    table = loader.table()
+    if not table.columns:
+        raise ValueError("Error: There are no financial reports in '%s'" % directory)
+    table.columns[VENDOR] = columns.repeat(vendors, counts)
+    table.columns[REGION] = columns.repeat(regions, counts)
+    return table
+
+def convert(table, rates, amount = AMOUNT, currency = CURRENCY):
+    """Return the amounts of a column converted by the exchange rates of the currencies given in another column"""
+
+    currencies = table[currency]
+    missing = sorted(set(currencies.values) - set(rates))
+    if missing:
+        raise ValueError("Error: The rate table has no exchange rate for " + ', '.join(value or "(empty currency)" for value in missing))
+    factors = [rates[value] for value in currencies.values]
+    if columns.numpy is not None:
+        return table[amount] * columns.numpy.asarray(factors)[currencies.codes]
+    return array.array('d', [value * factors[code] for value, code in zip(table[amount], currencies.codes)])
+
+def consolidate(table, rates, currency, by = BY):
+    """Add up quantities and amounts converted into currency for each combination of the columns in by
+
+    Amounts in their original currency are added up as well, as long as the totals are grouped by currency.
+    """
+
+    converted = '{0} ({1})'.format(AMOUNT, currency)
+    table = columns.Table(dict(table.columns, **{converted: convert(table, rates)}))
+    sums = [QUANTITY] + ([AMOUNT] if CURRENCY in by else []) + [converted]
+    return table.group_by(by, sums)
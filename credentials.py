@@ -0,0 +1,142 @@
+# Looking up login credentials from where they are kept
+#
+# The access token and password of an Apple ID can be kept in the macOS Keychain, in environment
+# variables, or in files which only their owner may read (on hosts without Keychain, passing them
+# on the command line would show them in process listings). Each of these is a Provider, which
+# looks up a secret by name (the name of a Keychain item or environment variable, the path of a
+# file) and, if it can, stores a new value, e.g. a token generated by generateToken.
+#
+# A Cache in front of the providers looks up each secret only once within ttl seconds and replaces
+# a secret right away when a new value is stored through it. Functions returning the current value
+# of a secret can be handed to ReporterClient instead of the secret itself, so that a long running
+# process (see daemon.py) picks up a token which has been rotated in the meantime; when App Store
+# Connect rejects a secret, the client has it looked up again right away and retries the request:
+#
+#     secrets = Cache(ttl=300)
+#     client = ReporterClient('your@apple-id.com', access_token=secrets.secret(FILE, '~/.itc-token'))
+
+import os, abc, time, threading
+import cache
+
+class Provider(abc.ABC):
+    """Source of secrets, looked up by name"""
+
+    description = "this source"
+
+    @abc.abstractmethod
+    def get(self, name):
+        """Return the value of a secret, or raise ValueError if it can't be found"""
+
+    def set(self, name, value):
+        raise ValueError("Error: Secrets can't be stored in {0}".format(self.description))
+
+class KeychainProvider(Provider):
+    """Generic password items in the default macOS Keychain, named like the item"""
+
+    description = "the macOS Keychain"
+
+    def get(self, name):
+        import keychain
+        try:
+            return keychain.find_generic_password(None, name, '')
+        except keychain.Error:
+            raise ValueError("Error: Could not find an item named '{0}' in the default Keychain".format(name))
+
+    def set(self, name, value):
+        import keychain
+        keychain.set_generic_password(None, name, '', value)
+
+class EnvironmentProvider(Provider):
+    """Environment variables, named like the variable"""
+
+    description = "environment variables"
+
+    def get(self, name):
+        value = os.environ.get(name)
+        if not value:
+            raise ValueError("Error: Environment variable '{0}' is not set".format(name))
+        return value
+
+class FileProvider(Provider):
+    """Files holding nothing but the secret, named by their path, which must not be accessible by anyone but their owner"""
+
+    description = "files"
+
+    def get(self, name):
+        filename = os.path.expanduser(name)
+        try:
+            with open(filename, encoding='utf-8') as file:
+                status = os.fstat(file.fileno())
+                if status.st_mode & 0o077:
+                    raise ValueError("Error: Credentials file '{0}' must not be accessible by others than its owner (use chmod 600)".format(name))
+                if hasattr(os, 'getuid') and status.st_uid != os.getuid():
+                    raise ValueError("Error: Credentials file '{0}' must be owned by the current user".format(name))
+                value = file.read().strip()
+        except OSError as e:
+            raise ValueError("Error: Could not read credentials file ({0})".format(e))
+        if not value:
+            raise ValueError("Error: Credentials file '{0}' is empty".format(name))
+        return value
+
+    def set(self, name, value):
+        """Replace the file atomically, creating it accessible by its owner only"""
+
+        with cache.atomic_write(os.path.expanduser(name), permissions=0o600, encoding='utf-8') as file:
+            file.write(value + '\n')
+
+KEYCHAIN, ENVIRONMENT, FILE = KeychainProvider(), EnvironmentProvider(), FileProvider()
+
+class Cache:
+    """Thread safe memo of secrets looked up from providers, each kept for ttl seconds"""
+
+    def __init__(self, ttl = 300.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._secrets = {}
+
+    def get(self, provider, name):
+        """Return a secret, looking it up only if it hasn't been looked up within ttl seconds"""
+
+        with self._lock:
+            secret = self._secrets.get((provider, name))
+        if secret and time.monotonic() < secret[1]:
+            return secret[0]
+
+        value = provider.get(name)
+        with self._lock:
+            self._secrets[(provider, name)] = (value, time.monotonic() + self.ttl)
+        return value
+
+    def set(self, provider, name, value):
+        """Store a new value of a secret, which is used from then on"""
+
+        provider.set(name, value)
+        with self._lock:
+            self._secrets[(provider, name)] = (value, time.monotonic() + self.ttl)
+
+    def invalidate(self, provider = None, name = None):
+        """Forget a secret (or all secrets of a provider, or all secrets), so it is looked up again when needed"""
+
+        with self._lock:
+            for key in list(self._secrets):
+                if provider in (None, key[0]) and name in (None, key[1]):
+                    del self._secrets[key]
+
+    def secret(self, provider, name):
+        """Return a function which returns the current value of a secret"""
+
+        return Secret(self, provider, name)
+
+class Secret:
+    """Function returning the current value of a secret kept in a Cache, which can be told to look the secret up again"""
+
+    def __init__(self, cache, provider, name):
+        self.cache = cache
+        self.provider = provider
+        self.name = name
+
+    def __call__(self):
+        return self.cache.get(self.provider, self.name)
+
+    def invalidate(self):
+        self.cache.invalidate(self.provider, self.name)
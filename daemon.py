@@ -0,0 +1,135 @@
+# Long-running reporter service answering queries from other local programs
+#
+# The daemon keeps a single ReporterClient warm: login credentials are looked up once, connections
+# to App Store Connect are kept alive and identical queries arriving at the same time are sent
+# upstream only once. Queries are made via HTTP, either on a localhost port or on a Unix socket,
+# by naming a client method and passing its arguments as URL parameters, e.g.
+#
+#     curl 'http://localhost:8765/get_sales_report?vendor=85442109&datetype=Daily&date=20230718'
+#     curl --unix-socket /tmp/reporter.sock 'http://localhost/get_status?service=Finance'
+#
+# A report is answered with its (unzipped) content, anything else with the text the reporter
+# service has sent. GET /stats returns connection and deduplication statistics as JSON.
+
+import os, json, socketserver, http.server, urllib.parse
+import retry
+
+# client methods which may be called through the daemon, along with the parameters each of them takes from the URL
+# (token manipulation is deliberately left out, and so is the destination of reports, which the daemon decides on)
+METHODS = {
+    'get_status': ('service',),
+    'get_accounts': ('service',),
+    'get_vendors': (),
+    'get_vendors_and_regions': (),
+    'get_report_version': ('reporttype', 'reportsubtype'),
+    'get_financial_report': ('vendor', 'regioncode', 'fiscalyear', 'fiscalperiod'),
+    'get_sales_report': ('vendor', 'datetype', 'date'),
+    'get_subscription_report': ('vendor', 'date', 'version'),
+    'get_subscription_event_report': ('vendor', 'date', 'version'),
+    'get_subscriber_report': ('vendor', 'date', 'version'),
+    'get_newsstand_report': ('vendor', 'datetype', 'date'),
+    'get_opt_in_report': ('vendor', 'date'),
+    'get_pre_order_report': ('vendor', 'datetype', 'date'),
+    'get_podcasts_subscription_snapshot_report': ('vendor', 'date'),
+}
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """Translate HTTP requests into calls of the shared client"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        # connections via Unix socket have no client address
+        return self.client_address[0] if self.client_address else 'local'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        name = url.path.strip('/')
+        params = dict(urllib.parse.parse_qsl(url.query))
+
+        if name == 'stats':
+            client = self.server.client
+            stats = dict(connections=client.pool.stats(), single_flight=client.single_flight.stats() if client.single_flight else None)
+            return self.respond(200, json.dumps(stats).encode(), 'application/json')
+        if name not in METHODS:
+            return self.respond(404, ("Unknown query '%s'\n" % name).encode())
+
+        unknown = sorted(set(params) - set(METHODS[name]))
+        if unknown:
+            return self.respond(400, ("Query '%s' doesn't take parameter(s) %s\n" % (name, ', '.join(unknown))).encode())
+
+        method = getattr(self.server.client, name)
+        if name.startswith('get_') and name.endswith('_report'):
+            params.update(sync=self.server.sync)
+        try:
+            result = method(**params)
+        except TypeError as e:
+            return self.respond(400, (str(e) + '\n').encode())
+        except retry.TransientError as e:
+            return self.respond(503, (str(e) + '\n').encode())
+        except ValueError as e:
+            return self.respond(502, (str(e).strip() + '\n').encode())
+
+        headers = {}
+        if result.filename:
+            headers = {'X-Report-Filename': result.filename, 'X-Report-Cached': 'yes' if result.cached else 'no'}
+        content_type = 'text/plain; charset=utf-8'
+        if result.filename:
+            content_type = 'application/gzip' if result.filename.endswith('.gz') else 'text/tab-separated-values; charset=utf-8'
+        if result.path:
+            with open(result.path, 'rb') as file:
+                return self.respond(200, file, content_type, headers, os.path.getsize(result.path))
+        if result.archive:
+            # the unzipped size of an archived report isn't known before reading it
+            return self.respond(200, result.archive.read(result.query), content_type, headers)
+        self.respond(200, result.content, content_type, headers)
+
+    def respond(self, status, body, content_type = 'text/plain; charset=utf-8', headers = None, length = None):
+        """Send a response whose body is either bytes or a file to be copied"""
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body) if length is None else length))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if isinstance(body, bytes):
+            self.wfile.write(body)
+        else:
+            while True:
+                chunk = body.read(64 * 1024)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+
+class HTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+def create_server(client, port = None, socket_path = None, sync = False, verbose = False):
+    """Set up a server for the client, listening either on a localhost port or on a Unix socket"""
+
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        # the daemon acts with our credentials, so don't let anybody else connect to it
+        umask = os.umask(0o177)
+        try:
+            server = UnixHTTPServer(socket_path, RequestHandler)
+        finally:
+            os.umask(umask)
+    else:
+        server = HTTPServer(('127.0.0.1', port), RequestHandler)
+
+    server.client = client
+    server.sync = sync
+    server.verbose = verbose
+    return server
@@ -0,0 +1,149 @@
+# Instrumentation of the queries sent to the reporter service
+#
+# Every query is measured by a Span: how long it took to open a connection (name resolution,
+# TCP and TLS handshakes), to wait for the response headers (mostly the time the server needs
+# to come up with a report), to transfer the body, to unzip it and to write it to its destination,
+# as well as how many bytes went over the wire and how many came out of unzipping, how often the
+# query was retried and whether it was answered from the report cache. Measuring costs a few
+# clock readings per 64 KiB of report, so it is always done; a Recorder, if any, collects spans.
+#
+# A Recorder appends one JSON object per span to a trace file and keeps latency histograms and
+# counters per method (e.g. Sales.getReport), which it writes as a Prometheus textfile (for the
+# textfile collector of node_exporter) when closed and, for long running processes, periodically.
+
+import time, json, bisect, threading, datetime
+import cache
+
+# upper bounds of the latency histogram buckets in seconds
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+class Span:
+    """Measurements of a single query, recorded by recorder when the span is left"""
+
+    def __init__(self, command, recorder = None):
+        self.command = command
+        self.method = command.split(',')[0]
+        self.recorder = recorder
+        self.timestamp = None
+        self.total = None
+        self.phases = {}
+        self.wire_bytes = 0
+        self.bytes = 0
+        self.retries = 0
+        self.reused = None
+        self.status = None
+        self.cached = False
+        self.error = None
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0) + seconds
+
+    def __enter__(self):
+        self.timestamp = time.time()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.total = time.perf_counter() - self._started
+        if value is not None:
+            self.error = str(value).strip() or type.__name__
+        if self.recorder:
+            self.recorder.record(self)
+
+    def event(self):
+        """Return the span as a trace event"""
+
+        return dict(time=datetime.datetime.fromtimestamp(self.timestamp, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+                    command=self.command, status=self.status, cached=self.cached, retries=self.retries, reused=self.reused,
+                    total=round(self.total, 6), phases={phase: round(seconds, 6) for phase, seconds in self.phases.items()},
+                    wire_bytes=self.wire_bytes, bytes=self.bytes, error=self.error)
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+
+class Recorder:
+    """Thread safe collector of spans, writing a JSON-lines trace and/or a Prometheus textfile"""
+
+    def __init__(self, trace = None, textfile = None, interval = 15.0):
+        self.textfile = textfile
+        self.interval = interval
+        self._trace = open(trace, 'a', buffering=1) if trace else None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._written = time.monotonic()
+
+    def record(self, span):
+        line = json.dumps(span.event()) + '\n' if self._trace else None
+        outcome = 'cached' if span.cached else 'error' if span.error else 'ok'
+
+        with self._lock:
+            if line:
+                self._trace.write(line)
+            self._histogram(span.method, 'total').observe(span.total)
+            for phase, seconds in span.phases.items():
+                self._histogram(span.method, phase).observe(seconds)
+            self._count('itc_reporter_requests_total', (span.method, outcome), 1)
+            self._count('itc_reporter_retries_total', (span.method,), span.retries)
+            self._count('itc_reporter_wire_bytes_total', (span.method,), span.wire_bytes)
+            self._count('itc_reporter_decompressed_bytes_total', (span.method,), span.bytes)
+            due = self.textfile and time.monotonic() - self._written >= self.interval
+            if due:
+                self._written = time.monotonic()
+
+        if due:
+            self.write_textfile()
+
+    def _histogram(self, method, phase):
+        histogram = self._histograms.get((method, phase))
+        if histogram is None:
+            histogram = self._histograms[(method, phase)] = Histogram()
+        return histogram
+
+    def _count(self, name, labels, amount):
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def textfile_lines(self):
+        """Render the histograms and counters in the Prometheus text exposition format"""
+
+        lines = ['# HELP itc_reporter_request_duration_seconds Time spent on queries to the reporter service, in total and per phase',
+                 '# TYPE itc_reporter_request_duration_seconds histogram']
+        with self._lock:
+            for (method, phase), histogram in sorted(self._histograms.items()):
+                labels = 'method="{0}",phase="{1}"'.format(method, phase)
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append('itc_reporter_request_duration_seconds_bucket{{{0},le="{1}"}} {2}'.format(labels, bound, cumulative))
+                lines.append('itc_reporter_request_duration_seconds_sum{{{0}}} {1}'.format(labels, histogram.sum))
+                lines.append('itc_reporter_request_duration_seconds_count{{{0}}} {1}'.format(labels, cumulative))
+
+            names = sorted(set(name for name, labels in self._counters))
+            for name in names:
+                lines.append('# TYPE {0} counter'.format(name))
+                for (counter, labels), value in sorted(self._counters.items()):
+                    if counter == name:
+                        label_names = ('method', 'outcome')[:len(labels)]
+                        lines.append('{0}{{{1}}} {2}'.format(name, ','.join('{0}="{1}"'.format(*label) for label in zip(label_names, labels)), value))
+        return lines
+
+    def write_textfile(self):
+        """Replace the textfile atomically, so a collector never reads a partial one"""
+
+        lines = self.textfile_lines()
+        with self._write_lock, cache.atomic_write(self.textfile) as file:
+            file.write('\n'.join(lines) + '\n')
+
+    def close(self):
+        if self.textfile:
+            self.write_textfile()
+        if self._trace:
+            self._trace.close()
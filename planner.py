@@ -0,0 +1,62 @@
+# Planning which reports to request for covering a range of days
+#
+# Reports are available for days, weeks (Monday to Sunday), calendar months and calendar years.
+# A range of days can be covered by many combinations of them; the planner finds one needing the
+# fewest requests. Reports already in the cache cost nothing. Downstream processing may need
+# figures per day, week, month or year (the granularity), so a report must not be coarser than the
+# granularity, nor span two of its periods: for monthly figures, a week from January 29th to
+# February 4th doesn't help, but for yearly figures it does.
+
+import datetime, calendar, collections
+import cache
+
+DATETYPES = ('Daily', 'Weekly', 'Monthly', 'Yearly')
+
+Report = collections.namedtuple('Report', 'datetype date cached')
+
+def period(datetype, day):
+    """Return the first and the last day of the period of the given date type which contains day"""
+
+    if datetype == 'Weekly':
+        first = day - datetime.timedelta(days=day.weekday())
+        return first, first + datetime.timedelta(days=6)
+    if datetype == 'Monthly':
+        return day.replace(day=1), day.replace(day=calendar.monthrange(day.year, day.month)[1])
+    if datetype == 'Yearly':
+        return day.replace(month=1, day=1), day.replace(month=12, day=31)
+    return day, day
+
+def plan(first, last, granularity, cached = None):
+    """Return the Reports covering the days first to last which need the fewest requests
+
+    cached(datetype, date) tells whether a report is in the cache already. Among plans needing the same number of
+    requests, the one with the fewest reports is chosen.
+    """
+
+    if first > last:
+        raise ValueError("Error: The first date of a range must not be later than the last one")
+    datetypes = DATETYPES[:DATETYPES.index(granularity) + 1]
+
+    # best[offset] is the cheapest plan for the days from first + offset to last:
+    # (requests, reports, first report of the plan, offset of the day following that report)
+    days = (last - first).days + 1
+    best = [None] * days + [(0, 0, None, None)]
+    for offset in range(days - 1, -1, -1):
+        day = first + datetime.timedelta(days=offset)
+        for datetype in reversed(datetypes):
+            start, end = period(datetype, day)
+            if start != day or end > last or end > period(granularity, day)[1]:
+                continue
+            following = offset + (end - start).days + 1
+            date = end.strftime(cache.DATE_FORMATS[datetype])
+            is_cached = bool(cached and cached(datetype, date))
+            requests, reports = best[following][0] + (not is_cached), best[following][1] + 1
+            if best[offset] is None or (requests, reports) < best[offset][:2]:
+                best[offset] = (requests, reports, Report(datetype, date, is_cached), following)
+
+    reports = []
+    offset = 0
+    while offset < days:
+        reports.append(best[offset][2])
+        offset = best[offset][3]
+    return reports
@@ -33,294 +33,705 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-import sys, argparse, urllib.request, urllib.parse, urllib.error, json, gzip, re, datetime, io
-if sys.platform == 'darwin':
-    import keychain
+import sys, os, json, argparse, threading, datetime
+import transport, cache, client, retry, metrics, credentials
 
-VERSION = '2.2'
-ENDPOINT_SALES = 'https://reportingitc-reporter.apple.com/reportservice/sales/v1'
-ENDPOINT_FINANCE = 'https://reportingitc-reporter.apple.com/reportservice/finance/v1'
+# modules needed by only some of the commands (e.g. Keychain access, the daemon or NumPy for summarize)
+# are imported where they are used, so that running a single query starts quickly
 
 # App Store Connect (formerly named iTC) queries
 
 def itc_get_vendors(args):
-    command = 'Sales.getVendors'
-    output_result(post_request(ENDPOINT_SALES, get_credentials(args), command))
+    output_result(args.client.get_vendors(), format=args.format)
 
 def itc_get_status(args):
-    command = args.service + '.getStatus'
-    endpoint = ENDPOINT_SALES if args.service == 'Sales' else ENDPOINT_FINANCE
-    output_result(post_request(endpoint, get_credentials(args), command))
+    output_result(args.client.get_status(args.service), format=args.format)
 
 def itc_get_accounts(args):
-    command = args.service + '.getAccounts'
-    endpoint = ENDPOINT_SALES if args.service == 'Sales' else ENDPOINT_FINANCE
-    output_result(post_request(endpoint, get_credentials(args), command))
+    output_result(args.client.get_accounts(args.service), format=args.format)
 
 def itc_get_vendor_and_regions(args):
-    command = 'Finance.getVendorsAndRegions'
-    output_result(post_request(ENDPOINT_FINANCE, get_credentials(args), command))
+    output_result(args.client.get_vendors_and_regions(), format=args.format)
 
 def itc_get_report_version(args):
-    # service is limited to Sales for now because although documented it doesn't work for Finance
-    command = 'Sales.getReportVersion, {0},{1}'.format(args.reporttype, args.reportsubtype)
-    output_result(post_request(ENDPOINT_SALES, get_credentials(args), command))
+    output_result(args.client.get_report_version(args.reporttype, args.reportsubtype), format=args.format)
 
 def itc_get_financial_report(args):
-    command = 'Finance.getReport, {0},{1},Financial,{2},{3}'.format(args.vendor, args.regioncode, args.fiscalyear, args.fiscalperiod)
-    output_result(post_request(ENDPOINT_FINANCE, get_credentials(args), command))
+    download_report(args, args.client.get_financial_report, args.vendor, args.regioncode, args.fiscalyear, args.fiscalperiod)
+
+def itc_get_all_financial_reports(args):
+    directory = os.path.join(args.output_dir, '{0}_{1:02d}'.format(args.fiscalyear, int(args.fiscalperiod)))
+    os.makedirs(directory, exist_ok=True)
+    outcomes = args.client.get_all_financial_reports(args.fiscalyear, args.fiscalperiod, directory, args.sync, args.jobs)
+
+    index = []
+    failures = []
+    for vendor, regioncode, outcome in outcomes:
+        entry = dict(vendor=vendor, region=regioncode)
+        if isinstance(outcome, Exception) or not (outcome.path or outcome.archive):
+            error = str(outcome) if isinstance(outcome, Exception) else outcome.text
+            entry.update(status='failed', error=error.strip())
+            failures.append("  vendor {0}, region {1}: {2}".format(vendor, regioncode, error.strip()))
+        else:
+            entry.update(status='cached' if outcome.cached else 'downloaded')
+            if outcome.path and args.cache_dir:
+                # the reports stay in the cache, the directory of the fiscal period gets links to them
+                path = os.path.join(directory, str(vendor), os.path.basename(outcome.path))
+                link_report(outcome.path, path)
+                entry.update(file=os.path.relpath(path, directory))
+            elif outcome.path:
+                entry.update(file=os.path.relpath(outcome.path, directory))
+            else:
+                # archived reports are listed by the query they are archived under
+                entry.update(key=outcome.query)
+            output_result(outcome)
+        index.append(entry)
+
+    # write the index of the whole fiscal period, so other tools don't have to look for the report files
+    filename = os.path.join(directory, 'index.json')
+    with cache.atomic_write(filename) as file:
+        json.dump(dict(fiscalyear=args.fiscalyear, fiscalperiod=args.fiscalperiod, reports=index), file, indent=2)
+    print_message("Index of {0} reports written to {1}".format(len(index), filename))
+
+    if failures:
+        raise ValueError('\n'.join(["{0} of {1} reports could not be retrieved:".format(len(failures), len(index))] + failures))
+
+def link_report(source, destination):
+    """Make a report file show up at another place as well, linking it if possible and copying it otherwise"""
+
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        import shutil
+        shutil.copyfile(source, destination)
 
 def itc_get_sales_report(args):
-    command = 'Sales.getReport, {0},Sales,Summary,{1},{2}'.format(args.vendor, args.datetype, args.date)
-    output_result(post_request(ENDPOINT_SALES, get_credentials(args), command))
+    method = args.client.derive_sales_report if args.derive else args.client.get_sales_report
+    download_report(args, method, args.vendor, args.datetype, args.date)
 
 def itc_get_subscription_report(args):
-    command = 'Sales.getReport, {0},Subscription,Summary,Daily,{1},{2}'.format(args.vendor, args.date, args.version)
-    output_result(post_request(ENDPOINT_SALES, get_credentials(args), command))
+    download_report(args, args.client.get_subscription_report, args.vendor, args.date, args.version)
 
 def itc_get_subscription_event_report(args):
-    command = 'Sales.getReport, {0},SubscriptionEvent,Summary,Daily,{1},{2}'.format(args.vendor, args.date, args.version)
-    output_result(post_request(ENDPOINT_SALES, get_credentials(args), command))
+    download_report(args, args.client.get_subscription_event_report, args.vendor, args.date, args.version)
 
 def itc_get_subscriber_report(args):
-    command = 'Sales.getReport, {0},Subscriber,Detailed,Daily,{1},{2}'.format(args.vendor, args.date, args.version)
-    output_result(post_request(ENDPOINT_SALES, get_credentials(args), command))
+    download_report(args, args.client.get_subscriber_report, args.vendor, args.date, args.version)
 
 def itc_get_newsstand_report(args):
-    command = 'Sales.getReport, {0},Newsstand,Detailed,{1},{2}'.format(args.vendor, args.datetype, args.date)
-    output_result(post_request(ENDPOINT_SALES, get_credentials(args), command))
+    download_report(args, args.client.get_newsstand_report, args.vendor, args.datetype, args.date)
 
 def itc_get_opt_in_report(args):
-    command = 'Sales.getReport, {0},Sales,Opt-In,Weekly,{1}'.format(args.vendor, args.date)
-    output_result(post_request(ENDPOINT_SALES, get_credentials(args), command), False) # do not attempt to unzip because it's password protected
+    download_report(args, args.client.get_opt_in_report, args.vendor, args.date)
 
 def itc_get_pre_order_report(args):
-    command = 'Sales.getReport, {0},Pre-Order,Summary,{1},{2}'.format(args.vendor, args.datetype, args.date)
-    output_result(post_request(ENDPOINT_SALES, get_credentials(args), command))
+    download_report(args, args.client.get_pre_order_report, args.vendor, args.datetype, args.date)
 
 def itc_get_podcasts_subscription_snapshot_report(args):
-    command = 'Sales.getReport, {0},apSubscriptionsSnapshot,Summary,Daily,{1}'.format(args.vendor, args.date)
-    output_result(post_request(ENDPOINT_SALES, get_credentials(args), command))
+    download_report(args, args.client.get_podcasts_subscription_snapshot_report, args.vendor, args.date)
 
 def itc_view_token(args):
-    command = 'Sales.viewToken'
-    output_result(post_request(ENDPOINT_SALES, get_credentials(args), command))
+    output_result(args.client.view_token(), format=args.format)
 
 def itc_generate_token(args):
-    command = 'Sales.generateToken'
-
-    # generating a new token requires mirroring back a request id to the iTC server, so let's examine the response header...
-    _, header = post_request(ENDPOINT_SALES, get_credentials(args), command)
-    service_request_id = header.get('service_request_id')
-
-    # ...and post back the request id
-    result = post_request(ENDPOINT_SALES, get_credentials(args), command, "&isExistingToken=Y&requestId=" + service_request_id)
-    output_result(result)
-
-    # optionally store the new token in Keychain upon success
-    content, _ = result
-    if content and args.update_keychain_item:
-        # extract token for both operation modes (Robot.XML or Normal)
-        content = content.decode()
-        token = re.findall('<AccessToken>(.*?)</AccessToken>', content) or re.findall('AccessToken:(.*?)$', content, re.M)
+    result = args.client.generate_token()
+    output_result(result, format=args.format)
+
+    # optionally store the new token in Keychain or a file upon success, replacing the token cached for this process
+    if result.content and (args.update_keychain_item or args.update_token_file):
+        token = result.parse().access_token
         if token:
-            token = token[0]
-            keychain.set_generic_password(None, args.update_keychain_item, '', token)
-            if not args.mode == 'Robot.XML': print("Keychain has been updated.")
+            for provider, name, message in ((credentials.KEYCHAIN, args.update_keychain_item, "Keychain has been updated."),
+                                            (credentials.FILE, args.update_token_file, "Token file has been updated.")):
+                if name:
+                    args.secrets.set(provider, name, token)
+                    if not args.mode == 'Robot.XML' and args.format == 'text': print(message)
 
 def itc_delete_token(args):
-    command = 'Sales.deleteToken'
-    output_result(post_request(ENDPOINT_SALES, get_credentials(args), command))
+    output_result(args.client.delete_token(), format=args.format)
+
+def itc_serve(args):
+    import daemon
+    server = daemon.create_server(args.client, args.port, args.socket, args.sync, args.verbose)
+    print_message("Serving queries on %s" % (args.socket or 'http://127.0.0.1:%d' % server.server_address[1]), stderr=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket:
+            os.remove(args.socket)
+
+# processing of downloaded reports
+
+def itc_summarize(args):
+    import columns
+    try:
+        table = columns.load_files(args.files, args.reporttype, args.version, args.by + args.sum)
+    except OSError as e:
+        raise ValueError("Error: Could not read report file ({0})".format(e))
+    totals = table.group_by(args.by, args.sum)
+    output_table(totals)
+
+def itc_consolidate(args):
+    import consolidate
+    directory = os.path.join(args.output_dir, '{0}_{1:02d}'.format(args.fiscalyear, int(args.fiscalperiod)))
+    rates = consolidate.load_rates(args.rates, args.currency)
+    report_archive = None
+    if args.from_archive:
+        import archive
+        report_archive = archive.Archive(args.from_archive)
+    try:
+        table = consolidate.load_period(directory, report_archive, args.by)
+    finally:
+        if report_archive:
+            report_archive.close()
+    totals = consolidate.consolidate(table, rates, args.currency, args.by)
+    output_table(totals)
+
+def itc_compact(args):
+    import archive
+    with archive.Archive(args.directory) as report_archive:
+        freed = report_archive.compact()
+        print_message("{0} reports kept in {1}, {2:.1f} MB freed".format(len(report_archive.entries()), args.directory, freed / 1024 / 1024))
+
+def itc_ingest(args):
+    import warehouse
+    with warehouse.Warehouse(args.database) as database:
+        try:
+            outcomes = [(filename, database.ingest_file(filename, args.reporttype, args.version)) for filename in args.files]
+        except OSError as e:
+            raise ValueError("Error: Could not read report file ({0})".format(e))
+        if args.from_cache:
+            outcomes += database.ingest_cache(cache.ReportCache(args.from_cache))
+        if args.from_archive:
+            import archive
+            with archive.Archive(args.from_archive) as report_archive:
+                outcomes += database.ingest_archive(report_archive)
+
+    ingested = [rows for key, rows in outcomes if rows is not None]
+    print_message("{0} reports with {1} rows ingested into {2}, {3} reports ingested already".format(len(ingested), sum(ingested), args.database, len(outcomes) - len(ingested)))
 
 # login credentials
 
-def get_credentials(args):
-    """Select App Store Connect login credentials depending on given command line arguments"""
+SECRET_SOURCES = (('keychain_item', credentials.KEYCHAIN), ('env', credentials.ENVIRONMENT), ('file', credentials.FILE))
 
-    # for most commands an App Store Connect access token is needed - fetched either from the command line or from Keychain...
-    access_token = keychain.find_generic_password(None, args.access_token_keychain_item, '') if args.access_token_keychain_item else args.access_token
+def secret_source(args, kind):
+    """Tell where the secret of a kind ('access_token' or 'password') is kept according to the command line as (provider, name), or None"""
 
-    # ...but commands for access token manipulation need the plaintext password of the App Store Connect account
-    password = keychain.find_generic_password(None, args.password_keychain_item, '') if args.password_keychain_item else args.password 
+    for suffix, provider in SECRET_SOURCES:
+        name = getattr(args, kind + '_' + suffix, None)
+        if name:
+            return provider, name
+    return None
 
-    return (args.userid, access_token, password, str(args.account), args.mode)
+def create_client(args):
+    """Set up a client with the login credentials and options given on the command line"""
 
-# HTTP request
+    # for most commands an App Store Connect access token is needed - given on the command line or looked up (and cached)
+    # from Keychain, an environment variable or a file...
+    source = secret_source(args, 'access_token')
+    access_token = args.secrets.secret(*source) if source else args.access_token
 
-def build_json_request_string(credentials, query):
-    """Build a JSON string from the urlquoted credentials and the actual query input"""
+    # ...but commands for access token manipulation need the plaintext password of the App Store Connect account
+    source = secret_source(args, 'password')
+    password = args.secrets.secret(*source) if source else args.password
 
-    userid, accessToken, password, account, mode = credentials
+    report_cache = cache.ReportCache(args.cache_dir, args.final_after) if getattr(args, 'cache_dir', None) else None
+    report_archive = None
+    if getattr(args, 'archive', None):
+        import archive
+        report_archive = archive.Archive(args.archive, args.final_after)
+    pool = transport.ConnectionPool(maxsize=getattr(args, 'jobs', 8), timeout=args.timeout)
+    retry_policy = retry.RetryPolicy(args.retries, args.backoff, args.max_delay)
+    rate_limiter = retry.RateLimiter(args.rate, max(1, args.rate)) if args.rate else None
+    circuit_breaker = retry.CircuitBreaker(args.breaker_threshold, args.breaker_cooldown) if args.breaker_threshold else None
 
-    request = dict(userid=userid, version=VERSION, mode=mode, queryInput=query)
-    if account: request.update(account=account) # empty account info would result in error 404
-    if accessToken: request.update(accesstoken=accessToken)
-    if password: request.update(password=password)
+    single_flight = client.SingleFlight() if args.command == 'serve' else None
+    recorder = metrics.Recorder(args.trace, args.metrics_file) if args.trace or args.metrics_file else None
 
-    request = dict(jsonRequest=json.dumps(request))
+    return client.ReporterClient(args.userid, access_token, password, args.account, args.mode, args.server, pool, report_cache, retry_policy, rate_limiter, circuit_breaker, single_flight, recorder, report_archive)
 
-    return urllib.parse.urlencode(request)
+# output
 
-def post_request(endpoint, credentials, command, url_params = None):
-    """Execute the HTTP POST request"""
+stdout_lock = threading.Lock()
 
-    command = "[p=Reporter.properties, %s]" % command
-    request_data = build_json_request_string(credentials, command)
-    if url_params: request_data += url_params
+def print_message(msg, stderr = False):
+    """Print a message in one piece, even if concurrent workers print messages at the same time"""
 
-    request = urllib.request.Request(endpoint, request_data.encode())
-    request.add_header('Accept', 'text/html,image/gif,image/jpeg; q=.2, */*; q=.2')
+    with stdout_lock:
+        print(msg, file=sys.stderr if stderr else sys.stdout)
 
-    try:
-        response = urllib.request.urlopen(request)
-        content = response.read()
-        header = response.info()
-
-        return (content, header)
-    except urllib.error.HTTPError as e:
-        if e.code == 400 or e.code == 401 or e.code == 403 or e.code == 404:
-            # for these error codes, the body always contains an error message
-            raise ValueError(e.read().decode())
-        else:
-            raise ValueError("HTTP Error %s. Did you choose reasonable query arguments?" % str(e.code))
-
-def output_result(result, unzip = True):
-    """Output (and when necessary unzip) the result of the request to the screen or into a report file"""
-
-    content, header = result
-
-    # unpack content into the final report file if it is gzip compressed.
-    if header.get_content_type() == 'application/a-gzip':
-        msg = header.get('downloadmsg')
-        filename = header.get('filename') or 'report.txt.gz'
-        if unzip:
-            msg = msg.replace('.txt.gz', '.txt')
-            filename = filename[:-3]
-            content = gzip.GzipFile(fileobj=io.BytesIO(content)).read()
-        file = open(filename, 'wb')
-        file.write(content)
-        file.close()
-        print(msg)
+def output_result(result, stderr = False, format = 'text'):
+    """Output the result of a query, or the message about a downloaded report file, to the screen
+
+    With format 'json', responses to queries are parsed and printed as JSON (responses without structure as a message).
+    """
+
+    if format == 'json' and not result.filename:
+        import responses
+        parsed = result.parse()
+        print_message(json.dumps(responses.to_json(parsed) if parsed is not None else dict(message=result.text.strip()), indent=2))
+    elif result.cached:
+        print_message("Report {0} is up to date".format(result.path or result.filename), stderr)
+    elif result.filename:
+        print_message(result.message, stderr)
     else:
-        print(content.decode())
+        print_message(result.text)
+
+def output_table(table):
+    """Print a Table as tab separated lines with a header, amounts rounded to cents"""
+
+    lines = ['\t'.join(table.columns)]
+    for row in table.rows():
+        lines.append('\t'.join('%.2f' % value if isinstance(value, float) else str(value) for value in row))
+    print_message('\n'.join(lines))
+
+def output_report_file(result):
+    """Copy an already downloaded report file (or archived report) to stdout"""
+
+    with result.open() as file, stdout_lock:
+        client.write_report(file, sys.stdout.buffer, False)
+        sys.stdout.buffer.flush()
+
+def download_report(args, method, *params):
+    """Download a report into the current directory (or the report cache or archive) or onto stdout, using one of the client's methods
+
+    With --ingest, the report is loaded into the warehouse as well; unless it goes into the cache or archive, it is
+    streamed into the database right away instead of being written to a file.
+    """
+
+    stored = args.client.report_cache or args.client.archive
+    if args.warehouse and not stored:
+        with args.warehouse.stream(args.reporttype, getattr(args, 'version', None), args.vendor) as stream:
+            result = method(*params, destination=stream)
+            stream.key = result.filename
+        return output_ingested(args, result, stream.rows)
+
+    if args.stdout and not stored:
+        # reports are downloaded concurrently into temporary files and copied to stdout one at a time, so that their
+        # output doesn't get mixed up
+        import tempfile
+        with tempfile.TemporaryFile() as file:
+            result = method(*params, destination=file)
+            file.seek(0)
+            with stdout_lock:
+                client.write_report(file, sys.stdout.buffer, False)
+                sys.stdout.buffer.flush()
+    else:
+        result = method(*params, destination=os.curdir, sync=args.sync)
+        if args.stdout and (result.path or result.archive):
+            output_report_file(result)
+
+    output_result(result, stderr=args.stdout)
+    if args.warehouse and result.path:
+        rows = args.warehouse.ingest_file(result.path, args.reporttype, getattr(args, 'version', None), args.vendor, result.filename)
+        output_ingested(args, result, rows)
+    elif args.warehouse and result.archive:
+        entry = result.archive.lookup(result.query)
+        with result.open() as file:
+            rows = args.warehouse.ingest(file, args.reporttype, getattr(args, 'version', None), args.vendor, result.filename, entry['sha256'])
+        output_ingested(args, result, rows)
+
+def output_ingested(args, result, rows):
+    """Tell how many rows of a report have been ingested into the warehouse"""
+
+    if not result.filename:
+        output_result(result, stderr=args.stdout)
+    elif rows is None:
+        print_message("Report {0} has been ingested into {1} already".format(result.filename, args.ingest), args.stdout)
+    else:
+        print_message("Report {0} ingested into {1} ({2} rows)".format(result.filename, args.ingest, rows), args.stdout)
+
+# batch processing
+
+def expand_date_range(datetype, first, last):
+    """Return the report dates of the given type which lie between first and last (inclusive)"""
+
+    format = cache.DATE_FORMATS[datetype]
+    date = datetime.datetime.strptime(first, format).date()
+    end = datetime.datetime.strptime(last, format).date()
+    dates = []
+
+    if datetype == 'Weekly':
+        # weekly reports are identified by the Sunday that week ends
+        date += datetime.timedelta(days=(6 - date.weekday()))
+
+    while date <= end:
+        dates.append(date.strftime(format))
+        if datetype == 'Daily':
+            date += datetime.timedelta(days=1)
+        elif datetype == 'Weekly':
+            date += datetime.timedelta(weeks=1)
+        elif datetype == 'Monthly':
+            date = date.replace(year=date.year + date.month // 12, month=date.month % 12 + 1)
+        else:
+            date = date.replace(year=date.year + 1)
+
+    return dates
+
+def expand_jobs(args):
+    """Split the arguments of a report command into one set of arguments per vendor and date"""
+
+    if getattr(args, 'plan', False):
+        return [job for job, cached in plan_jobs(args) if not cached]
+
+    dates = [None]
+    if getattr(args, 'from_date', None):
+        dates = expand_date_range(args.datetype, args.from_date, args.to_date)
+    elif hasattr(args, 'date'):
+        dates = [args.date]
+
+    jobs = []
+    for vendor in args.vendor:
+        for date in dates:
+            job = argparse.Namespace(**vars(args))
+            job.vendor = vendor
+            if date: job.date = date
+            jobs.append(job)
+
+    return jobs
+
+def plan_jobs(args):
+    """Cover the range of days from --from to --to with as few requests per vendor as the granularity given by datetype allows
+
+    Returns the jobs along with whether the report each job is about is in the cache already (and final).
+    """
+
+    import planner
+    first, last = (datetime.datetime.strptime(date, '%Y%m%d').date() for date in (args.from_date, args.to_date))
+    reporttype, reportsubtype = args.report
+
+    jobs = []
+    for vendor in args.vendor:
+        def cached(datetype, date):
+            store = args.client.report_cache or args.client.archive
+            entry = store.lookup(client.report_query(vendor, reporttype, reportsubtype, datetype, date)) if store else None
+            return bool(entry and entry['final'])
+
+        for report in planner.plan(first, last, args.datetype, cached):
+            job = argparse.Namespace(**vars(args))
+            job.vendor, job.datetype, job.date = vendor, report.datetype, report.date
+            jobs.append((job, report.cached))
+
+    return jobs
+
+def describe_job(job):
+    """Identify the report a job is about for use in messages"""
+
+    if hasattr(job, 'fiscalyear'):
+        return 'vendor {0}, region {1}, {2}/{3}'.format(job.vendor, job.regioncode, job.fiscalyear, job.fiscalperiod)
+    return 'vendor {0}, {1} {2}'.format(job.vendor, job.datetype.lower(), job.date)
+
+def run_jobs(args):
+    """Execute a report command for every vendor and date given, using a pool of concurrent workers"""
+
+    if getattr(args, 'dry_run', False):
+        planned = plan_jobs(args)
+        for job, cached in planned:
+            print_message(describe_job(job) + (' (cached)' if cached else ''))
+        print_message("{0} requests for {1} reports".format(sum(not cached for job, cached in planned), len(planned)))
+        return
+
+    jobs = expand_jobs(args)
+    if not jobs:
+        return print_message("All reports are in the cache already")
+    if getattr(args, 'watch', False):
+        return watch_jobs(args, jobs)
+    if len(jobs) == 1:
+        return args.func(jobs[0])
+
+    import concurrent.futures
+    failures = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {executor.submit(args.func, job): job for job in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except (ValueError, OSError) as e:
+                failures.append((describe_job(futures[future]), str(e).strip()))
+    report_failures(failures, jobs)
+
+def watch_jobs(args, jobs):
+    """Execute a report command for every vendor and date given as soon as each report has been published"""
+
+    import watch
+
+    def waiting(job, delay, error):
+        print_message("Report for {0} not available yet, asking again in {1:.0f} seconds".format(describe_job(job), delay), stderr=True)
+
+    failures = []
+    outcomes = watch.run(jobs, args.func, interval=args.watch_interval, max_interval=args.watch_max_interval,
+                         max_wait=args.watch_for * 3600, max_workers=args.jobs, on_wait=waiting)
+    for job, result, error in outcomes:
+        if error is not None and not isinstance(error, (ValueError, OSError)):
+            raise error
+        if error is not None:
+            failures.append((describe_job(job), str(error).strip()))
+    if len(jobs) == 1 and failures:
+        raise ValueError(failures[0][1])
+    report_failures(failures, jobs)
+
+def report_failures(failures, jobs):
+    """Raise an error summing up which of the jobs failed, if any"""
+
+    if failures:
+        summary = ["{0} of {1} reports could not be retrieved:".format(len(failures), len(jobs))]
+        summary += ["  {0}: {1}".format(job, msg) for job, msg in sorted(failures)]
+        raise ValueError('\n'.join(summary))
 
 # command line arguments
 
-def parse_arguments():
-    """Build and parse the command line arguments"""
-
-    parser_main = argparse.ArgumentParser(description="Reporting tool for querying Sales- and Financial Reports from App Store Connect", epilog="For a detailed description of report types, see https://help.apple.com/itc/appssalesandtrends/#/itc37a18bcbf")
+def vendor_list(string):
+    """Convert a comma separated list of vendor numbers"""
 
+    try:
+        return [int(vendor) for vendor in string.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid vendor number(s): '%s'" % string)
+
+def column_list(string):
+    """Convert a comma separated list of column names"""
+
+    return [column.strip() for column in string.split(',') if column.strip()]
+
+def report_types():
+    import reports
+    return sorted(set(reporttype for reporttype, version in reports.SCHEMAS))
+
+# Commands and the templates they share are described by data, each as (defaults, arguments), where
+# arguments is a list of (names, options) passed to add_argument; a nested list stands for a group of
+# mutually exclusive arguments one of which is required. Only the parser of the command actually
+# given is built, the others are just listed in the help.
+
+VENDOR = (('vendor',), dict(type=vendor_list, help="vendor number of the report to download (for a list of your vendor numbers, use the 'getVendors' command; separate multiple vendor numbers with commas)"))
+DATETYPE = (('datetype',), dict(choices=['Daily', 'Weekly', 'Monthly', 'Yearly'], help="length of time covered by the report"))
+DATE = (('date',), dict(nargs='?', help="specific time covered by the report (weekly reports use YYYYMMDD, where the day used is the Sunday that week ends; monthly reports use YYYYMM; yearly reports use YYYY)"))
+DAY = (('date',), dict(nargs='?', help="specific day covered by the report (use YYYYMMDD format)"))
+VERSION = (('-v', '--version'), dict(choices=['1_0', '1_1', '1_2', '1_3'], default='1_3', help="report format version to use (if omitted, the latest available version is used)"))
+SERVICE = (('service',), dict(choices=['Sales', 'Finance'], help="service endpoint to query"))
+
+TEMPLATES = {
+    # commands that require authentication with password
+    'auth_password': (dict(access_token=None, access_token_keychain_item=None), [[
+        (('-p', '--password-keychain-item'), dict(metavar="KEYCHAIN_ITEM", help='name of the macOS Keychain item that holds the (optionally app-specific) password for the Apple ID (cannot be used together with -P)')),
+        (('-P', '--password'), dict(help='(optionally app-specific) password for the Apple ID (cannot be used together with -p)')),
+        (('--password-env',), dict(metavar='VARIABLE', help="name of an environment variable holding the password (keeps it out of process listings, unlike -P)")),
+        (('--password-file',), dict(metavar='FILE', help="file holding the password, which must be accessible by its owner only (chmod 600)"))]]),
+
+    # commands that require authentication with access token
+    'auth_token': (dict(password=None, password_keychain_item=None), [[
+        (('-t', '--access-token-keychain-item'), dict(metavar="KEYCHAIN_ITEM", help='name of the macOS Keychain item that holds the App Store Connect access token (more secure alternative to -T)')),
+        (('-T', '--access-token'), dict(help='App Store Connect access token (can be obtained with the generateToken command or via App Store Connect -> Sales & Trends -> Saved -> Sales & Trends - Reports -> About Reports)')),
+        (('--access-token-env',), dict(metavar='VARIABLE', help="name of an environment variable holding the access token (keeps it out of process listings, unlike -T)")),
+        (('--access-token-file',), dict(metavar='FILE', help="file holding the access token, which must be accessible by its owner only (chmod 600); generateToken --update-token-file writes such a file"))]]),
+
+    # commands that only work on downloaded reports and don't query App Store Connect
+    'local': (dict(local=True, access_token=None, access_token_keychain_item=None, password=None, password_keychain_item=None), []),
+
+    # report commands that can be carried out for multiple vendors at once
+    'batch': ({}, [
+        (('--stdout',), dict(action='store_true', help="write the report contents to standard output instead of into files")),
+        (('-j', '--jobs'), dict(type=int, default=4, help="maximum number of reports to download concurrently when querying multiple reports (defaults to %(default)s)"))]),
+
+    # report commands that can wait for their reports to be published
+    'watch': ({}, [
+        (('--watch',), dict(action='store_true', help="if a report hasn't been published yet, keep asking for it and download it as soon as it is available")),
+        (('--watch-interval',), dict(metavar='SECONDS', type=float, default=300, help="time to wait before asking for a report again, doubled after every try up to --watch-max-interval (defaults to %(default)s)")),
+        (('--watch-max-interval',), dict(metavar='SECONDS', type=float, default=3600, help="longest time to wait between two tries (defaults to %(default)s)")),
+        (('--watch-for',), dict(metavar='HOURS', type=float, default=12, help="give up on reports which still haven't been published after this long (defaults to %(default)s)"))]),
+
+    # commands that can make use of a local report cache
+    'cache': ({}, [
+        (('--cache-dir',), dict(metavar='DIR', help="directory in which downloaded reports are stored and kept track of (instead of the current directory)")),
+        (('--sync',), dict(action='store_true', help="only download reports which are missing from the cache or which haven't been final yet when they were downloaded (needs --cache-dir)")),
+        (('--final-after',), dict(metavar='DAYS', type=int, default=3, help="number of days after the end of the period covered by a report after which the report is considered final (defaults to %(default)s)")),
+        (('--cache-max-age',), dict(metavar='DAYS', type=float, help="remove reports from the cache which have been downloaded longer ago than this")),
+        (('--cache-max-size',), dict(metavar='MB', type=float, help="remove the least recently downloaded reports from the cache as long as it is larger than this")),
+        (('--archive',), dict(metavar='DIR', help="store downloaded reports compressed in a few large pack files in DIR instead of one file per report (use instead of --cache-dir, works with --sync)"))]),
+
+    # report commands that can be carried out for a range of dates
+    'date_range': ({}, [
+        (('--from',), dict(dest='from_date', metavar='DATE', help="first date of a range of reports to download (use instead of the date argument, in the same format)")),
+        (('--to',), dict(dest='to_date', metavar='DATE', help="last date of a range of reports to download (use together with --from)"))]),
+
+    # report commands whose reports can be loaded into a local SQLite database
+    'ingest': ({}, [
+        (('--ingest',), dict(metavar='DATABASE', help="load the reports into the SQLite database DATABASE, replacing earlier versions of them (without --cache-dir, reports are streamed into the database instead of being written to files)"))]),
+
+    # report commands whose date range can be covered by reports of different date types
+    'plan': ({}, [
+        (('--plan',), dict(action='store_true', help="cover the days from --from to --to (given as YYYYMMDD) with as few requests as possible, combining yearly, monthly, weekly and daily reports no coarser than datetype and skipping reports already in the cache")),
+        (('--dry-run',), dict(action='store_true', help="only print which reports --plan would request, and how many requests that takes"))]),
+}
+
+# name: (help, templates, defaults, arguments)
+COMMANDS = {
+    'getStatus': ("check if App Store Connect is available for queries", ['auth_token'], dict(func=itc_get_status), [SERVICE]),
+    'getAccounts': ("fetch a list of accounts accessible to the Apple ID given in -u", ['auth_token'], dict(func=itc_get_accounts), [SERVICE]),
+    'getVendors': ("fetch a list of vendors accessible to the Apple ID given in -u", ['auth_token'], dict(func=itc_get_vendors), []),
+    'getVendorsAndRegions': ("fetch a list of financial reports you can download by vendor number and region", ['auth_token'], dict(func=itc_get_vendor_and_regions), []),
+    'getReportVersion': ("query what is the latest available version of reports of a specific type and subtype", ['auth_token'], dict(func=itc_get_report_version), [
+        (('reporttype',), dict(choices=['Sales', 'Subscription', 'SubscriptionEvent', 'Subscriber', 'Newsstand', 'Pre-Order'])),
+        (('reportsubtype',), dict(choices=['Summary', 'Detailed', 'Opt-In']))]),
+    'getFinancialReport': ("download a financial report file for a specific region and fiscal period", ['auth_token', 'batch', 'watch', 'cache', 'ingest'], dict(func=itc_get_financial_report, reporttype='Financial'), [
+        VENDOR,
+        (('regioncode',), dict(help="two-character code of country of the report to download (for a list of country codes by vendor number, use the 'getVendorsAndRegions' command)")),
+        (('fiscalyear',), dict(help="four-digit year of the report to download (year is specific to Apple’s fiscal calendar)")),
+        (('fiscalperiod',), dict(help="period in fiscal year for the report to download (1-12; period is specific to Apple’s fiscal calendar)"))]),
+    'getAllFinancialReports': ("download the financial reports of all vendors and regions available for a fiscal period at once", ['auth_token', 'cache'], dict(func=itc_get_all_financial_reports), [
+        (('fiscalyear',), dict(help="four-digit year of the reports to download (year is specific to Apple’s fiscal calendar)")),
+        (('fiscalperiod',), dict(help="period in fiscal year for the reports to download (1-12; period is specific to Apple’s fiscal calendar)")),
+        (('-o', '--output-dir'), dict(metavar='DIR', default=os.curdir, help="directory in which a subdirectory for the fiscal period is created, holding the reports of each vendor in a subdirectory and an index of all reports (defaults to the current directory)")),
+        (('-j', '--jobs'), dict(type=int, default=4, help="maximum number of reports to download concurrently (defaults to %(default)s)"))]),
+    'getSalesReport': ("download a summary sales report file for a specific date range", ['auth_token', 'batch', 'watch', 'cache', 'date_range', 'plan', 'ingest'], dict(func=itc_get_sales_report, report=('Sales', 'Summary'), reporttype='Sales'), [
+        VENDOR, DATETYPE, DATE,
+        (('--derive',), dict(action='store_true', help="put weekly, monthly and yearly reports together from the daily reports in the cache, downloading only missing days (needs --cache-dir)"))]),
+    'getSubscriptionReport': ("download a subscription report file for a specific day", ['auth_token', 'batch', 'watch', 'cache', 'date_range', 'ingest'], dict(func=itc_get_subscription_report, datetype='Daily', reporttype='Subscription'), [VENDOR, DAY, VERSION]),
+    'getSubscriptionEventReport': ("download an aggregated subscriber activity report file for a specific day", ['auth_token', 'batch', 'watch', 'cache', 'date_range', 'ingest'], dict(func=itc_get_subscription_event_report, datetype='Daily', reporttype='SubscriptionEvent'), [VENDOR, DAY, VERSION]),
+    'getSubscriberReport': ("download a transaction-level subscriber activity report file for a specific day", ['auth_token', 'batch', 'watch', 'cache', 'date_range', 'ingest'], dict(func=itc_get_subscriber_report, datetype='Daily', reporttype='Subscriber'), [VENDOR, DAY, VERSION]),
+    'getNewsstandReport': ("download a magazines & newspapers report file for a specific date range", ['auth_token', 'batch', 'watch', 'cache', 'date_range', 'plan', 'ingest'], dict(func=itc_get_newsstand_report, report=('Newsstand', 'Detailed'), reporttype='Newsstand'), [
+        VENDOR,
+        (('datetype',), dict(choices=['Daily', 'Weekly'], help="length of time covered by the report")),
+        (('date',), dict(nargs='?', help="specific time covered by the report (weekly reports, like daily reports, use YYYYMMDD, where the day used is the Sunday that week ends"))]),
+    'getOptInReport': ("download contact information for customers who opt in to share their contact information with you", ['auth_token', 'batch', 'watch', 'cache', 'date_range'], dict(func=itc_get_opt_in_report, datetype='Weekly'), [VENDOR, DAY]),
+    'getPreOrderReport': ("download a summary report file of pre-ordered items for a specific date range", ['auth_token', 'batch', 'watch', 'cache', 'date_range', 'plan', 'ingest'], dict(func=itc_get_pre_order_report, report=('Pre-Order', 'Summary'), reporttype='Pre-Order'), [VENDOR, DATETYPE, DATE]),
+    'getPodcastsSubscriptionSnapshotReport': ("download an aggregated Apple Podcasts Subscription Snapshot report file for a specific day", ['auth_token', 'batch', 'watch', 'cache', 'date_range'], dict(func=itc_get_podcasts_subscription_snapshot_report, datetype='Daily'), [VENDOR, DAY]),
+    'generateToken': ("generate a token for accessing App Store Connect (expires after 180 days) and optionally store it in the macOS Keychain or a file", ['auth_password'], dict(func=itc_generate_token), [
+        (('--update-keychain-item',), dict(metavar="KEYCHAIN_ITEM", help='name of the macOS Keychain item in which the new access token should be stored in')),
+        (('--update-token-file',), dict(metavar='FILE', help="file in which the new access token should be stored (created accessible by its owner only)"))]),
+    'viewToken': ("display current App Store Connect access token and its expiration date", ['auth_password'], dict(func=itc_view_token), []),
+    'deleteToken': ("delete an existing App Store Connect access token", ['auth_password'], dict(func=itc_delete_token), []),
+    'serve': ("keep running and answer queries of local programs via HTTP, sending identical queries made at the same time only once", ['auth_token', 'cache'], dict(func=itc_serve), [
+        [(('--port',), dict(type=int, help="localhost port to listen on")),
+         (('--socket',), dict(metavar='PATH', help="Unix socket to listen on"))],
+        (('--verbose',), dict(action='store_true', help="log every query"))]),
+    'summarize': ("add up the units, proceeds etc. of downloaded report files for each SKU, country, date or any other combination of columns", ['local'], dict(func=itc_summarize), [
+        (('reporttype',), dict(choices=report_types, help="type of the reports")),
+        (('files',), dict(nargs='+', metavar='FILE', help="downloaded (unzipped) report files")),
+        (('--by',), dict(type=column_list, required=True, help="comma separated names of the columns to group by, e.g. 'SKU,Country Code'")),
+        (('--sum',), dict(type=column_list, required=True, help="comma separated names of the columns to add up, e.g. 'Units,Developer Proceeds'")),
+        (('-v', '--version'), dict(help="report format version (if omitted, the latest known version is assumed)"))]),
+    'ingest': ("load downloaded report files, or all reports in a report cache, into a local SQLite database for querying with SQL", ['local'], dict(func=itc_ingest), [
+        (('database',), dict(help="SQLite database file (created if it doesn't exist)")),
+        (('files',), dict(nargs='*', metavar='FILE', help="downloaded (unzipped) report files; a file which has been ingested before is skipped unless its content has changed")),
+        (('--type',), dict(dest='reporttype', choices=report_types, help="type of the report files")),
+        (('-v', '--version'), dict(help="report format version of the files (if omitted, the latest known version is assumed)")),
+        (('--cache-dir',), dict(dest='from_cache', metavar='DIR', help="ingest all reports of known types in the report cache in DIR")),
+        (('--archive',), dict(dest='from_archive', metavar='DIR', help="ingest all reports of known types in the archive in DIR"))]),
+    'consolidate': ("add up the financial reports of a fiscal period downloaded with getAllFinancialReports, converting their amounts into a single currency", ['local'], dict(func=itc_consolidate), [
+        (('fiscalyear',), dict(help="four-digit year of the reports (year is specific to Apple’s fiscal calendar)")),
+        (('fiscalperiod',), dict(help="period in fiscal year of the reports (1-12; period is specific to Apple’s fiscal calendar)")),
+        (('--rates',), dict(metavar='FILE', required=True, help="table of exchange rates, with a currency code and how much one unit of the currency is worth in the target currency on each line, e.g. 'EUR,1.0857'")),
+        (('--currency',), dict(type=str.upper, default='USD', help="currency the amounts are converted into (defaults to %(default)s)")),
+        (('--by',), dict(type=column_list, default=['Vendor', 'Region', 'Vendor Identifier', 'Partner Share Currency'], help="comma separated names of the columns to group by, 'Vendor' and 'Region' standing for the vendor number and region of a report (defaults to 'Vendor,Region,Vendor Identifier,Partner Share Currency')")),
+        (('-o', '--output-dir'), dict(metavar='DIR', default=os.curdir, help="directory holding the subdirectory of the fiscal period created by getAllFinancialReports (defaults to the current directory)")),
+        (('--archive',), dict(dest='from_archive', metavar='DIR', help="report archive holding the reports, if they have been downloaded with --archive"))]),
+    'compact': ("rewrite the pack files of a report archive, dropping the data of reports which have been replaced or removed", ['local'], dict(func=itc_compact), [
+        (('directory',), dict(metavar='DIR', help="directory of the archive (see --archive)"))]),
+}
+
+# Main arguments are described like those of commands, in groups titled as in the help (None standing for the
+# usual options). Knowing them tells where the command starts without building any command's parser.
+MAIN_ARGUMENTS = [
     # (most of the time) optional arguments
-    parser_main.add_argument('-a', '--account', type=int, help="account number (needed if your Apple ID has access to multiple accounts; for a list of your account numbers, use the 'getAccounts' command)")
-    parser_main.add_argument('-m', '--mode', choices=['Normal', 'Robot.XML'], default='Normal', help="output format: plain text or XML (defaults to '%(default)s')")
+    (None, [
+        (('-a', '--account'), dict(type=int, help="account number (needed if your Apple ID has access to multiple accounts; for a list of your account numbers, use the 'getAccounts' command)")),
+        (('-m', '--mode'), dict(choices=['Normal', 'Robot.XML'], default='Normal', help="output format: plain text or XML (defaults to '%(default)s')")),
+        (('-f', '--format'), dict(choices=['text', 'json'], default='text', help="how to output responses to queries (not reports): as sent by the service or parsed into JSON (defaults to '%(default)s')")),
+        (('--server',), dict(metavar='URL', help="base URL of the reporter service, e.g. for testing against a local stand-in (defaults to https://reportingitc-reporter.apple.com)")),
+        (('--connection-stats',), dict(action='store_true', help="print how many connections were opened and reused to stderr when done")),
+        (('--trace',), dict(metavar='FILE', help="append one JSON object per request to FILE, telling where the time went (connecting, waiting, transferring, unzipping, writing), how many bytes were transferred, how often the request was retried and whether it was answered from the cache")),
+        (('--metrics-file',), dict(metavar='FILE', help="write latency histograms and request counters to FILE in the Prometheus text format when done (and every 15 seconds when serving), e.g. for the textfile collector of node_exporter")),
+        (('--credentials-ttl',), dict(metavar='SECONDS', type=float, default=300, help="how long to keep credentials looked up from Keychain, environment variables or files before looking them up again, e.g. when serving (defaults to %(default)s)"))]),
+
+    # arguments for coping with an unreliable network or a busy service
+    ("network arguments", [
+        (('--timeout',), dict(metavar='SECONDS', type=float, default=300, help="give up on a request if the service doesn't respond for this long (defaults to %(default)s)")),
+        (('--retries',), dict(metavar='N', type=int, default=3, help="how often to retry a request after a timeout, a lost connection or a server error (defaults to %(default)s)")),
+        (('--backoff',), dict(metavar='SECONDS', type=float, default=1.0, help="base delay before retrying a request, doubled with every retry and randomized (defaults to %(default)s)")),
+        (('--max-delay',), dict(metavar='SECONDS', type=float, default=60.0, help="longest delay before retrying a request; give up if the service asks to wait longer (defaults to %(default)s)")),
+        (('--rate',), dict(metavar='N', type=float, help="send at most this many requests per second (unlimited by default)")),
+        (('--breaker-threshold',), dict(metavar='N', type=int, default=5, help="stop sending requests after this many consecutive failures until the service reports to be available again; 0 disables this (defaults to %(default)s)")),
+        (('--breaker-cooldown',), dict(metavar='SECONDS', type=float, default=60.0, help="how long to wait before checking whether the service is available again (defaults to %(default)s)"))]),
 
     # always required arguments
-    required_args = parser_main.add_argument_group("required arguments")
-    required_args.add_argument('-u', '--userid', required=True, help="Apple ID for use with App Store Connect")
-
-    # template for commands that require authentication with password
-    parser_auth_password = argparse.ArgumentParser(add_help=False)
-    parser_auth_password.set_defaults(access_token=None, access_token_keychain_item=None)
-    auth_password_args = parser_auth_password.add_argument_group()
-    mutex_group = auth_password_args.add_mutually_exclusive_group(required=True)
-    mutex_group.add_argument('-p', '--password-keychain-item', metavar="KEYCHAIN_ITEM", help='name of the macOS Keychain item that holds the (optionally app-specific) password for the Apple ID (cannot be used together with -P)')
-    mutex_group.add_argument('-P', '--password', help='(optionally app-specific) password for the Apple ID (cannot be used together with -p)')
-
-    # template for commands that require authentication with access token
-    parser_auth_token = argparse.ArgumentParser(add_help=False)
-    parser_auth_token.set_defaults(password=None, password_keychain_item=None)
-    auth_token_args = parser_auth_token.add_argument_group()
-    mutex_group = auth_token_args.add_mutually_exclusive_group(required=True)
-    mutex_group.add_argument('-t', '--access-token-keychain-item', metavar="KEYCHAIN_ITEM", help='name of the macOS Keychain item that holds the App Store Connect access token (more secure alternative to -T)')
-    mutex_group.add_argument('-T', '--access-token', help='App Store Connect access token (can be obtained with the generateToken command or via App Store Connect -> Sales & Trends -> Saved -> Sales & Trends - Reports -> About Reports)')
+    ("required arguments", [
+        (('-u', '--userid'), dict(help="Apple ID for use with App Store Connect (not needed for commands which only work on downloaded reports)"))]),
+]
+
+def add_arguments(parser, arguments):
+    """Add arguments described as in COMMANDS to a parser"""
+
+    for argument in arguments:
+        if isinstance(argument, list):
+            add_arguments(parser.add_mutually_exclusive_group(required=True), argument)
+            continue
+        names, options = argument
+        if callable(options.get('choices')):
+            # choices which take importing a module to tell are only looked up when needed
+            options = dict(options, choices=options['choices']())
+        parser.add_argument(*names, **options)
+
+def template_parser(name):
+    """Build a parser holding the arguments of a template, to be used as a parent of command parsers"""
+
+    defaults, arguments = TEMPLATES[name]
+    parser = argparse.ArgumentParser(add_help=False)
+    add_arguments(parser, arguments)
+    parser.set_defaults(**defaults)
+    return parser
+
+def takes_value(arg):
+    """Tell whether a main option given on the command line is followed by its value, resolving abbreviations like argparse"""
+
+    if '=' in arg or not arg.startswith('--') and len(arg) > 2:
+        # the value is attached to the option
+        return False
+    options = {name: options for title, arguments in MAIN_ARGUMENTS for names, options in arguments for name in names}
+    matches = [name for name in options if name == arg] or [name for name in options if arg.startswith('--') and name.startswith(arg)]
+    return len(matches) == 1 and options[matches[0]].get('action') not in ('store_true', 'store_false', 'count')
+
+def selected_command(argv):
+    """Tell which command is given on the command line by skipping the main arguments, or None"""
+
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg.startswith('-'):
+            skip = takes_value(arg)
+        else:
+            return arg
+    return None
+
+def parse_arguments(argv = None):
+    """Build and parse the command line arguments"""
+
+    argv = sys.argv[1:] if argv is None else argv
+    parser_main = argparse.ArgumentParser(description="Reporting tool for querying Sales- and Financial Reports from App Store Connect", epilog="For a detailed description of report types, see https://help.apple.com/itc/appssalesandtrends/#/itc37a18bcbf")
+
+    for title, arguments in MAIN_ARGUMENTS:
+        add_arguments(parser_main.add_argument_group(title) if title else parser_main, arguments)
 
     # commands
     subparsers = parser_main.add_subparsers(dest='command', title='commands', description="Specify the task you want to be carried out (use -h after a command's name to get additional help for that command)")
-
-    parser_cmd = subparsers.add_parser('getStatus', help="check if App Store Connect is available for queries", parents=[parser_auth_token])
-    parser_cmd.add_argument('service', choices=['Sales', 'Finance'], help="service endpoint to query")
-    parser_cmd.set_defaults(func=itc_get_status)
-
-    parser_cmd = subparsers.add_parser('getAccounts', help="fetch a list of accounts accessible to the Apple ID given in -u", parents=[parser_auth_token])
-    parser_cmd.add_argument('service', choices=['Sales', 'Finance'], help="service endpoint to query")
-    parser_cmd.set_defaults(func=itc_get_accounts)
-
-    parser_cmd = subparsers.add_parser('getVendors', help="fetch a list of vendors accessible to the Apple ID given in -u", parents=[parser_auth_token])
-    parser_cmd.set_defaults(func=itc_get_vendors)
-
-    parser_cmd = subparsers.add_parser('getVendorsAndRegions', help="fetch a list of financial reports you can download by vendor number and region", parents=[parser_auth_token])
-    parser_cmd.set_defaults(func=itc_get_vendor_and_regions)
-
-    parser_cmd = subparsers.add_parser('getReportVersion', help="query what is the latest available version of reports of a specific type and subtype", parents=[parser_auth_token])
-    parser_cmd.add_argument('reporttype', choices=['Sales', 'Subscription', 'SubscriptionEvent', 'Subscriber', 'Newsstand', 'Pre-Order'])
-    parser_cmd.add_argument('reportsubtype', choices=['Summary', 'Detailed', 'Opt-In'])
-    parser_cmd.set_defaults(func=itc_get_report_version)
-
-    parser_cmd = subparsers.add_parser('getFinancialReport', help="download a financial report file for a specific region and fiscal period", parents=[parser_auth_token])
-    parser_cmd.add_argument('vendor', type=int, help="vendor number of the report to download (for a list of your vendor numbers, use the 'getVendors' command)")
-    parser_cmd.add_argument('regioncode', help="two-character code of country of the report to download (for a list of country codes by vendor number, use the 'getVendorsAndRegions' command)")
-    parser_cmd.add_argument('fiscalyear', help="four-digit year of the report to download (year is specific to Apple’s fiscal calendar)")
-    parser_cmd.add_argument('fiscalperiod', help="period in fiscal year for the report to download (1-12; period is specific to Apple’s fiscal calendar)")
-    parser_cmd.set_defaults(func=itc_get_financial_report)
-
-    parser_cmd = subparsers.add_parser('getSalesReport', help="download a summary sales report file for a specific date range", parents=[parser_auth_token])
-    parser_cmd.add_argument('vendor', type=int, help="vendor number of the report to download (for a list of your vendor numbers, use the 'getVendors' command)")
-    parser_cmd.add_argument('datetype', choices=['Daily', 'Weekly', 'Monthly', 'Yearly'], help="length of time covered by the report")
-    parser_cmd.add_argument('date', help="specific time covered by the report (weekly reports use YYYYMMDD, where the day used is the Sunday that week ends; monthly reports use YYYYMM; yearly reports use YYYY)")
-    parser_cmd.set_defaults(func=itc_get_sales_report)
-
-    parser_cmd = subparsers.add_parser('getSubscriptionReport', help="download a subscription report file for a specific day", parents=[parser_auth_token])
-    parser_cmd.add_argument('vendor', type=int, help="vendor number of the report to download (for a list of your vendor numbers, use the 'getVendors' command)")
-    parser_cmd.add_argument('date', help="specific day covered by the report (use YYYYMMDD format)")
-    parser_cmd.add_argument('-v', '--version', choices=['1_0', '1_1', '1_2', '1_3'], default='1_3', help="report format version to use (if omitted, the latest available version is used)")
-    parser_cmd.set_defaults(func=itc_get_subscription_report)
-
-    parser_cmd = subparsers.add_parser('getSubscriptionEventReport', help="download an aggregated subscriber activity report file for a specific day", parents=[parser_auth_token])
-    parser_cmd.add_argument('vendor', type=int, help="vendor number of the report to download (for a list of your vendor numbers, use the 'getVendors' command)")
-    parser_cmd.add_argument('date', help="specific day covered by the report (use YYYYMMDD format)")
-    parser_cmd.add_argument('-v', '--version', choices=['1_0', '1_1', '1_2', '1_3'], default='1_3', help="report format version to use (if omitted, the latest available version is used)")
-    parser_cmd.set_defaults(func=itc_get_subscription_event_report)
-
-    parser_cmd = subparsers.add_parser('getSubscriberReport', help="download a transaction-level subscriber activity report file for a specific day", parents=[parser_auth_token])
-    parser_cmd.add_argument('vendor', type=int, help="vendor number of the report to download (for a list of your vendor numbers, use the 'getVendors' command)")
-    parser_cmd.add_argument('date', help="specific day covered by the report (use YYYYMMDD format)")
-    parser_cmd.add_argument('-v', '--version', choices=['1_0', '1_1', '1_2', '1_3'], default='1_3', help="report format version to use (if omitted, the latest available version is used)")
-    parser_cmd.set_defaults(func=itc_get_subscriber_report)
-
-    parser_cmd = subparsers.add_parser('getNewsstandReport', help="download a magazines & newspapers report file for a specific date range", parents=[parser_auth_token])
-    parser_cmd.add_argument('vendor', type=int, help="vendor number of the report to download (for a list of your vendor numbers, use the 'getVendors' command)")
-    parser_cmd.add_argument('datetype', choices=['Daily', 'Weekly'], help="length of time covered by the report")
-    parser_cmd.add_argument('date', help="specific time covered by the report (weekly reports, like daily reports, use YYYYMMDD, where the day used is the Sunday that week ends")
-    parser_cmd.set_defaults(func=itc_get_newsstand_report)
-
-    parser_cmd = subparsers.add_parser('getOptInReport', help="download contact information for customers who opt in to share their contact information with you", parents=[parser_auth_token])
-    parser_cmd.add_argument('vendor', type=int, help="vendor number of the report to download (for a list of your vendor numbers, use the 'getVendors' command)")
-    parser_cmd.add_argument('date', help="specific day covered by the report (use YYYYMMDD format)")
-    parser_cmd.set_defaults(func=itc_get_opt_in_report)
-
-    parser_cmd = subparsers.add_parser('getPreOrderReport', help="download a summary report file of pre-ordered items for a specific date range", parents=[parser_auth_token])
-    parser_cmd.add_argument('vendor', type=int, help="vendor number of the report to download (for a list of your vendor numbers, use the 'getVendors' command)")
-    parser_cmd.add_argument('datetype', choices=['Daily', 'Weekly', 'Monthly', 'Yearly'], help="length of time covered by the report")
-    parser_cmd.add_argument('date', help="specific time covered by the report (weekly reports use YYYYMMDD, where the day used is the Sunday that week ends; monthly reports use YYYYMM; yearly reports use YYYY)")
-    parser_cmd.set_defaults(func=itc_get_pre_order_report)
-
-    parser_cmd = subparsers.add_parser('getPodcastsSubscriptionSnapshotReport', help="download an aggregated Apple Podcasts Subscription Snapshot report file for a specific day", parents=[parser_auth_token])
-    parser_cmd.add_argument('vendor', type=int, help="vendor number of the report to download (for a list of your vendor numbers, use the 'getVendors' command)")
-    parser_cmd.add_argument('date', help="specific day covered by the report (use YYYYMMDD format)")
-    parser_cmd.set_defaults(func=itc_get_podcasts_subscription_snapshot_report)
-
-    parser_cmd = subparsers.add_parser('generateToken', help="generate a token for accessing App Store Connect (expires after 180 days) and optionally store it in the macOS Keychain", parents=[parser_auth_password])
-    parser_cmd.add_argument('--update-keychain-item', metavar="KEYCHAIN_ITEM", help='name of the macOS Keychain item in which the new access token should be stored in')
-    parser_cmd.set_defaults(func=itc_generate_token)
-
-    parser_cmd = subparsers.add_parser('viewToken', help="display current App Store Connect access token and its expiration date", parents=[parser_auth_password])
-    parser_cmd.set_defaults(func=itc_view_token)
-
-    parser_cmd = subparsers.add_parser('deleteToken', help="delete an existing App Store Connect access token", parents=[parser_auth_password])
-    parser_cmd.set_defaults(func=itc_delete_token)
-
-    args = parser_main.parse_args()
+    command = selected_command(argv)
+    for name, (help, templates, defaults, arguments) in COMMANDS.items():
+        if name != command:
+            # commands not given are only listed in the help
+            subparsers.add_parser(name, help=help, add_help=False)
+            continue
+        parser_cmd = subparsers.add_parser(name, help=help, parents=[template_parser(template) for template in templates])
+        add_arguments(parser_cmd, arguments)
+        parser_cmd.set_defaults(**defaults)
+
+    args = parser_main.parse_args(argv)
+    args.secrets = credentials.Cache(args.credentials_ttl)
 
     try:
         validate_arguments(args)
@@ -332,22 +743,19 @@ def parse_arguments():
 def validate_arguments(args):
     """Do some additional checks on the passed arguments which argparse couldn't handle directly"""
 
-    if sys.platform != 'darwin' and (args.password_keychain_item or args.access_token_keychain_item):
+    if sys.platform != 'darwin' and (args.password_keychain_item or args.access_token_keychain_item or getattr(args, 'update_keychain_item', None)):
         raise ValueError("Error: Keychain support is limited to macOS")
 
-    if args.access_token_keychain_item:
-        try:
-            keychain.find_generic_password(None, args.access_token_keychain_item, '')
-        except:
-            raise ValueError("Error: Could not find an item named '{0}' in the default Keychain".format(args.access_token_keychain_item))
+    if not args.userid and not hasattr(args, 'local'):
+        raise ValueError("Error: Argument -u/--userid is needed for command '%s'" % args.command)
 
-    if args.password_keychain_item:
-        try:
-            keychain.find_generic_password(None, args.password_keychain_item, '')
-        except:
-            raise ValueError("Error: Could not find an item named '{0}' in the default Keychain".format(args.password_keychain_item))
+    for kind in ('access_token', 'password'):
+        source = secret_source(args, kind)
+        if source:
+            # the secret is cached, so checking that it can be found doesn't take another lookup later on
+            args.secrets.get(*source)
 
-    if not args.account and (args.command == 'getVendorsAndRegions' or args.command == 'getVendors' or args.command == 'getFinancialReport'):
+    if not args.account and (args.command == 'getVendorsAndRegions' or args.command == 'getVendors' or args.command == 'getFinancialReport' or args.command == 'getAllFinancialReports'):
         raise ValueError("Error: Argument -a/--account is needed for command '%s'" % args.command)
 
     if hasattr(args, 'fiscalyear'):
@@ -363,31 +771,92 @@ def validate_arguments(args):
         except:
             raise ValueError("Error: Fiscal period must be a value between 1 and 12")
 
+    if hasattr(args, 'from_date'):
+        if args.date and (args.from_date or args.to_date):
+            raise ValueError("Error: Either specify a single date or a date range using --from and --to, not both")
+        if not args.date and not (args.from_date and args.to_date):
+            raise ValueError("Error: A date or a date range using both --from and --to is needed for command '%s'" % args.command)
+
     if hasattr(args, 'datetype'):
-        format = '%Y%m%d'
+        format = cache.DATE_FORMATS[args.datetype]
         error = "Date must be specified as YYYYMMDD for daily reports"
         if args.datetype == 'Weekly':
             error = "Date must be specified as YYYYMMDD for weekly reports, where the day used is the Sunday that week ends"
         if args.datetype == 'Monthly':
             error = "Date must be specified as YYYYMM for monthly reports"
-            format = '%Y%m'
         if args.datetype == 'Yearly':
             error = "Date must be specified as YYYY for yearly reports"
-            format = '%Y'
+        if getattr(args, 'plan', False):
+            format, error = cache.DATE_FORMATS['Daily'], "The first and last day of a range to plan for must be specified as YYYYMMDD"
+            if args.date or not args.from_date:
+                raise ValueError("Error: Argument --plan needs a date range given with --from and --to")
         try:
-            datetime.datetime.strptime(args.date, format)
+            for date in filter(None, (args.date, args.from_date, args.to_date)):
+                datetime.datetime.strptime(date, format)
         except:
             raise ValueError("Error: " + error)
+        if args.from_date and args.from_date > args.to_date:
+            raise ValueError("Error: The first date of a range must not be later than the last one")
+
+    if hasattr(args, 'sync') and args.cache_dir and args.archive:
+        raise ValueError("Error: Arguments --cache-dir and --archive can't be used together")
+
+    if hasattr(args, 'sync') and not args.cache_dir and (args.sync and not args.archive or args.cache_max_age is not None or args.cache_max_size is not None):
+        raise ValueError("Error: Argument --cache-dir is needed for using the report cache")
+
+    if getattr(args, 'watch', False) and (args.watch_interval <= 0 or args.watch_max_interval < args.watch_interval or args.watch_for <= 0):
+        raise ValueError("Error: Arguments --watch-interval and --watch-for must be positive, --watch-max-interval must not be less than --watch-interval")
+
+    if getattr(args, 'dry_run', False) and not args.plan:
+        raise ValueError("Error: Argument --dry-run can only be used together with --plan")
+
+    if getattr(args, 'derive', False) and not args.cache_dir:
+        raise ValueError("Error: Argument --cache-dir is needed for deriving reports from cached daily reports")
+
+    if args.retries < 0 or args.breaker_threshold < 0:
+        raise ValueError("Error: Arguments --retries and --breaker-threshold must not be negative")
+
+    if args.rate is not None and args.rate <= 0:
+        raise ValueError("Error: Argument --rate must be a positive number")
+
+    if hasattr(args, 'jobs') and args.jobs < 1:
+        raise ValueError("Error: Number of concurrent jobs must be at least 1")
+
+    if getattr(args, 'ingest', None) and args.stdout and not (args.cache_dir or args.archive):
+        raise ValueError("Error: Argument --ingest can only be used together with --stdout if reports go into the cache (--cache-dir) or an archive (--archive)")
+
+    if args.command == 'ingest':
+        if not args.files and not args.from_cache and not args.from_archive:
+            raise ValueError("Error: Report files, a report cache (--cache-dir) or an archive (--archive) are needed for command 'ingest'")
+        if args.files and not args.reporttype:
+            raise ValueError("Error: Argument --type is needed for ingesting report files")
 
 # main
 
 if __name__ == '__main__':
     args = parse_arguments()
+    args.client = create_client(args)
+    args.warehouse = None
+    if getattr(args, 'ingest', None):
+        import warehouse
+        args.warehouse = warehouse.Warehouse(args.ingest)
 
     try:
-        args.func(args)
+        if hasattr(args, 'vendor'):
+            run_jobs(args)
+        else:
+            args.func(args)
     except ValueError as e:
         print(e)
         exit(-1)
+    finally:
+        if args.client.report_cache and (args.cache_max_age is not None or args.cache_max_size is not None):
+            max_size = args.cache_max_size * 1024 * 1024 if args.cache_max_size is not None else None
+            args.client.report_cache.prune(args.cache_max_age, max_size)
+        if args.connection_stats:
+            print("Connections: {connections} opened, {reused} reused, {reconnects} reopened after going stale ({requests} requests)".format(**args.client.pool.stats()), file=sys.stderr)
+        if args.warehouse:
+            args.warehouse.close()
+        args.client.close()
 
     exit(0)
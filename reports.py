@@ -0,0 +1,223 @@
+# Parsing of downloaded report files into typed records
+#
+# Reports are tab separated text files starting with a header row. Which columns a report has
+# depends on its type and version; the header row tells which of them are present, while the
+# schema registry below tells how to convert their values (dates, decimal amounts and counts,
+# everything else stays a string). Records are namedtuples whose fields are named after the
+# columns, e.g. 'Developer Proceeds' becomes developer_proceeds.
+#
+# Parsing works on anything yielding lines (a file opened in text or binary mode, a Result of
+# ReporterClient) as well as directly on the stream of a report being downloaded, by passing a
+# RecordWriter as destination of a ReporterClient report method:
+#
+#     for record in parse(open('S_D_85442109_20230718.txt', 'rb'), 'Sales', columns=['SKU', 'Units']):
+#         print(record.sku, record.units)
+
+import re, codecs, datetime, decimal, functools, collections
+
+# schema registry
+
+SCHEMAS = {}
+
+def register(reporttype, versions, types):
+    """Register how to convert the columns of a report type for each of the given versions"""
+
+    for version in versions:
+        SCHEMAS[(reporttype, version)] = types
+
+def schema(reporttype, version = None):
+    """Look up the column types of a report type and version (the most recent one if version is None)"""
+
+    versions = sorted(known for type, known in SCHEMAS if type == reporttype)
+    if not versions:
+        raise ValueError("Error: Unknown report type '%s'" % reporttype)
+    return SCHEMAS[(reporttype, version if version in versions else versions[-1])]
+
+@functools.lru_cache(maxsize=4096)
+def parse_date(value):
+    """Convert a date given as MM/DD/YYYY or YYYY-MM-DD (optionally followed by a time)"""
+
+    if not value:
+        return None
+    if value[2:3] == '/':
+        return datetime.date(int(value[6:10]), int(value[:2]), int(value[3:5]))
+    return datetime.date(int(value[:4]), int(value[5:7]), int(value[8:10]))
+
+def parse_int(value):
+    return int(value) if value else None
+
+def parse_decimal(value):
+    return decimal.Decimal(value.replace(',', '')) if value else None
+
+date, integer, amount = parse_date, parse_int, parse_decimal
+
+register('Sales', ('1_0', '1_1'), {
+    'Units': integer, 'Developer Proceeds': amount, 'Begin Date': date, 'End Date': date,
+    'Apple Identifier': integer, 'Customer Price': amount})
+
+register('Pre-Order', ('1_0',), {
+    'Apple Identifier': integer, 'Ordered': integer, 'Canceled': integer, 'Cumulative Ordered': integer,
+    'Cumulative Canceled': integer, 'Begin Date': date, 'End Date': date, 'Start Date': date})
+
+register('Newsstand', ('1_0',), {
+    'Units': integer, 'Developer Proceeds': amount, 'Customer Price': amount, 'Apple Identifier': integer,
+    'Download Date (PST)': date, 'Report Date (Local)': date})
+
+register('Subscription', ('1_0', '1_1', '1_2', '1_3'), {
+    'App Apple ID': integer, 'Subscription Apple ID': integer, 'Subscription Group ID': integer,
+    'Customer Price': amount, 'Developer Proceeds': amount,
+    'Active Standard Price Subscriptions': integer, 'Active Free Trial Introductory Offer Subscriptions': integer,
+    'Active Pay Up Front Introductory Offer Subscriptions': integer, 'Active Pay As You Go Introductory Offer Subscriptions': integer,
+    'Free Trial Promotional Offer Subscriptions': integer, 'Pay Up Front Promotional Offer Subscriptions': integer,
+    'Pay As You Go Promotional Offer Subscriptions': integer, 'Free Trial Offer Code Subscriptions': integer,
+    'Pay Up Front Offer Code Subscriptions': integer, 'Pay As You Go Offer Code Subscriptions': integer,
+    'Marketing Opt-Ins': integer, 'Billing Retry': integer, 'Grace Period': integer, 'Subscribers': integer})
+
+register('SubscriptionEvent', ('1_0', '1_1', '1_2', '1_3'), {
+    'Event Date': date, 'App Apple ID': integer, 'Subscription Apple ID': integer, 'Subscription Group ID': integer,
+    'Original Start Date': date, 'Days Before Canceling': integer, 'Days Canceled': integer,
+    'Consecutive Paid Periods': integer, 'Paid Service Days Recovered': integer, 'Quantity': integer})
+
+register('Subscriber', ('1_0', '1_1', '1_2', '1_3'), {
+    'Event Date': date, 'App Apple ID': integer, 'Subscription Apple ID': integer, 'Subscription Group ID': integer,
+    'Purchase Date': date, 'Original Start Date': date, 'Customer Price': amount, 'Developer Proceeds': amount,
+    'Units': integer, 'Consecutive Paid Periods': integer})
+
+register('Financial', ('1_0',), {
+    'Start Date': date, 'End Date': date, 'Quantity': integer, 'Partner Share': amount,
+    'Extended Partner Share': amount, 'Customer Price': amount, 'Apple Identifier': integer})
+
+def report_type_of(query):
+    """Tell report type and version (or None) from the query which has retrieved a report"""
+
+    method, _, params = query.partition(' ')
+    params = params.split(',')
+    if method.startswith('Finance.'):
+        return 'Financial', None
+    return params[1], (params[5] if len(params) > 5 else None)
+
+# records
+
+def field_name(column):
+    """Turn a column name into a valid identifier, e.g. 'Download Date (PST)' into download_date_pst"""
+
+    name = re.sub(r'\W+', '_', column.lower()).strip('_')
+    return name if name and not name[0].isdigit() else 'column_' + name
+
+@functools.lru_cache(maxsize=64)
+def record_type(columns):
+    """Create a compact record class for a tuple of column names"""
+
+    names = []
+    for column in columns:
+        name = field_name(column)
+        while name in names:
+            name += '_'
+        names.append(name)
+    return collections.namedtuple('Record', names)
+
+def split_totals(text):
+    """Cut the text of a report (whole lines with '\n' line breaks) off at the end of its records
+
+    Financial reports end with a blank line followed by totals which aren't records. Returns the text before the blank
+    line and whether there is one.
+    """
+
+    blank = ('\n' + text).find('\n\n')
+    return (text, False) if blank < 0 else (text[:blank], True)
+
+class Parser:
+    """Convert the lines of a report into records, keeping only the given columns and the records where accepts
+
+    conversions maps the conversion functions of the schema to others to be used instead, e.g. for storing values as text.
+    """
+
+    def __init__(self, reporttype, version = None, columns = None, where = None, conversions = None):
+        self.types = schema(reporttype, version)
+        self.columns = columns
+        self.where = where
+        self.conversions = conversions or {}
+        self.record = None
+        self.done = False
+
+    def header(self, line):
+        header = line.rstrip('\r\n').split('\t')
+        columns = self.columns or header
+        try:
+            self.indices = [header.index(column) for column in columns]
+        except ValueError:
+            raise ValueError("Error: The report has no column(s) named %s" % ', '.join(sorted(set(columns) - set(header))))
+        self.columns = columns
+        self.width = len(header)
+        self.converters = [(position, self.conversions.get(self.types[column], self.types[column])) for position, column in enumerate(columns) if column in self.types]
+        self.record = record_type(tuple(columns))
+
+    def parse(self, line):
+        """Return the record for a line, or None if it has to be skipped"""
+
+        if self.done:
+            return None
+        if self.record is None:
+            self.header(line)
+            return None
+
+        line = line.rstrip('\r\n')
+        fields = line.split('\t')
+        if len(fields) < self.width:
+            # lines lacking fields aren't records, and the records end at a blank one
+            self.done = split_totals(line + '\n')[1]
+            return None
+
+        values = [fields[index] for index in self.indices]
+        for position, convert in self.converters:
+            values[position] = convert(values[position])
+        record = self.record._make(values)
+        if self.where is None or self.where(record):
+            return record
+        return None
+
+def parse(lines, reporttype, version = None, columns = None, where = None):
+    """Iterate over the records of a report, given as lines of text or bytes
+
+    columns selects (and orders) the columns to be kept, where is a function filtering records after conversion.
+    """
+
+    parser = Parser(reporttype, version, columns, where)
+    decode = None
+    for line in lines:
+        if decode is None:
+            decode = isinstance(line, bytes)
+        record = parser.parse(line.decode('utf-8') if decode else line)
+        if record is not None:
+            yield record
+
+class RecordWriter:
+    """File-like destination for reports which parses the data written into it and passes each record to a callback
+
+    Use it as destination when downloading a report to process the report while it is being downloaded and unzipped,
+    without writing it to disk or keeping it in memory.
+    """
+
+    def __init__(self, callback, reporttype, version = None, columns = None, where = None):
+        self.callback = callback
+        self.parser = Parser(reporttype, version, columns, where)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._rest = ''
+
+    def write(self, data):
+        lines = (self._rest + self._decoder.decode(data)).split('\n')
+        self._rest = lines.pop()
+        for line in lines:
+            record = self.parser.parse(line)
+            if record is not None:
+                self.callback(record)
+        return len(data)
+
+    def flush(self):
+        """Process a final line which isn't terminated by a line break"""
+
+        rest, self._rest = self._rest + self._decoder.decode(b'', True), ''
+        if rest:
+            record = self.parser.parse(rest)
+            if record is not None:
+                self.callback(record)
@@ -0,0 +1,163 @@
+# Parsing of the text (or XML) responses of the reporter service
+#
+# Depending on the mode of a query, the reporter service answers with plain text meant for
+# humans (Normal) or with XML (Robot.XML). The functions below turn both into the same typed
+# Python objects. XML is parsed incrementally: every element is converted as soon as it is
+# complete and discarded right after, so even long listings are handled in a single pass.
+
+import io, collections, xml.etree.ElementTree as ElementTree
+import retry
+
+Account = collections.namedtuple('Account', 'name number')
+Vendor = collections.namedtuple('Vendor', 'number regions')
+Region = collections.namedtuple('Region', 'code reports')
+ReportVersion = collections.namedtuple('ReportVersion', 'reporttype reportsubtype version')
+Status = collections.namedtuple('Status', 'message available')
+Token = collections.namedtuple('Token', 'access_token expiration_date')
+
+def is_xml(content):
+    return content.lstrip().startswith(b'<')
+
+def iterparse(content):
+    """Yield the elements of an XML response one by one as soon as they are complete"""
+
+    try:
+        for _, element in ElementTree.iterparse(io.BytesIO(content), events=('end',)):
+            yield element
+    except ElementTree.ParseError as e:
+        raise ValueError("Error: Could not parse the XML response of the reporter service ({0})".format(e))
+
+def lines(content):
+    return [line.strip() for line in content.decode().splitlines() if line.strip()]
+
+def parse_accounts(content):
+    """Convert the response to getAccounts into a list of Accounts
+
+    In Normal mode, each line holds the name and the number of an account separated by a comma.
+    """
+
+    if is_xml(content):
+        accounts = []
+        for element in iterparse(content):
+            if element.tag == 'Account':
+                accounts.append(Account(element.findtext('Name', '').strip(), int(element.findtext('Number'))))
+                element.clear()
+        return accounts
+
+    accounts = []
+    for line in lines(content):
+        name, _, number = line.rpartition(',')
+        if number.strip().isdigit():
+            accounts.append(Account(name.strip(), int(number)))
+    return accounts
+
+def parse_vendors(content):
+    """Convert the response to Sales.getVendors into a list of vendor numbers"""
+
+    if is_xml(content):
+        vendors = []
+        for element in iterparse(content):
+            if element.tag == 'Vendor':
+                vendors.append(int(element.text))
+                element.clear()
+        return vendors
+
+    return [int(line) for line in lines(content) if line.isdigit()]
+
+def parse_vendors_and_regions(content):
+    """Convert the response to Finance.getVendorsAndRegions into a list of Vendors, each with its Regions
+
+    In Normal mode, the response lists the reports available for each vendor like this:
+
+        The following reports are available for vendor 80012345:
+        AE: Financial
+        US: Financial
+    """
+
+    vendors = []
+    if is_xml(content):
+        regions = []
+        reports = []
+        for element in iterparse(content):
+            if element.tag == 'Report' and element.text:
+                reports.append(element.text.strip())
+            elif element.tag == 'Region':
+                regions.append(Region(element.findtext('Code', '').strip(), reports))
+                reports = []
+                element.clear()
+            elif element.tag == 'Vendor':
+                vendors.append(Vendor(int(element.findtext('Number')), regions))
+                regions = []
+                element.clear()
+        return vendors
+
+    for line in lines(content):
+        if line.endswith(':') and line.split()[-1].rstrip(':').isdigit():
+            vendors.append(Vendor(int(line.split()[-1].rstrip(':')), []))
+            continue
+        code, separator, reports = line.partition(':')
+        if separator and len(code) == 2 and vendors:
+            vendors[-1].regions.append(Region(code, [report.strip() for report in reports.split(',') if report.strip()]))
+    return vendors
+
+def parse_report_version(content, reporttype = None, reportsubtype = None):
+    """Convert the response to Sales.getReportVersion into a ReportVersion"""
+
+    version = None
+    if is_xml(content):
+        for element in iterparse(content):
+            if element.tag.endswith('Version') and element.text and element.text.strip():
+                version = element.text.strip()
+    else:
+        words = [word.strip('.,:') for line in lines(content) for word in line.split()]
+        version = next((word for word in reversed(words) if word.replace('_', '').isdigit() and '_' in word), None)
+    return ReportVersion(reporttype, reportsubtype, version)
+
+def parse_status(content):
+    """Convert the response to getStatus into a Status telling whether the service is available"""
+
+    if is_xml(content):
+        message = ' '.join(element.text.strip() for element in iterparse(content) if element.text and element.text.strip())
+    else:
+        message = ' '.join(lines(content))
+    return Status(message, not retry.UNAVAILABLE_PATTERN.search(message))
+
+def parse_token(content):
+    """Convert the response to viewToken or generateToken into a Token
+
+    In Normal mode, the response holds lines like 'AccessToken:...' and 'Expiration Date:...'.
+    """
+
+    fields = {}
+    if is_xml(content):
+        for element in iterparse(content):
+            if element.text and element.text.strip():
+                fields[element.tag.lower()] = element.text.strip()
+    else:
+        for line in lines(content):
+            name, separator, value = line.partition(':')
+            if separator:
+                fields[name.replace(' ', '').lower()] = value.strip()
+    return Token(fields.get('accesstoken'), fields.get('expirationdate'))
+
+def parse(query, content):
+    """Parse the response to a query according to the query's command, or return None for responses without structure"""
+
+    method, _, params = query.partition(', ')
+    method = method.split('.')[-1]
+    if method == 'getReportVersion':
+        return parse_report_version(content, *params.split(','))
+    parser = PARSERS.get(method)
+    return parser(content) if parser else None
+
+PARSERS = {'getAccounts': parse_accounts, 'getVendors': parse_vendors, 'getVendorsAndRegions': parse_vendors_and_regions,
+           'getStatus': parse_status, 'viewToken': parse_token, 'generateToken': parse_token}
+
+def to_json(value):
+    """Turn parsed objects (namedtuples, possibly nested in lists) into something json.dumps can handle"""
+
+    if hasattr(value, '_asdict'):
+        return {name: to_json(field) for name, field in value._asdict().items()}
+    if isinstance(value, list):
+        return [to_json(item) for item in value]
+    return value
@@ -0,0 +1,135 @@
+# Coping with throttling and transient failures of the App Store Connect reporter service
+#
+# RetryPolicy decides whether and when a failed request is tried again (exponential backoff with
+# jitter, honoring Retry-After). RateLimiter is a token bucket limiting how many requests all
+# workers of a process may send per second. CircuitBreaker stops sending requests after a series
+# of failures until a status query reports the service as available again.
+
+import time, random, re, threading, datetime, email.utils
+
+# HTTP status codes which indicate a temporary condition
+TRANSIENT_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+# how a getStatus response tells that the service cannot be used right now
+UNAVAILABLE_PATTERN = re.compile(r'unavailable|not available|maintenance', re.I)
+
+class TransientError(ValueError):
+    """Failure of a request which might well succeed when tried again later"""
+
+    def __init__(self, msg, retry_after = None):
+        ValueError.__init__(self, msg)
+        self.retry_after = retry_after
+
+def parse_retry_after(value):
+    """Convert the value of a Retry-After header (seconds or HTTP date) into seconds, or None"""
+
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return int(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0, (date - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+class RetryPolicy:
+    """Exponential backoff with full jitter: the n-th retry waits a random time of up to backoff * 2^n seconds"""
+
+    def __init__(self, retries = 3, backoff = 1.0, max_delay = 60.0, jitter = True):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def delay(self, attempt, retry_after = None):
+        """Return how many seconds to wait before retry number attempt (counting from 0), or None to give up"""
+
+        if attempt >= self.retries:
+            return None
+        delay = min(self.max_delay, self.backoff * 2 ** attempt)
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        if retry_after is not None:
+            if retry_after > self.max_delay:
+                return None # the server asks for more patience than we are willing to have
+            delay = max(delay, retry_after)
+        return delay
+
+class RateLimiter:
+    """Thread safe token bucket allowing rate requests per second on average and bursts of up to burst requests"""
+
+    def __init__(self, rate, burst = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait until a request may be sent"""
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+class CircuitBreaker:
+    """Stop sending requests after threshold consecutive transient failures
+
+    While the circuit is open, requests fail right away. After cooldown seconds, a single caller probes the
+    service; the circuit closes again only if the probe reports the service as available.
+    """
+
+    def __init__(self, threshold = 5, cooldown = 60.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def open(self):
+        return self._opened is not None
+
+    def before_request(self, probe):
+        """Raise a TransientError if requests should not be sent right now; probe() is called to check the service's status"""
+
+        with self._lock:
+            if self._opened is None:
+                return
+            remaining = self._opened + self.cooldown - time.monotonic()
+            if remaining > 0 or self._probing:
+                raise TransientError("Error: The reporter service seems to be unavailable, not sending any requests for now", max(remaining, 0))
+            self._probing = True
+
+        try:
+            available = probe()
+        except ValueError:
+            available = False
+
+        with self._lock:
+            self._probing = False
+            if available:
+                self._failures = 0
+                self._opened = None
+                return
+            self._opened = time.monotonic()
+        raise TransientError("Error: The reporter service reports to be unavailable", self.cooldown)
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.threshold and self._opened is None:
+                self._opened = time.monotonic()
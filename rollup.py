@@ -0,0 +1,81 @@
+# Deriving weekly, monthly and yearly sales reports from daily ones
+#
+# A summary sales report for a longer period holds the same lines as the daily reports of all the
+# days it covers, except that lines which only differ in their dates are merged and their units
+# added up. So once the daily reports of a period are in the report cache, the report for the
+# whole period can be put together locally instead of being downloaded. Such reports are marked
+# as derived in the cache's manifest.
+#
+# Weeks run from Monday to the Sunday identifying them, months and years are calendar months and
+# years, just like for the reports App Store Connect provides.
+
+import datetime
+import cache
+
+# prefix of the file names App Store Connect uses for summary sales reports
+FILENAME_PREFIXES = {'Weekly': 'S_W', 'Monthly': 'S_M', 'Yearly': 'S_Y'}
+
+def period_days(datetype, date):
+    """Return the days covered by a weekly, monthly or yearly report, or None if they can't be told"""
+
+    if datetype not in FILENAME_PREFIXES:
+        return None
+    try:
+        last = cache.period_end(datetype, date)
+    except ValueError:
+        return None
+    if datetype == 'Weekly':
+        if last.weekday() != 6:
+            return None # weekly reports are identified by the Sunday the week ends
+        first = last - datetime.timedelta(days=6)
+    elif datetype == 'Monthly':
+        first = last.replace(day=1)
+    else:
+        first = last.replace(month=1, day=1)
+    return [first + datetime.timedelta(days=offset) for offset in range((last - first).days + 1)]
+
+def filename(vendor, datetype, date):
+    """Return the name of the file of a derived report, matching the name App Store Connect would have given it"""
+
+    return '{0}_{1}_{2}.txt'.format(FILENAME_PREFIXES[datetype], vendor, date)
+
+def combine(filenames, first, last, destination):
+    """Merge daily sales report files into a report covering first to last, written to the text file destination
+
+    Raises ValueError if the daily reports can't be combined, e.g. because they are of different versions.
+    """
+
+    header = None
+    totals = {}
+    for name in filenames:
+        with open(name, encoding='utf-8', newline='') as file:
+            columns = file.readline().rstrip('\r\n').split('\t')
+            if header is None:
+                header = columns
+                try:
+                    units, begin, end = (header.index(column) for column in ('Units', 'Begin Date', 'End Date'))
+                except ValueError:
+                    raise ValueError("Error: The daily report {0} is not a summary sales report".format(name))
+            elif columns != header:
+                raise ValueError("Error: The daily reports of the period differ in their columns")
+
+            for line in file:
+                fields = line.rstrip('\r\n').split('\t')
+                if len(fields) != len(header):
+                    raise ValueError("Error: The daily report {0} has a malformed line".format(name))
+                count = int(fields[units] or 0)
+                fields[units] = fields[begin] = fields[end] = ''
+                key = tuple(fields)
+                totals[key] = totals.get(key, 0) + count
+
+    if header is None:
+        raise ValueError("Error: There are no daily reports to combine")
+
+    dates = (first.strftime('%m/%d/%Y'), last.strftime('%m/%d/%Y'))
+    destination.write('\t'.join(header) + '\n')
+    for key, count in totals.items():
+        fields = list(key)
+        fields[units] = str(count)
+        fields[begin], fields[end] = dates
+        destination.write('\t'.join(fields) + '\n')
+    return len(totals)
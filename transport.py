@@ -0,0 +1,152 @@
+# Pool of persistent HTTP(S) connections for talking to the App Store Connect reporter service
+#
+# Both the sales and the finance endpoint live on the same host, so a single keep-alive
+# connection can serve any number of consecutive queries without paying for another
+# TCP and TLS handshake each time.
+
+import time, http.client, threading, urllib.parse
+
+# errors indicating that the server has silently dropped an idle keep-alive connection
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError, BrokenPipeError, ConnectionAbortedError)
+
+class Response:
+    """Response to a request made through a ConnectionPool
+
+    The underlying connection is handed back to its pool as soon as the body has been read completely.
+    """
+
+    def __init__(self, pool, key, connection, response, reused = False):
+        self.reused = reused
+        self._pool = pool
+        self._key = key
+        self._connection = connection
+        self._response = response
+        self.status = response.status
+        self.reason = response.reason
+
+    def info(self):
+        return self._response.msg
+
+    def read(self, amount = None):
+        data = self._response.read(amount)
+        if amount is None or not data:
+            self.close()
+        return data
+
+    def close(self):
+        """Release the connection: return it to the pool if the body has been consumed, otherwise discard it"""
+
+        if self._connection is None:
+            return
+        if self._response.isclosed() and not self._response.will_close:
+            self._pool._release(self._key, self._connection)
+        else:
+            self._connection.close()
+        self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class ConnectionPool:
+    """Thread safe pool of keep-alive connections, grouped by scheme, host and port"""
+
+    def __init__(self, maxsize = 8, timeout = None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._stats = dict(requests=0, connections=0, reused=0, reconnects=0)
+
+    def request(self, url, body = None, headers = None, timings = None):
+        """POST body to url, reusing an idle connection to the same host if there is one
+
+        If a timings dictionary is given, the seconds spent on opening a connection (name resolution, TCP and TLS
+        handshakes) and on waiting for the response headers are added to its 'connect' and 'wait' entries.
+        """
+
+        url = urllib.parse.urlsplit(url)
+        key = (url.scheme, url.hostname, url.port)
+        path = url.path + ('?' + url.query if url.query else '')
+        headers = headers or {}
+
+        connection, reused = self._acquire(key)
+        try:
+            response = self._send(connection, path, body, headers, timings)
+        except STALE_CONNECTION_ERRORS:
+            connection.close()
+            if not reused:
+                raise
+            # the server has closed the connection while it was idle, so try once more with a fresh one
+            self._count('reconnects')
+            connection, reused = self._acquire(key, fresh=True)
+            try:
+                response = self._send(connection, path, body, headers, timings)
+            except:
+                connection.close()
+                raise
+        except:
+            connection.close()
+            raise
+
+        self._count('requests')
+        return Response(self, key, connection, response, reused)
+
+    @staticmethod
+    def _send(connection, path, body, headers, timings):
+        if timings is None:
+            connection.request('POST', path, body, headers)
+            return connection.getresponse()
+
+        if connection.sock is None:
+            started = time.perf_counter()
+            connection.connect()
+            timings['connect'] = timings.get('connect', 0) + time.perf_counter() - started
+        started = time.perf_counter()
+        connection.request('POST', path, body, headers)
+        response = connection.getresponse()
+        timings['wait'] = timings.get('wait', 0) + time.perf_counter() - started
+        return response
+
+    def stats(self):
+        """Return the number of requests made, connections opened and connections reused"""
+
+        with self._lock:
+            return dict(self._stats, idle=sum(len(connections) for connections in self._idle.values()))
+
+    def close(self):
+        """Close all idle connections"""
+
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def _acquire(self, key, fresh = False):
+        with self._lock:
+            connections = self._idle.get(key)
+            if connections and not fresh:
+                self._stats['reused'] += 1
+                return connections.pop(), True
+            self._stats['connections'] += 1
+
+        scheme, host, port = key
+        connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        if self.timeout is None:
+            return connection_class(host, port), False
+        return connection_class(host, port, timeout=self.timeout), False
+
+    def _release(self, key, connection):
+        with self._lock:
+            connections = self._idle.setdefault(key, [])
+            if len(connections) < self.maxsize:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
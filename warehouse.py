@@ -0,0 +1,312 @@
+# Loading downloaded reports into a local SQLite database
+#
+# Each report type gets a table of its own (sales, subscription, subscription_event, subscriber,
+# financial, ...) whose columns are named like the fields of records (see reports.py), created
+# and extended as reports with new columns come in. Every row refers to the report it came from,
+# and carries the vendor, which most reports don't mention themselves. Dates are stored as
+# YYYY-MM-DD, counts as integers and amounts as numbers; indexes cover the vendor, the dates,
+# SKUs and countries.
+#
+# The table reports is a ledger of what has been ingested: one row per report, keyed by the name
+# App Store Connect gives its file (which identifies the report, whether it is ingested from a file,
+# a cache, an archive or while downloading it), along with the SHA-256 checksum of its content.
+# Ingesting a report again is a no-op unless its content has changed, in which case its rows are
+# replaced. A report is ingested in a single transaction, inserting rows in batches.
+#
+# Reports can be ingested from files, from an archive (see archive.py) or streamed right into the
+# database while being downloaded:
+#
+#     with warehouse.stream('Sales', vendor=85442109) as stream:
+#         result = client.get_sales_report(85442109, 'Daily', '20230718', destination=stream)
+#         stream.key = result.filename
+
+import os, io, re, sqlite3, hashlib, datetime, threading, functools
+import cache, reports
+
+# number of rows inserted at once
+BATCH_ROWS = 10000
+
+# columns which get an index if a report type has them
+INDEXED_COLUMNS = ('Begin Date', 'Start Date', 'Event Date', 'SKU', 'Apple Identifier', 'Subscription Apple ID',
+                   'Country Code', 'Country', 'Country Of Sale')
+
+LEDGER = '''CREATE TABLE IF NOT EXISTS reports (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    reporttype TEXT NOT NULL,
+    vendor INTEGER,
+    sha256 TEXT,
+    rows INTEGER,
+    ingested TEXT)'''
+
+@functools.lru_cache(maxsize=4096)
+def iso_date(value):
+    day = reports.parse_date(value)
+    return day.isoformat() if day else None
+
+def number(value):
+    return value.replace(',', '') if value else None
+
+# how values of the column types of reports.py are stored: as which SQL type, converted by what
+SQL_TYPES = {reports.parse_date: 'TEXT', reports.parse_int: 'INTEGER', reports.parse_decimal: 'NUMERIC'}
+CONVERSIONS = {reports.parse_date: iso_date, reports.parse_decimal: number}
+
+def table_name(reporttype):
+    return reports.field_name(reporttype)
+
+def vendor_of(key):
+    """Tell the vendor number from the query or file name identifying a report, or None"""
+
+    if key.startswith(('Sales.', 'Finance.')):
+        vendor = key.partition(' ')[2].split(',')[0]
+    else:
+        # report files are named like S_D_85442109_20230718.txt, the vendor number coming first
+        vendor = next(iter(re.findall(r'(?<![0-9])[0-9]{8,}(?![0-9])', os.path.basename(key))), None)
+    return int(vendor) if vendor and vendor.isdigit() else None
+
+def ingestible(key):
+    """Tell whether the report retrieved by a query is of a type with a known schema"""
+
+    reporttype, version = reports.report_type_of(key)
+    # opt-in reports are zip files of contact information
+    return ',Opt-In,' not in key and any(known == reporttype for known, _ in reports.SCHEMAS)
+
+class Stream(reports.RecordWriter):
+    """File-like destination for a report being downloaded, ingesting its records while they are written
+
+    The rows go into the database in a transaction which is committed when the with block ends without an error, and
+    rolled back otherwise. Set key to identify the report in the ledger (its file name, e.g. the filename of the Result);
+    if it is left unset, the checksum of the content is used. Streams of concurrent downloads take turns as soon as
+    their reports start to arrive.
+    """
+
+    def __init__(self, warehouse, reporttype, version, vendor):
+        reports.RecordWriter.__init__(self, None, reporttype, version)
+        self.warehouse = warehouse
+        self.reporttype = reporttype
+        self.version = version
+        self.vendor = vendor
+        self.key = None
+        self.rows = None
+        self._sha256 = hashlib.sha256()
+        self._inserter = None
+
+    def __enter__(self):
+        return self
+
+    def write(self, data):
+        if self._inserter is None:
+            self.warehouse._lock.acquire()
+            try:
+                self._inserter = self.warehouse._begin(self.reporttype, self.version, self.vendor)
+            except:
+                self.warehouse._end()
+                raise
+            # records are parsed the way the inserter stores them
+            self.parser, self.callback = self._inserter.parser, self._inserter.add
+        self._sha256.update(data)
+        return reports.RecordWriter.write(self, data)
+
+    def __exit__(self, type, value, traceback):
+        if self._inserter is None:
+            return
+        try:
+            if type is None:
+                self.flush()
+                digest = self._sha256.hexdigest()
+                self.rows = self.warehouse._commit(self._inserter, self.key or digest, digest)
+        finally:
+            self.warehouse._end()
+
+class Inserter:
+    """Insert the records of one report in batches into the table of its report type, creating or extending the table as needed"""
+
+    def __init__(self, connection, reporttype, version, vendor):
+        self.connection = connection
+        self.reporttype = reporttype
+        self.table = table_name(reporttype)
+        self.parser = reports.Parser(reporttype, version, conversions=CONVERSIONS)
+        self.vendor = vendor
+        # the ledger entry is only made once the report is complete, but its id is needed for the rows already
+        self.report = connection.execute('SELECT coalesce(max(id), 0) + 1 FROM reports').fetchone()[0]
+        self.statement = None
+        self.batch = []
+        self.rows = 0
+
+    def prepare(self):
+        """Make sure the table has a column for every column of the report, once the parser has seen its header"""
+
+        columns = self.parser.columns
+        types = self.parser.types
+        names = []
+        for column in columns:
+            name = reports.field_name(column)
+            while name in names or name in ('report', 'vendor'):
+                name += '_'
+            names.append(name)
+
+        existing = {row[1] for row in self.connection.execute('PRAGMA table_info("%s")' % self.table)}
+        if not existing:
+            self.connection.execute('CREATE TABLE "%s" (report INTEGER NOT NULL REFERENCES reports(id), vendor INTEGER)' % self.table)
+            self.connection.execute('CREATE INDEX "%s_report" ON "%s" (report)' % (self.table, self.table))
+            self.connection.execute('CREATE INDEX "%s_vendor" ON "%s" (vendor)' % (self.table, self.table))
+        for column, name in zip(columns, names):
+            if name not in existing:
+                # reports of a newer version may have additional columns
+                self.connection.execute('ALTER TABLE "%s" ADD COLUMN "%s" %s' % (self.table, name, SQL_TYPES[types[column]] if column in types else 'TEXT'))
+                if column in INDEXED_COLUMNS:
+                    self.connection.execute('CREATE INDEX "%s_%s" ON "%s" ("%s")' % (self.table, name, self.table, name))
+
+        self.statement = 'INSERT INTO "%s" (report, vendor, %s) VALUES (?, ?%s)' % (self.table, ', '.join('"%s"' % name for name in names), ', ?' * len(names))
+
+    def add(self, record):
+        if self.statement is None:
+            self.prepare()
+        self.batch.append((self.report, self.vendor) + record)
+        if len(self.batch) >= BATCH_ROWS:
+            self.insert()
+
+    def add_lines(self, lines):
+        parser = self.parser
+        for line in lines:
+            record = parser.parse(line)
+            if record is not None:
+                self.add(record)
+
+    def insert(self):
+        if self.statement is None and self.parser.record is not None:
+            # a report without rows still gets its table
+            self.prepare()
+        if self.batch:
+            self.connection.executemany(self.statement, self.batch)
+            self.rows += len(self.batch)
+            self.batch = []
+
+class Warehouse:
+    """SQLite database of ingested reports along with a ledger of what has been ingested
+
+    A warehouse can be shared by multiple threads; reports are ingested one at a time.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(LEDGER)
+        self._lock = threading.RLock()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def ingested(self, key):
+        """Return the checksum of an ingested report, or None if it hasn't been ingested"""
+
+        row = self.connection.execute('SELECT sha256 FROM reports WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _begin(self, reporttype, version, vendor):
+        # take the write lock of the database right away, so that no other process gets to use the same report id
+        self.connection.execute('BEGIN IMMEDIATE')
+        return Inserter(self.connection, reporttype, version, vendor)
+
+    def _end(self):
+        """Roll back what hasn't been committed and let the next report be ingested"""
+
+        if self.connection.in_transaction:
+            self.connection.rollback()
+        self._lock.release()
+
+    def _commit(self, inserter, key, digest):
+        """Replace a previously ingested version of the report unless it had the same content, and commit
+
+        Returns the number of rows ingested, or None if the report had been ingested already.
+        """
+
+        inserter.insert()
+        previous = self.connection.execute('SELECT id, sha256 FROM reports WHERE key = ?', (key,)).fetchone()
+        if previous and previous[1] == digest:
+            self.connection.rollback()
+            return None
+        if previous:
+            table = table_name(self.connection.execute('SELECT reporttype FROM reports WHERE id = ?', (previous[0],)).fetchone()[0])
+            self.connection.execute('DELETE FROM "%s" WHERE report = ?' % table, (previous[0],))
+            self.connection.execute('DELETE FROM reports WHERE id = ?', (previous[0],))
+        self.connection.execute('INSERT INTO reports (id, key, reporttype, vendor, sha256, rows, ingested) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                (inserter.report, key, inserter.reporttype, inserter.vendor, digest, inserter.rows,
+                                 datetime.datetime.now().isoformat(timespec='seconds')))
+        self.connection.execute('COMMIT')
+        return inserter.rows
+
+    def ingest(self, file, reporttype, version, vendor, key, sha256):
+        """Ingest a report read from a file object, identified by key and the checksum sha256 of its data in the ledger
+
+        Returns the number of rows ingested, or None if the report has been ingested with the same checksum already
+        (in which case the file isn't read at all).
+        """
+
+        self._lock.acquire()
+        try:
+            if self.ingested(key) == sha256:
+                return None
+            inserter = self._begin(reporttype, version, vendor)
+            if not isinstance(file, io.TextIOBase):
+                file = io.TextIOWrapper(file, encoding='utf-8', newline='')
+            inserter.add_lines(file)
+            return self._commit(inserter, key, sha256)
+        finally:
+            self._end()
+
+    def ingest_file(self, filename, reporttype, version = None, vendor = None, key = None, sha256 = None):
+        """Ingest a report file, identified by its file name in the ledger unless another key is given
+
+        Returns the number of rows ingested, or None if the report has been ingested with the same content already.
+        """
+
+        key = key or os.path.basename(filename)
+        with open(filename, encoding='utf-8', newline='') as file:
+            return self.ingest(file, reporttype, version, vendor or vendor_of(key) or vendor_of(filename), key, sha256 or cache.checksum(filename))
+
+    def ingest_cache(self, report_cache):
+        """Ingest all reports of a ReportCache whose types are known, identified by their file names
+
+        Returns a list of (key, rows) tuples, rows being None for reports which had been ingested already.
+        """
+
+        outcomes = []
+        for entry in report_cache.entries():
+            if not ingestible(entry['key']):
+                continue
+            reporttype, version = reports.report_type_of(entry['key'])
+            key = os.path.basename(entry['file'])
+            rows = self.ingest_file(report_cache.path(entry), reporttype, version, vendor_of(entry['key']), key, entry['sha256'])
+            outcomes.append((key, rows))
+        return outcomes
+
+    def ingest_archive(self, archive):
+        """Ingest all reports of an Archive whose types are known, like ingest_cache"""
+
+        outcomes = []
+        for entry in archive.entries():
+            if not ingestible(entry['key']):
+                continue
+            reporttype, version = reports.report_type_of(entry['key'])
+            key = entry['filename']
+            if self.ingested(key) == entry['sha256']:
+                rows = None
+            else:
+                with archive.open(entry['key']) as file:
+                    rows = self.ingest(file, reporttype, version, vendor_of(entry['key']), key, entry['sha256'])
+            outcomes.append((key, rows))
+        return outcomes
+
+    def stream(self, reporttype, version = None, vendor = None):
+        """Return a file-like destination ingesting a report while it is being downloaded (use it in a with block)"""
+
+        return Stream(self, reporttype, version, vendor)
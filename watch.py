@@ -0,0 +1,91 @@
+# Waiting for reports which haven't been published yet
+#
+# App Store Connect publishes the reports of a day at varying times the next morning (and financial
+# reports some weeks into the next fiscal period). Rather than running a command every hour until a
+# report turns up, watch() keeps all reports it is waiting for on a single event loop: each one is
+# requested right away and, as long as the reporter service answers that there is no report for the
+# period yet (a short 404 response, hardly more expensive than a status query), requested again after
+# a delay which doubles from interval up to max_interval, randomized so that the requests for many
+# watched reports are spread out. Reports of the same date are usually published together, so once
+# one of them is available, the others waiting for that date are requested again right away.
+#
+# Transient failures are waited out the same way (a circuit breaker of the client probes the service
+# with getStatus in the meantime), any other error ends watching a report. Downloads themselves run
+# on a pool of max_workers threads:
+#
+#     outcomes = watch.run(jobs, download, interval=300, max_interval=3600, max_wait=12 * 3600)
+
+import re, time, random, asyncio, concurrent.futures
+import retry
+
+# how the reporter service tells that a report hasn't been published (yet)
+NOT_YET_PATTERN = re.compile(r'no reports? (are )?available|not (yet )?(been )?(available|published)', re.I)
+
+def not_yet_available(error):
+    """Tell whether an error means that a report may still turn up later"""
+
+    return isinstance(error, retry.TransientError) or bool(NOT_YET_PATTERN.search(str(error)))
+
+class Watch:
+    """Request reports until they are available, backing off while waiting for them"""
+
+    def __init__(self, fetch, interval = 300.0, max_interval = 3600.0, max_wait = 12 * 3600.0, max_workers = 4, group = None, on_wait = None):
+        self.fetch = fetch
+        self.interval = interval
+        self.max_interval = max_interval
+        self.max_wait = max_wait
+        self.max_workers = max_workers
+        self.group = group or (lambda job: getattr(job, 'date', None))
+        self.on_wait = on_wait
+        self._published = {}
+
+    async def watch_all(self, jobs):
+        """Watch all jobs at once, returning the result or the exception each one ended with, in order"""
+
+        loop = asyncio.get_running_loop()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return await asyncio.gather(*[self.watch(job, loop, executor) for job in jobs], return_exceptions=True)
+
+    async def watch(self, job, loop, executor):
+        """Fetch a report as soon as it is available, or raise the error that keeps it from being fetched"""
+
+        deadline = time.monotonic() + self.max_wait
+        delay = self.interval
+        while True:
+            try:
+                result = await loop.run_in_executor(executor, self.fetch, job)
+            except ValueError as e:
+                if not not_yet_available(e):
+                    raise
+                # wait at least as long as the service asks to, and at most until the deadline
+                wait = max(random.uniform(delay / 2, delay), getattr(e, 'retry_after', None) or 0)
+                if time.monotonic() + wait > deadline:
+                    raise ValueError("Error: Gave up waiting for the report ({0})".format(str(e).strip()))
+                if self.on_wait:
+                    self.on_wait(job, wait, e)
+                await self._wait_for_group(job, wait)
+                delay = min(delay * 2, self.max_interval)
+                continue
+
+            published = self._published.pop(self.group(job), None)
+            if published:
+                published.set()
+            return result
+
+    async def _wait_for_group(self, job, timeout):
+        """Sleep for timeout seconds, or until a report of the same group is published"""
+
+        published = self._published.setdefault(self.group(job), asyncio.Event())
+        try:
+            await asyncio.wait_for(published.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+def run(jobs, fetch, **options):
+    """Watch jobs on a new event loop until each one has been fetched or given up on
+
+    Returns a list of (job, result, error) tuples, in the order of jobs.
+    """
+
+    outcomes = asyncio.run(Watch(fetch, **options).watch_all(jobs))
+    return [(job, None, outcome) if isinstance(outcome, BaseException) else (job, outcome, None) for job, outcome in zip(jobs, outcomes)]